@@ -1,4 +1,5 @@
 import os
+import sys
 from pathlib import Path
 import environ
 from datetime import timedelta
@@ -92,6 +93,26 @@ else:
         }
     }
 
+# --- CACHE ---
+# Кэш должен быть общим для веба и Celery-воркеров: ключи ответов, версия аналитики и статусы
+# рендера буклетов сбрасываются/пишутся в одном процессе, а читаются в другом.
+# Поэтому по умолчанию — тот же Redis, что у брокера Celery (CACHE_URL переопределяет).
+REDIS_URL = env('CELERY_BROKER_URL', default='redis://127.0.0.1:6379/0')
+
+if env('CACHE_URL', default=None):
+    CACHES = {'default': env.cache('CACHE_URL')}
+elif 'test' in sys.argv:
+    # manage.py test — один процесс, Redis не нужен
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+            'KEY_PREFIX': 'edtest',
+        }
+    }
+
 # --- PASSWORDS ---
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
@@ -191,9 +212,38 @@ CORS_ALLOW_CREDENTIALS = True
 CSRF_TRUSTED_ORIGINS = ['https://*.run.app'] # Доверяем доменам Cloud Run
 
 # --- CELERY ---
-CELERY_BROKER_URL = env('CELERY_BROKER_URL', default='redis://127.0.0.1:6379/0')
+CELERY_BROKER_URL = REDIS_URL
 CELERY_RESULT_BACKEND = 'django-db'
 CELERY_ACCEPT_CONTENT = ['application/json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
-CELERY_TIMEZONE = TIME_ZONE
\ No newline at end of file
+CELERY_TIMEZONE = TIME_ZONE
+
+# --- GRADER (OMR) ---
+# Сколько процессов проверяют пачку бланков (ZIP/PDF) параллельно
+GRADER_BATCH_WORKERS = env.int('GRADER_BATCH_WORKERS', default=os.cpu_count() or 2)
+# Сколько бланков обрабатывает одна Celery-задача (чанк) при фоновой проверке
+GRADER_CHUNK_SIZE = env.int('GRADER_CHUNK_SIZE', default=25)
+# Пороги закрашенности кружка (доля пикселей): ниже MIN — пусто;
+# второй кружок >= DOUBLE * лучший (и выше MIN) — двойная отметка
+GRADER_FILL_MIN_RATIO = env.float('GRADER_FILL_MIN_RATIO', default=0.5)
+GRADER_DOUBLE_MARK_RATIO = env.float('GRADER_DOUBLE_MARK_RATIO', default=0.8)
+# Debug-картинки проверки (media/grader_debug/): off | failure | sample | all
+GRADER_DEBUG_ARTIFACTS = env('GRADER_DEBUG_ARTIFACTS', default='off')
+GRADER_DEBUG_SAMPLE_RATE = env.float('GRADER_DEBUG_SAMPLE_RATE', default=0.02)
+
+# --- PROVISIONING (массовое создание учеников) ---
+# Сколько потоков хэшируют пароли (PBKDF2) при массовой выдаче логинов
+PROVISIONING_HASH_WORKERS = env.int('PROVISIONING_HASH_WORKERS', default=os.cpu_count() or 2)
+# Сколько секунд фоновый PDF с карточками доступа (пароли!) ждет скачивания, потом удаляется
+STUDENT_CARDS_TTL = env.int('STUDENT_CARDS_TTL', default=15 * 60)
+
+# --- ANALYTICS ---
+# Сколько секунд живут закэшированные дашборды/рейтинги (сбрасываются раньше при новых результатах)
+ANALYTICS_CACHE_TIMEOUT = env.int('ANALYTICS_CACHE_TIMEOUT', default=60 * 60)
+
+# --- BOOKLETS (PDF) ---
+# Сколько буклетов рендерит одна Celery-задача при фоновом пре-рендере после генерации вариантов
+BOOKLET_RENDER_CHUNK_SIZE = env.int('BOOKLET_RENDER_CHUNK_SIZE', default=4)
+# Сколько секунд буклет может висеть в статусе "rendering" (потом считается не начатым)
+BOOKLET_RENDER_TIMEOUT = env.int('BOOKLET_RENDER_TIMEOUT', default=60 * 60)
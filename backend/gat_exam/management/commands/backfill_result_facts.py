@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+
+from gat_exam.models import ExamResult
+from gat_exam.services.result_facts import ResultFactsService
+
+
+class Command(BaseCommand):
+    help = 'Заполняет факт-таблицы аналитики (SubjectScore, QuestionResponse) из ExamResult.details для уже сохраненных результатов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=ResultFactsService.BATCH_SIZE,
+                            help='Сколько результатов пересчитывать за раз')
+        parser.add_argument('--exam', type=int, action='append', dest='exams',
+                            help='Только результаты этих экзаменов (можно несколько раз)')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        queryset = ExamResult.objects.only('id', 'student_id', 'exam_id', 'details').order_by('id')
+        if options['exams']:
+            queryset = queryset.filter(exam_id__in=options['exams'])
+
+        total = queryset.count()
+        self.stdout.write(f"🚀 Пересчет факт-таблиц аналитики: {total} результатов...")
+
+        contexts = {}
+        batch, done, scores, responses = [], 0, 0, 0
+        for result in queryset.iterator(chunk_size=batch_size):
+            batch.append(result)
+            if len(batch) >= batch_size:
+                s, r = self._flush(batch, contexts)
+                scores, responses, done = scores + s, responses + r, done + len(batch)
+                batch = []
+                self.stdout.write(f"   ... {done}/{total}")
+
+        if batch:
+            s, r = self._flush(batch, contexts)
+            scores, responses, done = scores + s, responses + r, done + len(batch)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ Готово: {done} результатов, {scores} строк SubjectScore, {responses} строк QuestionResponse"
+        ))
+
+    def _flush(self, batch, contexts):
+        # Карты вопросов кэшируем между пачками: экзаменов намного меньше, чем результатов
+        missing = {r.exam_id for r in batch} - contexts.keys()
+        if missing:
+            contexts.update(ResultFactsService.exam_contexts(missing))
+        return ResultFactsService.rebuild(batch, contexts)
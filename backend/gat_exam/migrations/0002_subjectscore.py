@@ -0,0 +1,29 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gat_exam', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SubjectScore',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('correct', models.PositiveIntegerField(default=0, verbose_name='Верных ответов')),
+                ('total', models.PositiveIntegerField(default=0, verbose_name='Всего вопросов')),
+                ('result', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='subject_scores', to='gat_exam.examresult')),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='subject_scores', to='gat_exam.student')),
+                ('subject', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='scores', to='gat_exam.subject')),
+            ],
+            options={
+                'verbose_name': 'Балл по предмету',
+                'verbose_name_plural': 'Баллы по предметам',
+                'indexes': [models.Index(fields=['subject', 'student'], name='gat_exam_su_subject_81befa_idx'), models.Index(fields=['student', 'subject'], name='gat_exam_su_student_080c7c_idx')],
+                'unique_together': {('result', 'subject')},
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gat_exam', '0002_subjectscore'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuestionResponse',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('booklet_num', models.PositiveSmallIntegerField(verbose_name='Номер в буклете')),
+                ('chosen', models.CharField(blank=True, max_length=1, verbose_name='Выбранный ответ')),
+                ('is_correct', models.BooleanField(default=False, verbose_name='Верно?')),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='responses', to='gat_exam.question')),
+                ('result', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='responses', to='gat_exam.examresult')),
+            ],
+            options={
+                'verbose_name': 'Ответ на вопрос',
+                'verbose_name_plural': 'Ответы на вопросы',
+                'indexes': [models.Index(fields=['question', 'is_correct'], name='gat_exam_qu_questio_80f908_idx'), models.Index(fields=['result', 'booklet_num'], name='gat_exam_qu_result__479dd4_idx')],
+                'unique_together': {('result', 'question')},
+            },
+        ),
+    ]
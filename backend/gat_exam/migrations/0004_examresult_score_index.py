@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gat_exam', '0003_questionresponse'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='examresult',
+            index=models.Index(fields=['score', 'id'], name='gat_exam_ex_score_580f95_idx'),
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gat_exam', '0004_examresult_score_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='exam',
+            name='variant',
+            field=models.CharField(choices=[('A', 'Вариант А (Master)'), ('B', 'Вариант Б (Shuffled)'), ('C', 'Вариант В (Shuffled)'), ('D', 'Вариант Г (Shuffled)')], db_index=True, default='A', max_length=1, verbose_name='Вариант'),
+        ),
+    ]
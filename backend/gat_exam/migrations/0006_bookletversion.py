@@ -0,0 +1,33 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gat_exam', '0005_exam_variant_choices'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookletVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(max_length=64, unique=True, verbose_name='Хэш содержимого')),
+                ('grade_level', models.IntegerField(verbose_name='Параллель')),
+                ('gat_day', models.IntegerField(default=1, verbose_name='День экзамена')),
+                ('variant', models.CharField(max_length=1, verbose_name='Вариант')),
+                ('question_order', models.JSONField(default=dict, verbose_name='Порядок вопросов (Shuffle Map)')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Версия буклета',
+                'verbose_name_plural': 'Версии буклетов',
+            },
+        ),
+        migrations.AddField(
+            model_name='exam',
+            name='booklet',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='exams', to='gat_exam.bookletversion', verbose_name='Версия буклета'),
+        ),
+    ]
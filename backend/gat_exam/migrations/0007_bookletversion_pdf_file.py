@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gat_exam', '0006_bookletversion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bookletversion',
+            name='generated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='bookletversion',
+            name='pdf_file',
+            field=models.FileField(blank=True, null=True, upload_to='booklets/pdf/', verbose_name='Файл буклета'),
+        ),
+    ]
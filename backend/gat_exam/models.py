@@ -237,10 +237,12 @@ class Exam(models.Model):
         (2, 'День 2'),
     )
 
-    # 🔥 ДВА ВАРИАНТА
+    # 🔥 ВАРИАНТЫ: А — мастер (порядок эксперта), остальные — детерминированно перемешаны
     VARIANT_CHOICES = (
         ('A', 'Вариант А (Master)'),
         ('B', 'Вариант Б (Shuffled)'),
+        ('C', 'Вариант В (Shuffled)'),
+        ('D', 'Вариант Г (Shuffled)'),
     )
     
     # Основные данные
@@ -270,6 +272,12 @@ class Exam(models.Model):
         blank=True,
         help_text="Критично для Варианта Б! Хранит соответствие: Номер в буклете -> ID вопроса"
     )
+    # Сгенерированные варианты ссылаются на общую версию буклета (одна на все школы),
+    # тогда своя question_order пустая — см. order_map
+    booklet = models.ForeignKey(
+        'BookletVersion', on_delete=models.PROTECT, null=True, blank=True,
+        related_name='exams', verbose_name="Версия буклета"
+    )
 
     # Настройки Раунда
     gat_round = models.IntegerField(choices=GAT_ROUNDS, default=1, verbose_name="Номер GAT")
@@ -299,6 +307,13 @@ class Exam(models.Model):
     def __str__(self):
         return f"{self.title} [Grade {self.grade_level}] [Var {self.variant}]"
 
+    @property
+    def order_map(self):
+        """Карта буклета: из общей версии (BookletVersion), иначе собственная question_order."""
+        if self.booklet_id:
+            return self.booklet.question_order
+        return self.question_order or {}
+
 
 # --- 4. МОДЕЛЬ ВОПРОСА ---
 class Question(models.Model):
@@ -501,11 +516,68 @@ class ExamResult(models.Model):
 
     class Meta:
         unique_together = ('student', 'exam')
+        indexes = [
+            # Рейтинг: ORDER BY score DESC, id DESC + keyset-курсор (score, id)
+            models.Index(fields=['score', 'id']),
+        ]
 
     def __str__(self):
         return f"{self.student} - {self.exam}: {self.score}"
 
 
+# --- 10.1. БАЛЛЫ ПО ПРЕДМЕТАМ (факт-таблица для аналитики) ---
+class SubjectScore(models.Model):
+    """
+    Разбивка ExamResult по предметам: сколько верных из скольки.
+    Заполняется при проверке (GraderService, ImportService) из details,
+    для старых результатов — командой backfill_result_facts.
+    """
+    result = models.ForeignKey(ExamResult, on_delete=models.CASCADE, related_name='subject_scores')
+    student = models.ForeignKey(Student, on_delete=models.CASCADE, related_name='subject_scores')
+    subject = models.ForeignKey(Subject, on_delete=models.CASCADE, related_name='scores')
+
+    correct = models.PositiveIntegerField(default=0, verbose_name="Верных ответов")
+    total = models.PositiveIntegerField(default=0, verbose_name="Всего вопросов")
+
+    class Meta:
+        verbose_name = "Балл по предмету"
+        verbose_name_plural = "Баллы по предметам"
+        unique_together = ('result', 'subject')
+        indexes = [
+            models.Index(fields=['subject', 'student']),
+            models.Index(fields=['student', 'subject']),
+        ]
+
+    def __str__(self):
+        return f"{self.student} - {self.subject}: {self.correct}/{self.total}"
+
+
+# --- 10.2. ОТВЕТЫ НА ВОПРОСЫ (факт-таблица для анализа заданий) ---
+class QuestionResponse(models.Model):
+    """
+    Один ответ ученика на один вопрос: тепловые карты и статистика заданий
+    считаются GROUP BY по этой таблице, без разбора ExamResult.details.
+    """
+    result = models.ForeignKey(ExamResult, on_delete=models.CASCADE, related_name='responses')
+    question = models.ForeignKey(Question, on_delete=models.CASCADE, related_name='responses')
+
+    booklet_num = models.PositiveSmallIntegerField(verbose_name="Номер в буклете")
+    chosen = models.CharField(max_length=1, blank=True, verbose_name="Выбранный ответ")  # '' — пусто, '*' — несколько
+    is_correct = models.BooleanField(default=False, verbose_name="Верно?")
+
+    class Meta:
+        verbose_name = "Ответ на вопрос"
+        verbose_name_plural = "Ответы на вопросы"
+        unique_together = ('result', 'question')
+        indexes = [
+            models.Index(fields=['question', 'is_correct']),
+            models.Index(fields=['result', 'booklet_num']),
+        ]
+
+    def __str__(self):
+        return f"{self.result_id} #{self.booklet_num}: {self.chosen or '-'}"
+
+
 # --- 11. ГЛОБАЛЬНЫЕ НАСТРОЙКИ ---
 class GlobalSettings(models.Model):
     site_name = models.CharField("Название платформы", max_length=100, default="GAT Premium Platform")
@@ -716,6 +788,31 @@ class MasterBooklet(models.Model):
         return f"Booklet for {self.round.name}"
 
 
+class BookletVersion(models.Model):
+    """
+    Содержимое одного варианта буклета ("Умная карта"), общее для всех школ.
+    Адресуется хэшем карты: одинаковый буклет = одна строка, сколько бы школ его ни писали.
+    Строка не меняется — новая карта дает новый хэш и новую версию.
+    """
+    content_hash = models.CharField(max_length=64, unique=True, verbose_name="Хэш содержимого")
+    grade_level = models.IntegerField(verbose_name="Параллель")
+    gat_day = models.IntegerField(default=1, verbose_name="День экзамена")
+    variant = models.CharField(max_length=1, verbose_name="Вариант")
+    question_order = models.JSONField(default=dict, verbose_name="Порядок вопросов (Shuffle Map)")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    # Готовый PDF (см. BookletPdfService): путь по хэшу содержимого страницы
+    generated_at = models.DateTimeField(null=True, blank=True)
+    pdf_file = models.FileField(upload_to='booklets/pdf/', null=True, blank=True, verbose_name="Файл буклета")
+
+    class Meta:
+        verbose_name = "Версия буклета"
+        verbose_name_plural = "Версии буклетов"
+
+    def __str__(self):
+        return f"{self.grade_level} кл - День {self.gat_day} - Вар {self.variant} [{self.content_hash[:8]}]"
+
+
 class QuestionHistory(models.Model):
     question = models.ForeignKey('Question', on_delete=models.CASCADE, related_name='usage_history')
     round = models.ForeignKey(ExamRound, on_delete=models.CASCADE)
@@ -0,0 +1,48 @@
+import hashlib
+import json
+import time
+from django.conf import settings
+from django.core.cache import cache
+
+# Номер "поколения" данных аналитики. Ключи ответов включают его,
+# поэтому сброс = инкремент одного счетчика (без перебора ключей по фильтрам)
+VERSION_KEY = "analytics_version"
+
+
+class AnalyticsCache:
+    """
+    🗄️ КЭШ ТЯЖЕЛЫХ ОТВЕТОВ АНАЛИТИКИ (дашборды, рейтинги)
+
+    Ответ кэшируется по имени + нормализованному набору фильтров.
+    Как только появляются/меняются результаты (ExamResult, факт-таблицы),
+    invalidate() увеличивает версию, и все старые ключи перестают читаться
+    (а сами истекают по ANALYTICS_CACHE_TIMEOUT).
+    """
+
+    @staticmethod
+    def version():
+        return cache.get_or_set(VERSION_KEY, time.time_ns, timeout=None)
+
+    @staticmethod
+    def key(name, params):
+        raw = json.dumps(params, sort_keys=True, default=str)
+        digest = hashlib.md5(raw.encode()).hexdigest()
+        return f"analytics_{name}_v{AnalyticsCache.version()}_{digest}"
+
+    @staticmethod
+    def get_or_build(name, params, builder):
+        """Ответ из кэша, при промахе — builder() и запись в кэш."""
+        cache_key = AnalyticsCache.key(name, params)
+        data = cache.get(cache_key)
+        if data is None:
+            data = builder()
+            cache.set(cache_key, data, timeout=settings.ANALYTICS_CACHE_TIMEOUT)
+        return data
+
+    @staticmethod
+    def invalidate():
+        try:
+            cache.incr(VERSION_KEY)
+        except ValueError:
+            # Счетчика нет (вытеснили) — новое поколение от времени, чтобы не совпасть со старыми ключами
+            cache.set(VERSION_KEY, time.time_ns(), timeout=None)
@@ -0,0 +1,227 @@
+import hashlib
+import json
+import mimetypes
+from functools import lru_cache
+from urllib.parse import urlsplit, unquote
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.template.loader import get_template, render_to_string
+from django.utils import timezone
+
+# WeasyPrint (PDF движок)
+try:
+    import weasyprint
+except ImportError:
+    weasyprint = None
+
+TEMPLATE_NAME = 'booklet_pdf.html'
+
+# Поднять, если меняется сам рендер (не шаблон — его текст уже входит в хэш)
+RENDER_VERSION = 1
+
+# Папка готовых PDF в media: booklets/pdf/<хэш>.pdf
+PDF_FOLDER = 'booklets/pdf'
+
+# Флаг "PDF версии буклета рендерится в фоне" (ставит booklet_prerender_task)
+RENDERING_KEY = "booklet_pdf_rendering_{}"
+
+# База для относительных ссылок, если рендер идет вне запроса (Celery).
+# Хост не важен: картинки media читает MediaFetcher из хранилища по пути
+FALLBACK_BASE_URL = 'http://localhost/'
+
+
+@lru_cache(maxsize=1)
+def _template_fingerprint():
+    source = get_template(TEMPLATE_NAME).template.source
+    return hashlib.sha256(f"{RENDER_VERSION}:{source}".encode()).hexdigest()
+
+
+def media_name(url):
+    """Имя файла в default_storage по URL картинки (/media/... или URL бакета) или None, если это не media."""
+    prefix = urlsplit(settings.MEDIA_URL).path
+    path = urlsplit(url).path
+    if prefix and path.startswith(prefix):
+        return unquote(path[len(prefix):])
+    return None
+
+
+class MediaFetcher:
+    """
+    url_fetcher для WeasyPrint: картинки вопросов/ответов читаются прямо из default_storage,
+    без HTTP и без зависимости от base_url. Ненайденные файлы копятся в missing.
+    """
+
+    def __init__(self):
+        self.missing = []
+
+    def __call__(self, url):
+        name = media_name(url)
+        if name is None:
+            return weasyprint.default_url_fetcher(url)
+        try:
+            with default_storage.open(name, 'rb') as f:
+                data = f.read()
+        except Exception:
+            self.missing.append(name)
+            raise
+        return {"string": data, "mime_type": mimetypes.guess_type(name)[0], "redirected_url": url}
+
+
+class BookletPdfService:
+    """
+    📚 PDF БУКЛЕТОВ С КЭШЕМ В ХРАНИЛИЩЕ (content-addressed)
+
+    PDF адресуется хэшем всего, что попадает в страницу: карта буклета (порядок вопросов
+    и вариантов ответа), тексты/картинки вопросов и ответов, шапка экзамена и версия шаблона.
+    Один и тот же буклет (разные школы, разные учителя) рендерится WeasyPrint один раз,
+    дальше отдается из media. Изменили вопрос или шаблон — хэш другой, PDF рендерится заново.
+    """
+
+    @staticmethod
+    def build_sections(exam):
+        """Вопросы экзамена в порядке буклета, сгруппированные по предметам (для шаблона)."""
+        order_map = exam.order_map
+        all_questions = list(exam.questions.select_related('topic__subject').prefetch_related('choices'))
+        q_lookup = {q.id: q for q in all_questions}
+
+        ordered_questions = []
+        if order_map:
+            for key in sorted(order_map.keys(), key=lambda x: int(x)):
+                item = order_map[key]
+                if isinstance(item, dict):
+                    q_id = item.get('id')
+                    custom_choices_order = item.get('choices', [])
+                else:
+                    q_id = item
+                    custom_choices_order = []
+
+                question = q_lookup.get(q_id)
+                if question:
+                    # Подменяем порядок ответов для PDF
+                    choices = list(question.choices.all())
+                    if custom_choices_order:
+                        c_lookup = {c.id: c for c in choices}
+                        question.pdf_choices = [c_lookup[c_id] for c_id in custom_choices_order if c_id in c_lookup]
+                    else:
+                        question.pdf_choices = choices
+                    ordered_questions.append(question)
+        else:
+            ordered_questions = all_questions
+            for q in ordered_questions:
+                q.pdf_choices = list(q.choices.all())
+
+        # Группировка для PDF
+        sections = []
+        current_subject = None
+        current_questions = []
+        for q in ordered_questions:
+            subj_name = q.topic.subject.name if (q.topic and q.topic.subject) else "General"
+            if subj_name != current_subject:
+                if current_subject:
+                    sections.append({'subject': current_subject, 'questions': list(current_questions)})
+                current_subject = subj_name
+                current_questions = []
+            current_questions.append(q)
+
+        if current_subject:
+            sections.append({'subject': current_subject, 'questions': current_questions})
+        return sections
+
+    @staticmethod
+    def context(exam, sections):
+        return {
+            'exam': exam,
+            'variant': exam.variant,
+            'sections': sections,
+            'date': exam.date or "2026",
+        }
+
+    @staticmethod
+    def fingerprint(exam, sections):
+        """sha256 содержимого страницы (см. docstring класса)."""
+        content = {
+            "template": _template_fingerprint(),
+            "header": [exam.title, exam.variant, exam.grade_level, exam.gat_round, str(exam.date or "2026")],
+            "sections": [
+                [section['subject'], [
+                    [q.id, q.text, q.image.name if q.image else '',
+                     [[c.id, c.text, c.image.name if c.image else ''] for c in q.pdf_choices]]
+                    for q in section['questions']
+                ]]
+                for section in sections
+            ],
+        }
+        raw = json.dumps(content, ensure_ascii=False, separators=(',', ':'))
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    @staticmethod
+    def render_html(exam, sections=None):
+        if sections is None:
+            sections = BookletPdfService.build_sections(exam)
+        return render_to_string(TEMPLATE_NAME, BookletPdfService.context(exam, sections))
+
+    @staticmethod
+    def get_or_render(exam, base_url=None):
+        """
+        Путь готового PDF в хранилище: берет существующий по хэшу или рендерит и сохраняет.
+        Путь записывается в версию буклета (BookletVersion.pdf_file / generated_at).
+        base_url нужен только для не-media ссылок шаблона: картинки читает MediaFetcher.
+        Возвращает (путь, отрендерен ли сейчас).
+        """
+        if weasyprint is None:
+            raise RuntimeError("WeasyPrint не установлен")
+
+        sections = BookletPdfService.build_sections(exam)
+        path = f"{PDF_FOLDER}/{BookletPdfService.fingerprint(exam, sections)}.pdf"
+
+        rendered = False
+        if not default_storage.exists(path):
+            html_string = BookletPdfService.render_html(exam, sections)
+            fetcher = MediaFetcher()
+            pdf_bytes = weasyprint.HTML(
+                string=html_string, base_url=base_url or FALLBACK_BASE_URL, url_fetcher=fetcher
+            ).write_pdf()
+            # PDF без картинок не кэшируем: под тем же хэшем его отдавали бы всем и всегда
+            if fetcher.missing:
+                raise RuntimeError(f"Не найдены картинки буклета: {', '.join(fetcher.missing)}")
+            path = default_storage.save(path, ContentFile(pdf_bytes))
+            rendered = True
+
+        booklet = exam.booklet if exam.booklet_id else None
+        if booklet is not None and booklet.pdf_file.name != path:
+            booklet.pdf_file.name = path
+            booklet.generated_at = timezone.now()
+            booklet.save(update_fields=['pdf_file', 'generated_at'])
+        return path, rendered
+
+    # --- Статус фонового рендера (для каталога) ---
+
+    @staticmethod
+    def mark_rendering(booklet_ids):
+        """Флаги живут не дольше BOOKLET_RENDER_TIMEOUT: упавший воркер не оставит вечный "rendering"."""
+        cache.set_many(
+            {RENDERING_KEY.format(b_id): True for b_id in booklet_ids},
+            timeout=settings.BOOKLET_RENDER_TIMEOUT
+        )
+
+    @staticmethod
+    def clear_rendering(booklet_id):
+        cache.delete(RENDERING_KEY.format(booklet_id))
+
+    @staticmethod
+    def rendering_ids(booklet_ids):
+        """Какие из версий буклетов сейчас в очереди/в рендере (один запрос к кэшу)."""
+        keys = {RENDERING_KEY.format(b_id): b_id for b_id in booklet_ids}
+        return {keys[key] for key in cache.get_many(list(keys))}
+
+    @staticmethod
+    def status(exam, rendering=()):
+        """ready — PDF уже в хранилище, rendering — рендерится в фоне, pending — отрендерится при скачивании."""
+        booklet = exam.booklet if exam.booklet_id else None
+        if booklet is not None and booklet.pdf_file:
+            return 'ready'
+        if exam.booklet_id in rendering:
+            return 'rendering'
+        return 'pending'
@@ -0,0 +1,106 @@
+import os
+import cv2
+import uuid
+import random
+import logging
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Режимы GRADER_DEBUG_ARTIFACTS:
+# 'off'     -> ничего не сохраняем (прод по умолчанию)
+# 'failure' -> только проблемные бланки (ошибка, нет выравнивания, двойные отметки)
+# 'sample'  -> проблемные + случайная доля GRADER_DEBUG_SAMPLE_RATE остальных
+# 'all'     -> каждый бланк
+DEBUG_MODES = ('off', 'failure', 'sample', 'all')
+
+# Запись в хранилище идет в фоне, чтобы не тормозить проверку.
+# Пул потоков создается лениво и свой в каждом процессе: после fork унаследованный пул без потоков
+_writer = None
+_writer_pid = None
+
+
+def _get_writer():
+    global _writer, _writer_pid
+    if _writer is None or _writer_pid != os.getpid():
+        _writer = ThreadPoolExecutor(max_workers=2, thread_name_prefix='grader-debug')
+        _writer_pid = os.getpid()
+    return _writer
+
+
+def _in_pool_worker():
+    """Процесс ProcessPoolExecutor (process_batch): завершается через os._exit, очередь записи не дождется."""
+    return multiprocessing.parent_process() is not None
+
+
+def _write_image(path, image):
+    try:
+        ok, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 80])
+        if ok:
+            default_storage.save(path, ContentFile(buffer.tobytes()))
+    except Exception as e:
+        logger.warning(f"Не удалось сохранить debug-картинку {path}: {e}")
+
+
+class ScanDebug:
+    """
+    Собирает debug-картинки одного бланка и решает, сохранять ли их.
+    Картинки держатся по ссылке (без копий), пока не станет ясен исход проверки.
+    """
+
+    def __init__(self, mode=None):
+        self.mode = mode or settings.GRADER_DEBUG_ARTIFACTS
+        if self.mode not in DEBUG_MODES:
+            self.mode = 'off'
+        self.scan_id = uuid.uuid4().hex
+        self.images = {}
+        self.failed = False
+        # Выборку решаем заранее: если бланк не попал в нее, оверлеи можно не рисовать
+        self.sampled = self.mode == 'all' or (
+            self.mode == 'sample' and random.random() < settings.GRADER_DEBUG_SAMPLE_RATE
+        )
+
+    @property
+    def enabled(self):
+        return self.mode != 'off'
+
+    @property
+    def will_save(self):
+        """Попадут ли картинки в хранилище (тогда есть смысл рисовать разметку ответов)."""
+        return self.enabled and (self.sampled or self.failed)
+
+    def add(self, name, image):
+        if self.enabled and image is not None:
+            self.images[name] = image
+
+    def mark_failed(self):
+        self.failed = True
+
+    def flush(self, failed=False):
+        """
+        Ставит запись картинок в фоновую очередь (media: grader_debug/<дата>/<scan_id>_<имя>.jpg).
+        Возвращает пути сразу, не дожидаясь записи.
+        В процессе пула пакетной проверки пишет сразу (синхронно) — иначе картинки теряются при выходе воркера.
+        """
+        failed = failed or self.failed
+        if not self.images or not (self.sampled or failed):
+            return []
+
+        folder = f"grader_debug/{timezone.now():%Y-%m-%d}"
+        sync = _in_pool_worker()
+        paths = []
+        for name, image in self.images.items():
+            path = f"{folder}/{self.scan_id}_{name}.jpg"
+            if sync:
+                _write_image(path, image)
+            else:
+                _get_writer().submit(_write_image, path, image)
+            paths.append(path)
+
+        self.images = {}
+        return paths
@@ -1,72 +1,90 @@
 import cv2
 import numpy as np
+import io
 import json
-from ..models import Student, Exam, ExamResult
+import multiprocessing
+import zipfile
+import django
+from collections import defaultdict
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from ..models import Student, Exam, ExamResult, Choice
+from .omr_engine import BubbleFillEngine, DOUBLE_MARK, OPTIONS
+from . import sheet_layout
+from .grader_debug import ScanDebug
+from .result_facts import ResultFactsService
+
+# Форматы картинок, которые берем из ZIP-архива со сканами
+BATCH_IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp')
+
+# Скомпилированный ключ ответов экзамена живет в кэше сутки (сбрасывается сигналами)
+ANSWER_KEY_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Сколько страниц PDF растеризуем за один вызов pdf2image (ограничивает память)
+PDF_PAGES_PER_CHUNK = 10
+
+# Процессы пула не fork-аются от веб-воркера: у gunicorn он многопоточный, и fork скопировал бы
+# чужие соединения с БД и захваченные другими потоками локи. forkserver (или spawn, где его нет)
+# запускает чистые процессы, поэтому каждому нужен свой django.setup()
+POOL_CONTEXT = multiprocessing.get_context(
+    'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+)
+
+# pyzbar (libzbar) читает QR в разы быстрее OpenCV, но системной библиотеки может не быть
+try:
+    from pyzbar.pyzbar import decode as zbar_decode, ZBarSymbol
+except Exception:
+    zbar_decode = None
+
+
+@lru_cache(maxsize=1)
+def _qr_detector():
+    """Один cv2.QRCodeDetector на процесс (веб-воркер, процесс пула или Celery)."""
+    return cv2.QRCodeDetector()
+
+
+def _read_sheet_worker(index, name, payload):
+    """
+    Точка входа для процесса пула (ProcessPoolExecutor).
+    Выполняет только CV-этапы (выравнивание, QR, кружки), запись в БД делает главный процесс.
+    """
+    sheet = GraderService.read_sheet(payload)
+    sheet.update({"index": index, "file": name})
+    return sheet
+
 
 class GraderService:
     
-    # Константы для поиска (подбирал под A4 и твои якоря)
-    A4_WIDTH_PX = 1240   # Ширина, к которой приводим скан
-    A4_HEIGHT_PX = 1754  # Высота A4 при 150 DPI
-    
-    # Координаты центров якорей на идеальном листе (в PDF координатах, переведенных в пиксели)
-    # PDF: A4 (595x842 pt). Якоря: (30,30), (W-40,30), (30, H-40). QR: (W-80, H-80).
-    # Масштабируем их к 1240x1754
-    SCALE = A4_WIDTH_PX / 595.27
-    
+    # Геометрия листа живет в sheet_layout (ее же рисует PDFGenerator)
+    A4_WIDTH_PX = sheet_layout.A4_WIDTH_PX    # Ширина, к которой приводим скан
+    A4_HEIGHT_PX = sheet_layout.A4_HEIGHT_PX  # Высота A4 при 150 DPI
+    SCALE = sheet_layout.SCALE_PX
+
     # Целевые точки (куда мы хотим притянуть найденные маркеры)
     # Порядок: [Top-Left, Top-Right (QR), Bottom-Right, Bottom-Left]
-    DST_PTS = np.array([
-        [35 * SCALE, 35 * SCALE],                # TL (Якорь Верх-Лево)
-        [515 * SCALE, 80 * SCALE],               # TR (Центр QR-кода)
-        [560 * SCALE, 1719 * SCALE],             # BR (Якорь Низ-Право)
-        [35 * SCALE, 1719 * SCALE]               # BL (Якорь Низ-Лево)
-    ], dtype="float32")
+    DST_PTS = sheet_layout.alignment_points_px()
 
     @staticmethod
     def process_scan(file_obj):
         try:
-            # 1. Читаем файл в OpenCV
-            file_bytes = np.frombuffer(file_obj.read(), np.uint8)
-            original_image = cv2.imdecode(file_bytes, cv2.IMREAD_COLOR)
-
-            if original_image is None: 
-                return {"status": "error", "message": "Не удалось прочитать изображение."}
-
-            print("📸 [1] Фото загружено. Начинаю выравнивание...")
-
-            # 2. ВЫРАВНИВАНИЕ (Perspective Transform)
-            aligned_image, debug_align_path = GraderService.align_image(original_image)
-            
-            # Если выравнивание не удалось, пробуем работать с оригиналом (на страх и риск)
-            image_to_scan = aligned_image if aligned_image is not None else original_image
-
-            # 3. Ищем QR-код (теперь на ровном фото это легче)
-            qr_data, _ = GraderService.find_qr_code(image_to_scan)
-            
-            if not qr_data: 
-                # Если не нашли на ровном, пробуем на оригинале (вдруг при выравнивании обрезали)
-                qr_data, _ = GraderService.find_qr_code(original_image)
-                if not qr_data:
-                    return {"status": "error", "message": "QR-код не найден. Убедитесь, что фото четкое."}
+            # 1. Читаем файл в OpenCV и прогоняем CV-этапы
+            sheet = GraderService.read_sheet(file_obj.read())
+            if sheet["status"] == "error":
+                return {"status": "error", "message": sheet["message"]}
 
             try:
-                data = json.loads(qr_data)
-                student = Student.objects.get(id=data.get('uid'))
-                exam = Exam.objects.get(id=data.get('eid'))
-            except Exception:
+                student = Student.objects.get(id=sheet["uid"])
+                exam = Exam.objects.get(id=sheet["eid"])
+            except (Student.DoesNotExist, Exam.DoesNotExist):
                 return {"status": "error", "message": "Неверный формат данных в QR-коде."}
 
-            # 4. РАСПОЗНАВАНИЕ ОТВЕТОВ
-            print(f"👀 [2] Сканирую ответы студента: {student.last_name_ru}")
-            # Берем кол-во вопросов из экзамена, или 20 по умолчанию
-            q_count = exam.questions.count() or 20
-            
-            student_answers, debug_scan_path = GraderService.recognize_answers(image_to_scan, q_count)
-            print(f"✅ [3] Распознано ответов: {len(student_answers)}")
+            print(f"✅ [3] Распознано ответов ({student.last_name_ru}): {len(sheet['answers'])}")
 
             # 5. РАСЧЕТ И СОХРАНЕНИЕ
-            result_obj = GraderService.calculate_and_save(student, exam, student_answers)
+            result_obj = GraderService.calculate_and_save(student, exam, sheet["answers"])
 
             return {
                 "status": "success",
@@ -76,7 +94,7 @@ class GraderService:
                     "exam": exam.title,
                     "score": result_obj.score,
                     "percent": result_obj.percentage,
-                    "debug_files": [debug_align_path, debug_scan_path]
+                    "debug_files": sheet["debug_files"]
                 }
             }
 
@@ -85,11 +103,312 @@ class GraderService:
             return {"status": "error", "message": f"Системная ошибка: {str(e)}"}
 
     @staticmethod
-    def align_image(image):
+    def read_sheet(payload):
+        """
+        CV-часть проверки одного бланка: декодирование, QR, выравнивание и кружки.
+        Принимает байты файла или уже готовый BGR-массив (страница PDF).
+        В БД только читает количество вопросов, поэтому безопасна для процессов пула.
+
+        Возвращает dict: status ('ok'/'error'), message, uid, eid, answers, debug_files.
+        debug_files — пути debug-картинок в media (см. GRADER_DEBUG_ARTIFACTS), обычно пусто.
+        Исключения CV (битая/нестандартная страница) не выходят наружу: лист вернется со status='error',
+        и остальная пачка проверится как обычно.
+        """
+        debug = ScanDebug()
+        try:
+            sheet = GraderService._read_sheet(payload, debug)
+        except Exception as e:
+            print(f"❌ Ошибка чтения бланка: {e}")
+            sheet = {"status": "error", "message": f"Системная ошибка: {str(e)}", "uid": None, "eid": None, "answers": {}}
+        sheet["debug_files"] = debug.flush(failed=sheet["status"] != "ok")
+        return sheet
+
+    @staticmethod
+    def _read_sheet(payload, debug):
+        sheet = {"status": "error", "message": "", "uid": None, "eid": None, "answers": {}}
+
+        if isinstance(payload, np.ndarray):
+            original_image = payload
+        else:
+            file_bytes = np.frombuffer(payload, np.uint8)
+            original_image = cv2.imdecode(file_bytes, cv2.IMREAD_COLOR)
+
+        if original_image is None:
+            sheet["message"] = "Не удалось прочитать изображение."
+            return sheet
+
+        debug.add("original", original_image)
+
+        print("📸 [1] Фото загружено. Ищу QR-код...")
+
+        # 2. QR-код: ОДИН проход — данные идут на идентификацию, углы — на выравнивание
+        qr_data, qr_points = GraderService.detect_qr(original_image)
+        if not qr_data:
+            sheet["message"] = "QR-код не найден. Убедитесь, что фото четкое."
+            return sheet
+
+        # 3. ВЫРАВНИВАНИЕ (Perspective Transform)
+        aligned_image = GraderService.align_image(original_image, qr_points, debug)
+
+        # Если выравнивание не удалось, пробуем работать с оригиналом (на страх и риск)
+        image_to_scan = aligned_image if aligned_image is not None else original_image
+
+        try:
+            data = json.loads(qr_data)
+            sheet["uid"] = int(data.get('uid'))
+            sheet["eid"] = int(data.get('eid'))
+        except Exception:
+            sheet["message"] = "Неверный формат данных в QR-коде."
+            return sheet
+
+        # 4. РАСПОЗНАВАНИЕ ОТВЕТОВ
+        # Берем кол-во вопросов из экзамена (ключ ответов из кэша), или 20 по умолчанию
+        q_count = len(GraderService.get_answer_key(sheet["eid"])["keys"]) or 20
+
+        # На выровненном листе кружки читаем по известной сетке (версия — в QR),
+        # без выравнивания — ищем контуры как раньше
+        layout = sheet_layout.get_layout(data.get('l')) if aligned_image is not None else None
+
+        student_answers = GraderService.recognize_answers(image_to_scan, q_count, layout, debug)
+
+        sheet.update({"status": "ok", "answers": student_answers})
+        return sheet
+
+    # =========================================================================
+    # 📦 ПАКЕТНАЯ ПРОВЕРКА (ZIP / многостраничный PDF)
+    # =========================================================================
+    @staticmethod
+    def process_batch(file_obj, max_workers=None):
         """
-        Ищет 3 квадрата и QR код, вычисляет матрицу перспективы и выравнивает лист.
+        Проверяет пачку бланков: ZIP с фото или многостраничный PDF.
+        CV-этапы идут параллельно в пуле процессов, результаты пишутся в БД одним bulk-запросом.
         """
         try:
+            pages = GraderService.iter_batch_pages(file_obj)
+        except ValueError as e:
+            return {"status": "error", "message": str(e)}
+
+        workers = max_workers or settings.GRADER_BATCH_WORKERS
+
+        sheets = []
+        pending = set()
+        with ProcessPoolExecutor(max_workers=workers, mp_context=POOL_CONTEXT, initializer=django.setup) as pool:
+            for index, (name, payload) in enumerate(pages):
+                pending.add(pool.submit(_read_sheet_worker, index, name, payload))
+
+                # Держим в очереди не больше 2 страниц на воркер, чтобы не раздувать память
+                if len(pending) >= workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    sheets.extend(f.result() for f in done)
+
+            sheets.extend(f.result() for f in pending)
+
+        if not sheets:
+            return {"status": "error", "message": "В файле не найдено ни одного бланка."}
+
+        sheets.sort(key=lambda s: s["index"])
+        report = GraderService.save_batch(sheets)
+        graded = sum(1 for r in report if r["status"] == "success")
+
+        return {
+            "status": "success",
+            "message": f"Проверено бланков: {graded} из {len(report)}",
+            "data": {
+                "total": len(report),
+                "graded": graded,
+                "failed": len(report) - graded,
+                "sheets": report
+            }
+        }
+
+    @staticmethod
+    def iter_batch_pages(file_obj):
+        """
+        Генератор (имя, payload) по всем бланкам пачки.
+        ZIP -> байты каждой картинки, PDF -> BGR-массив каждой страницы (150 DPI = A4_WIDTH_PX).
+        """
+        data = file_obj.read()
+        if GraderService.batch_kind(data) == 'image':
+            raise ValueError("Поддерживаются только ZIP-архивы с фото или PDF-файлы.")
+        return GraderService.iter_pages(data, getattr(file_obj, 'name', 'batch'))
+
+    @staticmethod
+    def batch_kind(data):
+        """'zip', 'pdf' или 'image' (одно фото бланка)."""
+        if zipfile.is_zipfile(io.BytesIO(data)):
+            return 'zip'
+        if data[:5] == b'%PDF-':
+            return 'pdf'
+        return 'image'
+
+    @staticmethod
+    def list_batch_pages(data):
+        """
+        Ссылки на бланки файла без растеризации: имена файлов ZIP или номера страниц PDF.
+        По этим ссылкам Celery делит пачку на чанки (см. tasks.grader_process_scan_task).
+        """
+        kind = GraderService.batch_kind(data)
+        if kind == 'zip':
+            with zipfile.ZipFile(io.BytesIO(data)) as archive:
+                return [info.filename for info in GraderService._zip_images(archive)]
+        if kind == 'pdf':
+            from pdf2image import pdfinfo_from_bytes
+            return list(range(1, pdfinfo_from_bytes(data)["Pages"] + 1))
+        return [0]
+
+    @staticmethod
+    def extract_pages(data, pages):
+        """
+        Файл-часть пачки только с бланками pages (ссылки из list_batch_pages): ZIP или PDF.
+        Celery-чанк читает свою часть, а не всю пачку целиком.
+        """
+        kind = GraderService.batch_kind(data)
+        buffer = io.BytesIO()
+        if kind == 'zip':
+            with zipfile.ZipFile(io.BytesIO(data)) as archive, zipfile.ZipFile(buffer, 'w') as part:
+                for name in pages:
+                    part.writestr(archive.getinfo(name), archive.read(name))
+        elif kind == 'pdf':
+            from pypdf import PdfReader, PdfWriter
+            reader, writer = PdfReader(io.BytesIO(data)), PdfWriter()
+            for page in pages:
+                writer.add_page(reader.pages[page - 1])
+            writer.write(buffer)
+        else:
+            return data
+        return buffer.getvalue()
+
+    @staticmethod
+    def iter_part_pages(part, base_name, pages):
+        """Бланки файла-части (extract_pages) с именами, как в исходной пачке (страницы PDF — по номеру в пачке)."""
+        for page, (name, payload) in zip(pages, GraderService.iter_pages(part, base_name)):
+            yield (f"{base_name}#{page}" if isinstance(page, int) and page else name), payload
+
+    @staticmethod
+    def iter_pages(data, base_name, pages=None):
+        """Генератор (имя, payload) по бланкам файла. pages — подмножество из list_batch_pages."""
+        kind = GraderService.batch_kind(data)
+        if kind == 'zip':
+            return GraderService._iter_zip_pages(data, pages)
+        if kind == 'pdf':
+            return GraderService._iter_pdf_pages(data, base_name, pages)
+        return iter([(base_name, data)])
+
+    @staticmethod
+    def _zip_images(archive):
+        for info in archive.infolist():
+            name = info.filename
+            if info.is_dir() or name.startswith('__MACOSX/'):
+                continue
+            if name.lower().endswith(BATCH_IMAGE_EXTENSIONS):
+                yield info
+
+    @staticmethod
+    def _iter_zip_pages(data, pages=None):
+        wanted = set(pages) if pages is not None else None
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            for info in GraderService._zip_images(archive):
+                if wanted is None or info.filename in wanted:
+                    yield info.filename, archive.read(info)
+
+    @staticmethod
+    def _iter_pdf_pages(data, base_name, pages=None):
+        from pdf2image import convert_from_bytes, pdfinfo_from_bytes
+
+        if pages is None:
+            pages = range(1, pdfinfo_from_bytes(data)["Pages"] + 1)
+        pages = sorted(pages)
+
+        # Растеризуем подряд идущими диапазонами по PDF_PAGES_PER_CHUNK страниц
+        for i in range(0, len(pages), PDF_PAGES_PER_CHUNK):
+            window = pages[i:i + PDF_PAGES_PER_CHUNK]
+            first, last = window[0], window[-1]
+            wanted = set(window)
+            for offset, page in enumerate(convert_from_bytes(data, dpi=150, first_page=first, last_page=last)):
+                if first + offset not in wanted:
+                    continue
+                image = cv2.cvtColor(np.array(page.convert('RGB')), cv2.COLOR_RGB2BGR)
+                yield f"{base_name}#{first + offset}", image
+
+    @staticmethod
+    def save_batch(sheets):
+        """
+        Считает баллы и сохраняет результаты пачки: студенты/экзамены грузятся in_bulk,
+        ключ ответов берется из кэша один раз на экзамен, ExamResult пишется одним upsert.
+        """
+        readable = [s for s in sheets if s["status"] == "ok"]
+        students = Student.objects.in_bulk({s["uid"] for s in readable})
+        exams = Exam.objects.in_bulk({s["eid"] for s in readable})
+
+        answer_keys = {}
+        results = {}
+        report = []
+
+        for sheet in sheets:
+            row = {"file": sheet["file"], "status": "error", "message": sheet["message"],
+                   "debug_files": sheet.get("debug_files", [])}
+            report.append(row)
+            if sheet["status"] != "ok":
+                continue
+
+            student = students.get(sheet["uid"])
+            exam = exams.get(sheet["eid"])
+            if not student or not exam:
+                row["message"] = "Неверный формат данных в QR-коде."
+                continue
+
+            if exam.id not in answer_keys:
+                answer_keys[exam.id] = GraderService.get_answer_key(exam.id)
+
+            score, max_score, percent, details = GraderService.score_answers(answer_keys[exam.id], sheet["answers"])
+
+            # Если один бланк отсканировали дважды, сохраняем последний
+            results[(student.id, exam.id)] = ExamResult(
+                student=student, exam=exam,
+                score=score, max_score=max_score, percentage=percent, details=details
+            )
+            row.update({
+                "status": "success",
+                "message": f"Оценка: {score} из {max_score}",
+                "student": f"{student.last_name_ru} {student.first_name_ru}",
+                "exam": exam.title,
+                "score": score,
+                "percent": percent,
+            })
+
+        if results:
+            with transaction.atomic():
+                saved = ExamResult.objects.bulk_create(
+                    results.values(),
+                    batch_size=500,
+                    update_conflicts=True,
+                    unique_fields=['student', 'exam'],
+                    update_fields=['score', 'max_score', 'percentage', 'details']
+                )
+                ResultFactsService.rebuild(saved)
+
+        return report
+
+    @staticmethod
+    def align_image(image, qr_points=None, debug=None):
+        """
+        Ищет 3 квадрата, вычисляет матрицу перспективы по ним и QR-коду и выравнивает лист.
+        qr_points — углы QR из detect_qr (в координатах image); если не переданы, ищем сами.
+        Возвращает выровненный лист или None (тогда бланк помечается проблемным в debug).
+        """
+        debug = debug or ScanDebug(mode='off')
+        warped = GraderService._align_image(image, qr_points)
+        if warped is None:
+            debug.mark_failed()
+        debug.add("aligned", warped)
+        return warped
+
+    @staticmethod
+    def _align_image(image, qr_points=None):
+        try:
+            if qr_points is None:
+                _, qr_points = GraderService.detect_qr(image)
+
             # Уменьшаем для быстрого поиска контуров
             ratio = image.shape[0] / 800.0
             small = cv2.resize(image, (int(image.shape[1] / ratio), 800))
@@ -117,34 +436,22 @@ class GraderService:
                     if w > 10 and h > 10 and 0.8 <= ar <= 1.2:
                         anchors.append(approx)
 
-            # Нам нужно найти 3 квадрата (якоря). QR код мы найдем отдельно детектором.
+            # Нам нужно найти 3 квадрата (якоря). QR уже найден в detect_qr.
             # Если нашли слишком много квадратов, берем самые похожие по площади
             anchors = sorted(anchors, key=cv2.contourArea, reverse=True)[:5] 
             
-            # Ищем QR-код на уменьшенном изображении для скорости
-            detector = cv2.QRCodeDetector()
-            decoded_info, qr_points, _ = detector.detectAndDecode(small)
-            
-            qr_center = None
-            if qr_points is not None:
-                # qr_points - это массив углов [[x,y], ...]
-                pts = qr_points[0]
-                center_x = np.mean([p[0] for p in pts])
-                center_y = np.mean([p[1] for p in pts])
-                qr_center = np.array([center_x, center_y])
-            
             # Если нет QR или нет хотя бы 3 квадратов, выравнивание невозможно
             # (Можно попробовать усложнить логику, но пока вернем оригинал)
-            if qr_center is None or len(anchors) < 3:
+            if qr_points is None or len(anchors) < 3:
                 print("⚠️ Не нашел достаточно якорей или QR. Пропускаю выравнивание.")
-                return None, None
+                return None
 
             # --- ЛОГИКА ОПРЕДЕЛЕНИЯ КТО ЕСТЬ КТО ---
             # У нас есть QR (это всегда Верх-Право, если лист не перевернут)
             # И 3 квадрата: TL, BL, BR.
             
-            # Переводим координаты в масштаб оригинала
-            qr_center_orig = qr_center * ratio
+            # Центр QR (углы уже в масштабе оригинала)
+            qr_center_orig = np.asarray(qr_points, dtype="float32").reshape(-1, 2).mean(axis=0)
             
             found_anchors = []
             for a in anchors[:3]: # Берем 3 самых больших квадрата
@@ -154,7 +461,7 @@ class GraderService:
                     cY = int((M["m01"] / M["m00"]) * ratio)
                     found_anchors.append([cX, cY])
             
-            if len(found_anchors) < 3: return None, None
+            if len(found_anchors) < 3: return None
             
             # Сортируем: 
             # 1. Считаем расстояния от QR кода до каждого якоря.
@@ -214,39 +521,80 @@ class GraderService:
             M = cv2.getPerspectiveTransform(src_pts, GraderService.DST_PTS)
             
             # Применяем
-            warped = cv2.warpPerspective(image, M, (GraderService.A4_WIDTH_PX, GraderService.A4_HEIGHT_PX))
-            
-            # Дебаг
-            cv2.imwrite("debug_aligned.jpg", warped)
-            
-            return warped, "debug_aligned.jpg"
+            return cv2.warpPerspective(image, M, (GraderService.A4_WIDTH_PX, GraderService.A4_HEIGHT_PX))
 
         except Exception as e:
             print(f"⚠️ Ошибка выравнивания: {e}")
-            return None, None
+            return None
 
+    # =========================================================================
+    # 🔑 КЛЮЧ ОТВЕТОВ (компилируется один раз на экзамен и живет в кэше)
+    # =========================================================================
     @staticmethod
-    def calculate_and_save(student, exam, raw_answers):
-        questions = exam.questions.all().order_by('id')
+    def answer_key_cache_key(exam_id):
+        return f"exam_answer_key_{exam_id}"
+
+    @staticmethod
+    def get_answer_key(exam_id):
+        """
+        Скомпилированный ключ экзамена из кэша (при промахе — build_answer_key, 2 запроса).
+        Сбрасывается сигналами (см. signals.py) при изменении вопросов, вариантов ответа и экзамена.
+        """
+        cache_key = GraderService.answer_key_cache_key(exam_id)
+        answer_key = cache.get(cache_key)
+        if answer_key is None:
+            answer_key = GraderService.build_answer_key(exam_id)
+            cache.set(cache_key, answer_key, timeout=ANSWER_KEY_CACHE_TIMEOUT)
+        return answer_key
+
+    @staticmethod
+    def invalidate_answer_keys(exam_ids):
+        cache.delete_many([GraderService.answer_key_cache_key(exam_id) for exam_id in exam_ids])
+
+    @staticmethod
+    def build_answer_key(exam_id):
+        """
+        Ключ ответов по порядку вопросов экзамена (order_by('id')):
+        {"questions": [id вопроса], "keys": [буква или None], "points": [баллы вопроса]}.
+        Правильный ответ = первый верный среди первых 4 вариантов (по id).
+        """
+        options_map = ["A", "B", "C", "D"]
+        questions = list(
+            Exam.questions.through.objects.filter(exam_id=exam_id)
+            .order_by('question_id')
+            .values_list('question_id', 'question__points')
+        )
+        question_ids = [q_id for q_id, _ in questions]
+
+        correct = {}
+        positions = defaultdict(int)
+        choices = Choice.objects.filter(question_id__in=question_ids).order_by('question_id', 'id')
+        for q_id, is_correct in choices.values_list('question_id', 'is_correct'):
+            c_idx = positions[q_id]
+            positions[q_id] += 1
+            if is_correct and c_idx < 4 and q_id not in correct:
+                correct[q_id] = options_map[c_idx]
+
+        return {
+            "questions": question_ids,
+            "keys": [correct.get(q_id) for q_id in question_ids],
+            "points": [points for _, points in questions],
+        }
+
+    @staticmethod
+    def score_answers(answer_key, raw_answers):
+        """Сравнивает ответы бланка с ключом. Возвращает (score, max_score, percent, details)."""
         score = 0
-        max_score = len(questions)
+        max_score = len(answer_key["keys"])
         details = {}
-        options_map = ["A", "B", "C", "D"]
 
-        for idx, question in enumerate(questions):
+        for idx, correct_letter in enumerate(answer_key["keys"]):
             q_num = str(idx + 1)
             student_ans = raw_answers.get(q_num, None)
-            
-            # Правильный ответ
-            correct_letter = None
-            for c_idx, choice in enumerate(question.choices.all().order_by('id')):
-                if choice.is_correct and c_idx < 4:
-                    correct_letter = options_map[c_idx]
-                    break
-            
+
             is_match = (student_ans == correct_letter)
             if is_match: score += 1
-            
+
             details[q_num] = {
                 "student": student_ans,
                 "correct": correct_letter,
@@ -254,86 +602,137 @@ class GraderService:
             }
 
         percent = (score / max_score) * 100 if max_score > 0 else 0
+        return score, max_score, round(percent, 2), details
+
+    @staticmethod
+    def calculate_and_save(student, exam, raw_answers):
+        answer_key = GraderService.get_answer_key(exam.id)
+        score, max_score, percent, details = GraderService.score_answers(answer_key, raw_answers)
 
         result, _ = ExamResult.objects.update_or_create(
             student=student, exam=exam,
-            defaults={'score': score, 'max_score': max_score, 'percentage': round(percent, 2), 'details': details}
+            defaults={'score': score, 'max_score': max_score, 'percentage': percent, 'details': details}
         )
+        ResultFactsService.rebuild([result])
         return result
 
     @staticmethod
     def find_qr_code(image):
-        detector = cv2.QRCodeDetector()
-        data, points, _ = detector.detectAndDecode(image)
-        return data, points
+        return GraderService.detect_qr(image)
+
+    @staticmethod
+    def detect_qr(image):
+        """
+        Ищет и декодирует QR за один проход.
+        Возвращает (payload, углы 4x2 в координатах image) или (None, None).
+        Сначала уменьшенная копия (быстро), потом оригинал; на каждой — pyzbar, затем OpenCV.
+        """
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+
+        attempts = []
+        ratio = gray.shape[0] / 800.0
+        if ratio > 1:
+            attempts.append((cv2.resize(gray, (int(gray.shape[1] / ratio), 800)), ratio))
+        attempts.append((gray, 1.0))
+
+        for candidate, scale in attempts:
+            data, points = GraderService._decode_qr(candidate)
+            if data:
+                return data, points * scale
+        return None, None
+
+    @staticmethod
+    def _decode_qr(gray):
+        if zbar_decode is not None:
+            for symbol in zbar_decode(gray, symbols=[ZBarSymbol.QRCODE]):
+                points = np.array([(p.x, p.y) for p in symbol.polygon], dtype="float32")
+                return symbol.data.decode('utf-8'), points
+
+        data, points, _ = _qr_detector().detectAndDecode(gray)
+        if data and points is not None:
+            return data, points.reshape(-1, 2).astype("float32")
+        return None, None
 
     @staticmethod
-    def recognize_answers(image, questions_count=20):
+    def recognize_answers(image, questions_count=20, layout=None, debug=None):
+        debug = debug or ScanDebug(mode='off')
+
         # 1. Подготовка (уже на выровненном изображении)
         gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
         blurred = cv2.GaussianBlur(gray, (5, 5), 0)
-        thresh = cv2.adaptiveThreshold(blurred, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, 11, 2)
 
-        # 2. Поиск кружков
-        cnts, _ = cv2.findContours(thresh.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        question_cnts = []
+        # 2. Кружки: по сетке шаблона (быстро и детерминированно) или поиском контуров
+        if layout is not None:
+            rows = layout.bubble_boxes_px(questions_count)
+        else:
+            rows = GraderService.find_bubble_rows(blurred, questions_count)
+
+        # 3. Анализ заполненности: все кружки листа за один векторный проход.
+        # Адаптивный порог "выедает" середину сплошной заливки, поэтому чернила меряем по Otsu
+        _, ink = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+        engine = BubbleFillEngine()
+        answers = engine.decide(engine.fill_ratios(ink, rows))
+
+        results = {str(q + 1): answer for q, answer in enumerate(answers) if answer is not None}
+
+        # Двойные отметки — спорный бланк: сохраняем картинки для разбора
+        if DOUBLE_MARK in answers:
+            debug.mark_failed()
+
+        if debug.will_save:
+            debug.add("scan_result", GraderService._draw_answers(image, rows, answers))
+
+        return results
+
+    @staticmethod
+    def _draw_answers(image, rows, answers):
+        """Debug-разметка: зеленым — выбранный кружок, красным — строка без ответа."""
+        debug_img = image.copy()
+
+        for q, answer in enumerate(answers):
+            if answer is None:
+                # Если ответ не распознан, рисуем красный
+                for (x, y, bw, bh) in rows[q]:
+                    cv2.rectangle(debug_img, (int(x), int(y)), (int(x + bw), int(y + bh)), (0, 0, 255), 1)
+                continue
+
+            if answer == DOUBLE_MARK:
+                continue
+            # Рисуем зеленую рамку вокруг ответа
+            x, y, bw, bh = rows[q][OPTIONS.index(answer)]
+            cv2.rectangle(debug_img, (int(x), int(y)), (int(x + bw), int(y + bh)), (0, 255, 0), 4)
+
+        return debug_img
+
+    @staticmethod
+    def find_bubble_rows(blurred, questions_count=20):
+        """
+        Запасной путь для невыровненного фото: ищет кружки контурами.
+        Возвращает рамки (вопросы, 4, 4) — x, y, w, h, в строке слева-направо (A, B, C, D).
+        """
+        thresh = cv2.adaptiveThreshold(blurred, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, 11, 2)
+        cnts, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
 
         # Фильтр для кружков (подгоняем под размеры на A4_WIDTH_PX=1240)
         # На листе шириной 1240, кружок будет примерно 20-25px
-        for c in cnts:
-            (x, y, w, h) = cv2.boundingRect(c)
-            ar = w / float(h)
-            
-            # Чуть расширим диапазон, чтобы ловить даже неидеальные круги
-            if w >= 18 and h >= 18 and w <= 60 and h <= 60 and 0.85 <= ar <= 1.15:
-                question_cnts.append(c)
+        boxes = np.array([cv2.boundingRect(c) for c in cnts], dtype=np.int32).reshape(-1, 4)
+        w, h = boxes[:, 2], boxes[:, 3]
+        ar = w / np.maximum(h, 1)
+        # Чуть расширим диапазон, чтобы ловить даже неидеальные круги
+        boxes = boxes[(w >= 18) & (h >= 18) & (w <= 60) & (h <= 60) & (ar >= 0.85) & (ar <= 1.15)]
+
+        # Сортировка (Сверху-вниз)
+        boxes = boxes[np.argsort(boxes[:, 1], kind='stable')]
 
-        # 3. Сортировка (Сверху-вниз)
-        question_cnts = GraderService.sort_contours(question_cnts, method="top-to-bottom")
-        
         # Обрезаем лишнее (если нашли шум)
         expected = questions_count * 4
-        if len(question_cnts) > expected:
+        if len(boxes) > expected:
             # Берем нижние, так как вопросы идут после шапки
-            question_cnts = question_cnts[-expected:] 
-
-        results = {}
-        debug_img = image.copy()
-        options_map = {0: "A", 1: "B", 2: "C", 3: "D"}
-
-        # 4. Анализ заполненности
-        for (q, i) in enumerate(range(0, len(question_cnts), 4)):
-            row_cnts = question_cnts[i:i + 4]
-            if len(row_cnts) < 4: continue
-
-            # Сортируем слева-направо (A, B, C, D)
-            row_cnts = GraderService.sort_contours(row_cnts, method="left-to-right")
-            
-            bubbled = None
-            max_pixels = 0
-
-            for (j, c) in enumerate(row_cnts):
-                mask = np.zeros(thresh.shape, dtype="uint8")
-                cv2.drawContours(mask, [c], -1, 255, -1)
-                mask = cv2.bitwise_and(thresh, thresh, mask=mask)
-                total = cv2.countNonZero(mask)
-
-                # Порог закрашенности (нужно тестировать, 500 для размера 1240px - ок)
-                if bubbled is None or total > max_pixels:
-                    max_pixels = total
-                    bubbled = (j, c)
-
-            if bubbled and max_pixels > 550: # Поднял порог, чтобы исключить случайные точки
-                idx, best_cnt = bubbled
-                results[str(q + 1)] = options_map[idx]
-                # Рисуем зеленый кружок вокруг ответа
-                cv2.drawContours(debug_img, [best_cnt], -1, (0, 255, 0), 4)
-            else:
-                # Если ответ не распознан, рисуем красный
-                cv2.drawContours(debug_img, row_cnts, -1, (0, 0, 255), 1)
+            boxes = boxes[-expected:]
 
-        cv2.imwrite("debug_scan_result.jpg", debug_img)
-        return results, "debug_scan_result.jpg"
+        # Строки по 4 кружка, внутри строки — слева-направо (A, B, C, D)
+        rows = boxes[:len(boxes) // 4 * 4].reshape(-1, 4, 4)
+        return np.take_along_axis(rows, np.argsort(rows[:, :, 0], axis=1, kind='stable')[:, :, None], axis=1)
 
     @staticmethod
     def sort_contours(cnts, method="left-to-right"):
@@ -0,0 +1,133 @@
+import re
+import numpy as np
+
+# Буквы вариантов ответа по порядку вариантов в буклете
+LETTERS = ('A', 'B', 'C', 'D', 'E', 'F')
+
+# Пустой ответ ученика в details
+NO_ANSWER = '-'
+
+# Значения ячеек, которые считаем пустым ответом
+_EMPTY_VALUES = ['', 'NAN', 'NONE']
+
+_NUMBER_RE = re.compile(r'(\d+)')
+
+
+class ScoringPlan:
+    """
+    📋 СКОМПИЛИРОВАННЫЙ ПЛАН ПРОВЕРКИ ОДНОГО ЭКЗАМЕНА (варианта)
+
+    Строится один раз из question_order ("Умной карты"):
+    - numbers:  номера вопросов в буклете ("1", "2", ...)
+    - keys:     вектор правильных букв для этого буклета
+    - subjects: вектор аббревиатур предметов (для аналитики в details)
+
+    Дальше все ученики варианта проверяются одним сравнением матрицы ответов с вектором ключей.
+    Экзамен должен приходить с prefetch_related('questions__choices', 'questions__topic__subject'),
+    тогда построение плана не делает запросов в БД.
+    """
+
+    def __init__(self, exam):
+        order_map = exam.order_map
+        questions = {q.id: q for q in exam.questions.all()}
+
+        numbers, keys, subjects = [], [], []
+        for booklet_num in sorted(order_map, key=lambda n: int(n) if str(n).isdigit() else 0):
+            map_data = order_map[booklet_num]
+
+            # Поддержка старого формата (где просто ID) и нового (где Dict)
+            if isinstance(map_data, int):
+                question_id, key = map_data, None
+            else:
+                question_id, key = map_data.get('id'), map_data.get('key')
+
+            question = questions.get(question_id)
+            if question is None:
+                continue
+
+            # Ключа нет в карте (старый формат) -> буква верного варианта в исходном порядке (по ID)
+            if not key:
+                key = ScoringPlan._original_key(question)
+
+            numbers.append(str(booklet_num))
+            keys.append(key)
+            subjects.append(ScoringPlan._subject_abbr(question))
+
+        self.numbers = numbers
+        self.keys = np.array(keys, dtype=str)
+        self.subjects = subjects
+        self._position = {num: i for i, num in enumerate(numbers)}
+        self._bindings = {}
+
+    @staticmethod
+    def _original_key(question):
+        choices = sorted(question.choices.all(), key=lambda c: c.id)
+        for i, choice in enumerate(choices[:len(LETTERS)]):
+            if choice.is_correct:
+                return LETTERS[i]
+        return '?'
+
+    @staticmethod
+    def _subject_abbr(question):
+        subject = question.topic.subject if question.topic else None
+        if not subject:
+            return "GEN"
+        return subject.abbreviation or subject.name[:3]
+
+    def bind(self, columns):
+        """
+        Сопоставляет колонки файла вопросам плана (Q5 / "5" / "Вопрос 5" -> вопрос №5).
+        Возвращает (колонки, индексы в плане). Результат кэшируется по набору колонок.
+        """
+        columns = tuple(columns)
+        if columns not in self._bindings:
+            picked, positions, seen = [], [], set()
+            for col in columns:
+                match = _NUMBER_RE.search(str(col))
+                if not match:
+                    continue
+                position = self._position.get(match.group(1))
+                if position is None or position in seen:
+                    continue
+                seen.add(position)
+                picked.append(col)
+                positions.append(position)
+            self._bindings[columns] = (picked, np.array(positions, dtype=np.intp))
+        return self._bindings[columns]
+
+    def score(self, df):
+        """
+        Проверяет все строки DataFrame разом.
+        Возвращает список словарей (по строке): total_score, max_score_possible, percentage, details.
+        """
+        columns, positions = self.bind(df.columns)
+        if not columns:
+            return [{"total_score": 0, "max_score_possible": 0, "percentage": 0, "details": {}}
+                    for _ in range(len(df))]
+
+        # Матрица ответов (ученики x вопросы): строки, верхний регистр, пустые -> '-'
+        answers = np.char.upper(np.char.strip(df[columns].fillna('').to_numpy(dtype=str)))
+        answers = np.where(np.isin(answers, _EMPTY_VALUES), NO_ANSWER, answers)
+
+        # --- ПРОВЕРКА --- одна операция на весь вариант
+        keys = self.keys[positions]
+        correct = (answers == keys) & (keys != '?')  # '?' — ключ не найден, засчитать нельзя
+        totals = correct.sum(axis=1)
+        max_possible = len(columns)  # 1 балл за вопрос
+        percentages = np.round(totals / max_possible * 100, 1)
+
+        numbers = [self.numbers[p] for p in positions]
+        subjects = [self.subjects[p] for p in positions]
+
+        results = []
+        for row_answers, row_correct, total, percentage in zip(answers.tolist(), correct.tolist(), totals.tolist(), percentages.tolist()):
+            results.append({
+                "total_score": total,
+                "max_score_possible": max_possible,
+                "percentage": percentage,
+                "details": {
+                    num: {"s": int(ok), "v": value, "sb": sb}
+                    for num, value, ok, sb in zip(numbers, row_answers, row_correct, subjects)
+                }
+            })
+        return results
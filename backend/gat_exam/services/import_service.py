@@ -1,8 +1,10 @@
+import io
+import csv
+import openpyxl
 import pandas as pd
 import numpy as np
-import re
 import logging
-from difflib import SequenceMatcher
+from collections import defaultdict
 from django.db import transaction
 from django.core.exceptions import ObjectDoesNotExist
 from typing import Dict, Any, List
@@ -10,9 +12,13 @@ from typing import Dict, Any, List
 # Импорты моделей
 from ..models import (
     Student, Exam, ExamResult, StudentClass, 
-    School, Question, Subject, UserProfile
+    School, Question, Subject
 )
 from ..serializers import ExamResultSerializer # Если нужен для ответа API
+from .import_scoring import ScoringPlan
+from .student_matcher import StudentMatcher, normalize_id, normalize_name
+from .provisioning_service import ProvisioningService
+from .result_facts import ResultFactsService
 
 logger = logging.getLogger(__name__)
 
@@ -28,29 +34,21 @@ class ImportService:
     5. Проверить ответ и выставить оценку.
     """
 
+    # Сколько строк Excel обрабатываем и сохраняем за один раз
+    CHUNK_SIZE = 1000
+
     @staticmethod
-    def process_file(file_obj, school_id: int, round_id: int, grade_level: int, day: int = 1):
+    def process_file(file_obj, school_id: int, round_id: int, grade_level: int, day: int = 1,
+                     progress_callback=None):
         """
         Главный метод обработки файла.
+        Файл читается потоково (openpyxl read-only / csv) чанками по CHUNK_SIZE строк:
+        каждый чанк проверяется и сразу сохраняется, поэтому память не растет с размером файла.
+        progress_callback(rows_done, processed) вызывается после каждого чанка.
         """
         logs = []
-        
-        # 1. Читаем Excel
-        try:
-            df = pd.read_excel(file_obj)
-            # Приводим заголовки к верхнему регистру для удобства (variant -> VARIANT)
-            df.columns = [str(c).strip().upper() for c in df.columns]
-        except Exception as e:
-            return {"error": f"Ошибка чтения файла: {str(e)}"}
 
-        # 2. Проверяем наличие колонки VARIANT
-        # Возможные названия: VARIANT, VAR, ВАРИАНТ
-        variant_col = next((col for col in df.columns if 'VAR' in col or 'ВАР' in col), None)
-        
-        if not variant_col:
-            return {"error": "❌ В файле нет колонки 'Variant' (или 'Вариант'). Без неё Умный Импорт невозможен."}
-
-        # 3. Подгружаем Экзамены (КЭШИРОВАНИЕ)
+        # 1. Подгружаем Экзамены (КЭШИРОВАНИЕ)
         # Чтобы не делать 100 запросов в БД, достаем экзамены заранее
         # Ключ словаря: (Variant_Letter) -> Объект Exam
         # Например: 'B' -> <Exam: 5 Класс - Var B>
@@ -62,168 +60,200 @@ class ImportService:
             # Или gat_round=round_id если это число. Подстрой под свою модель Round!
             grade_level=grade_level,
             gat_day=day
-        ).prefetch_related('questions', 'questions__choices', 'questions__topic__subject')
+        ).select_related('booklet').prefetch_related('questions', 'questions__choices', 'questions__topic__subject')
         
         if not exams_qs.exists():
-            return {"error": f"❌ В базе данных не найдены экзамены для Школы ID={school_id}, Класса {grade_level}, Дня {day}. Сначала сгенерируйте их!"}
+            return {"status": "error", "error": f"❌ В базе данных не найдены экзамены для Школы ID={school_id}, Класса {grade_level}, Дня {day}. Сначала сгенерируйте их!"}
 
         for exam in exams_qs:
             # Нормализуем вариант (A, B)
             v_key = ImportService._normalize_variant(exam.variant)
             exams_cache[v_key] = exam
 
-        # 4. Обработка строк
+        # План проверки строится один раз на вариант (ключи, предметы, номера вопросов)
+        plans = {v_key: ScoringPlan(exam) for v_key, exam in exams_cache.items()}
+        fact_contexts = ResultFactsService.exam_contexts([exam.id for exam in exams_cache.values()])
+
+        # 2. Обработка строк (чанками)
         processed_count = 0
         new_students_count = 0
-        results_to_create = [] # Для bulk_create (оптимизация)
+        rows_done = 0
+        variant_col = None
+
+        # Индекс существующих студентов школы (ID / имя / триграммы), чтобы искать быстро
+        matcher = StudentMatcher(Student.objects.filter(school_id=school_id, student_class__grade_level=grade_level))
+        import_class = None  # Класс для новых учеников (берем/создаем при первой необходимости)
+
+        try:
+            for df in ImportService.iter_chunks(file_obj, ImportService.CHUNK_SIZE):
+                # Проверяем наличие колонки VARIANT (по заголовку первого чанка)
+                # Возможные названия: VARIANT, VAR, ВАРИАНТ
+                if variant_col is None:
+                    variant_col = next((col for col in df.columns if 'VAR' in col or 'ВАР' in col), None)
+                    if not variant_col:
+                        return {"status": "error", "error": "❌ В файле нет колонки 'Variant' (или 'Вариант'). Без неё Умный Импорт невозможен."}
+
+                results_to_upsert = {} # (ученик, экзамен) -> ExamResult: один upsert на чанк
+                routed = defaultdict(list)  # Вариант -> [(позиция строки в чанке, ученик или None, ключ нового)]
+                pending = {}  # Ключ нового ученика -> данные для ProvisioningService
+
+                for offset, (_, row) in enumerate(df.iterrows()):
+                    line = rows_done + offset + 2  # +1 заголовок, +1 нумерация Excel с единицы
+                    try:
+                        # --- А. Маршрутизация (Routing) ---
+                        raw_variant = row.get(variant_col)
+                        variant_char = ImportService._normalize_variant(raw_variant)
+
+                        if not variant_char or variant_char not in exams_cache:
+                            logs.append(f"⚠️ Строка {line}: Неизвестный вариант '{raw_variant}'. Пропуск.")
+                            continue
+
+                        # --- Б. Идентификация Ученика ---
+                        student_id = row.get('STUDENT ID') or row.get('ID')
+                        full_name = row.get('FULL NAME') or row.get('NAME') or row.get('ФИО')
+
+                        student = matcher.find(student_id, full_name)
+                        key = None
+                        if student is None:
+                            # Новых учеников копим и создаем одной пачкой после разбора чанка
+                            key = normalize_id(student_id) or normalize_name(full_name)
+                            if not key:
+                                logs.append(f"⚠️ Строка {line}: Нет ни ID, ни ФИО ученика. Пропуск.")
+                                continue
+                            pending.setdefault(key, ImportService._new_student_spec(student_id, full_name))
+
+                        routed[variant_char].append((offset, student, key))
+
+                    except Exception as e:
+                        logs.append(f"❌ Ошибка в строке {line}: {str(e)}")
+
+                # Массовое создание новых учеников (User + Профиль + Student)
+                created = {}
+                if pending:
+                    if import_class is None:
+                        import_class = ImportService._import_class(school_id, grade_level)
+                    try:
+                        new_students = ProvisioningService.create_students(list(pending.values()), school_id, import_class)
+                    except Exception as e:
+                        logs.append(f"❌ Не удалось создать новых учеников ({len(pending)}): {str(e)}")
+                        new_students = []
+                    for key, (student, _) in zip(pending, new_students):
+                        created[key] = student
+                        matcher.add(student) # Добавляем в индекс
+                    new_students_count += len(created)
 
-        # Подгружаем список существующих студентов школы, чтобы искать быстро
-        existing_students = list(Student.objects.filter(school_id=school_id, grade_level=grade_level))
-        
-        for index, row in df.iterrows():
-            try:
-                row_log = []
-                
-                # --- А. Идентификация Ученика ---
-                student_id = row.get('STUDENT ID') or row.get('ID')
-                full_name = row.get('FULL NAME') or row.get('NAME') or row.get('ФИО')
-                
-                student, created = ImportService._find_or_create_student(
-                    student_id, full_name, existing_students, school_id, grade_level
-                )
-                
-                if created:
-                    new_students_count += 1
-                    existing_students.append(student) # Добавляем в локальный кэш
-
-                # --- Б. Маршрутизация (Routing) ---
-                raw_variant = row.get(variant_col)
-                variant_char = ImportService._normalize_variant(raw_variant)
-                
-                if not variant_char or variant_char not in exams_cache:
-                    logs.append(f"⚠️ Строка {index+2}: Неизвестный вариант '{raw_variant}'. Пропуск.")
-                    continue
-                
-                target_exam = exams_cache[variant_char]
-                
                 # --- В. ПРОВЕРКА (THE MATRIX LOGIC) ---
-                # Здесь происходит магия сопоставления Q1 (Var A) = Q5 (Var B)
-                score_data = ImportService._calculate_score(row, target_exam)
-                
-                # --- Г. Подготовка результата ---
-                # Удаляем старый результат этого ученика за этот экзамен, если есть
-                ExamResult.objects.filter(exam=target_exam, student=student).delete()
-                
-                result_obj = ExamResult(
-                    exam=target_exam,
-                    student=student,
-                    score=score_data['total_score'],
-                    max_score=score_data['max_score_possible'],
-                    percentage=score_data['percentage'],
-                    details=score_data['details'], # JSON с ответами
-                    is_passed=(score_data['percentage'] >= 50) # Порог 50%
-                )
-                results_to_create.append(result_obj)
-                processed_count += 1
-
-            except Exception as e:
-                logs.append(f"❌ Ошибка в строке {index+2}: {str(e)}")
-
-        # 5. Массовое сохранение (Bulk Create)
-        if results_to_create:
-            ExamResult.objects.bulk_create(results_to_create)
+                # Все ученики варианта проверяются разом по скомпилированному плану
+                # (здесь происходит магия сопоставления Q1 (Var A) = Q5 (Var B))
+                for variant_char, rows in routed.items():
+                    target_exam = exams_cache[variant_char]
+                    rows = [(offset, student or created.get(key)) for offset, student, key in rows]
+                    rows = [(offset, student) for offset, student in rows if student is not None]
+                    positions = [offset for offset, _ in rows]
+                    scores = plans[variant_char].score(df.iloc[positions])
+
+                    # --- Г. Подготовка результата ---
+                    for (_, student), score_data in zip(rows, scores):
+                        # Повтор ученика в файле: побеждает последняя строка (как при перезаписи)
+                        results_to_upsert[(student.id, target_exam.id)] = ExamResult(
+                            exam=target_exam,
+                            student=student,
+                            score=score_data['total_score'],
+                            max_score=score_data['max_score_possible'],
+                            percentage=score_data['percentage'],
+                            details=score_data['details'], # JSON с ответами
+                        )
+                        processed_count += 1
+
+                # 3. Сохраняем чанк сразу, не копя весь файл в памяти.
+                # Upsert по (student, exam): повторный импорт исправленного файла
+                # перезаписывает старые результаты без DELETE на каждого ученика
+                if results_to_upsert:
+                    with transaction.atomic():
+                        saved = ExamResult.objects.bulk_create(
+                            results_to_upsert.values(),
+                            batch_size=500,
+                            update_conflicts=True,
+                            unique_fields=['student', 'exam'],
+                            update_fields=['score', 'max_score', 'percentage', 'details']
+                        )
+                        # Факт-таблицы аналитики (SubjectScore, QuestionResponse)
+                        ResultFactsService.rebuild(saved, fact_contexts)
+
+                rows_done += len(df)
+                if progress_callback:
+                    progress_callback(rows_done, processed_count)
+
+        except Exception as e:
+            return {"status": "error", "error": f"Ошибка чтения файла: {str(e)}", "processed": processed_count}
+
+        if variant_col is None:
+            return {"status": "error", "error": "❌ Файл пустой: нет ни заголовка, ни строк."}
 
         return {
+            "status": "success",
             "success": True,
+            "rows": rows_done,
             "processed": processed_count,
             "new_students": new_students_count,
             "logs": logs[:20] # Вернем только первые 20 логов, чтобы не спамить
         }
 
     # =========================================================================
-    # 🕵️ ЛОГИКА ПРОВЕРКИ (ТО САМОЕ МЕСТО)
+    # 📥 ПОТОКОВОЕ ЧТЕНИЕ ФАЙЛА
     # =========================================================================
     @staticmethod
-    def _calculate_score(row: pd.Series, exam: Exam) -> Dict:
+    def iter_chunks(file_obj, chunk_size: int = CHUNK_SIZE):
         """
-        Проверяет ответы ученика, используя 'Запеченные ключи' (Baked Keys) из question_order.
-        Поддерживает Full Shuffle (перемешанные вопросы И ответы).
+        Генератор DataFrame по chunk_size строк.
+        Заголовки приводятся к верхнему регистру (variant -> VARIANT), пустые строки пропускаются.
+        В памяти одновременно держится только один чанк.
         """
-        total_score = 0
-        max_possible = 0
-        details = {} 
-        
-        # 1. Получаем карту
-        order_map = exam.question_order or {}
-        
-        # Кэш объектов вопросов (чтобы достать предмет/тему для аналитики)
-        # Нам всё еще нужны объекты, чтобы узнать "Математика" это или "Физика"
-        questions_lookup = {q.id: q for q in exam.questions.select_related('topic__subject').all()}
-
-        # 2. Идем по колонкам Excel (Q1, Q2...)
-        for col_name in row.index:
-            match = re.search(r'(\d+)', str(col_name))
-            if not match: continue
-            
-            booklet_num = match.group(1) # Например "5"
-            
-            # Достаем данные из JSON карты
-            # Поддержка старого формата (где просто ID) и нового (где Dict)
-            map_data = order_map.get(booklet_num) or order_map.get(int(booklet_num))
-            
-            if not map_data: continue
-
-            # Разбираем формат
-            if isinstance(map_data, int):
-                # СТАРЫЙ ФОРМАТ (только ID вопроса) -> Fallback Logic
-                real_question_id = map_data
-                correct_val = None # Придется искать в БД
-            else:
-                # НОВЫЙ ФОРМАТ (Full Shuffle)
-                real_question_id = map_data.get('id')
-                correct_val = map_data.get('key') # 'A', 'B', 'C'...
-
-            question_obj = questions_lookup.get(real_question_id)
-            if not question_obj: continue
-
-            # Если ключа не было в JSON (старый формат), ищем в базе
-            if not correct_val:
-                correct_choice = next((c for c in question_obj.choices.all() if c.is_correct), None)
-                correct_val = correct_choice.variant if correct_choice else "?"
-
-            # Ответ ученика
-            student_val = str(row[col_name]).strip().upper()
-            if student_val in ['NAN', 'NONE', '']: student_val = '-'
-
-            # --- ПРОВЕРКА ---
-            # Просто сравниваем буквы!
-            is_correct = (student_val == correct_val)
-            
-            points = 1 
-            
-            if is_correct:
-                total_score += points
-            max_possible += points
-            
-            # Детали для аналитики
-            subj_abbr = "GEN"
-            if question_obj.topic and question_obj.topic.subject:
-                subj_abbr = question_obj.topic.subject.abbreviation or question_obj.topic.subject.name[:3]
-
-            details[booklet_num] = {
-                "s": 1 if is_correct else 0,
-                "v": student_val,
-                "sb": subj_abbr
-            }
-
-        percentage = (total_score / max_possible * 100) if max_possible > 0 else 0
-        
-        return {
-            "total_score": total_score,
-            "max_score_possible": max_possible,
-            "percentage": round(percentage, 1),
-            "details": details
-        }
+        name = str(getattr(file_obj, 'name', '') or '').lower()
+        rows = ImportService._iter_csv_rows(file_obj) if name.endswith('.csv') else ImportService._iter_xlsx_rows(file_obj)
+
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [str(c).strip().upper() if c is not None else '' for c in header]
+        width = len(columns)
+
+        chunk = []
+        for values in rows:
+            if not values or all(v is None or str(v).strip() == '' for v in values):
+                continue
+            # Строки CSV бывают короче/длиннее заголовка — выравниваем
+            chunk.append((list(values) + [None] * width)[:width])
+            if len(chunk) >= chunk_size:
+                yield pd.DataFrame(chunk, columns=columns)
+                chunk = []
+
+        if chunk:
+            yield pd.DataFrame(chunk, columns=columns)
+
+    @staticmethod
+    def _iter_xlsx_rows(file_obj):
+        """Строки первого листа в read-only режиме openpyxl (ячейки не грузятся целиком)."""
+        workbook = openpyxl.load_workbook(file_obj, read_only=True, data_only=True)
+        try:
+            yield from workbook.worksheets[0].iter_rows(values_only=True)
+        finally:
+            workbook.close()
+
+    @staticmethod
+    def _iter_csv_rows(file_obj):
+        """Строки CSV (UTF-8, разделитель , ; или табуляция определяется по началу файла)."""
+        stream = io.TextIOWrapper(getattr(file_obj, 'file', file_obj), encoding='utf-8-sig', newline='')
+        try:
+            sample = stream.read(4096)
+            stream.seek(0)
+            try:
+                dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+            except csv.Error:
+                dialect = csv.excel
+            yield from csv.reader(stream, dialect)
+        finally:
+            stream.detach()  # Не закрываем исходный файл вместе с оберткой
 
     # =========================================================================
     # 🛠 ВСПОМОГАТЕЛЬНЫЕ МЕТОДЫ
@@ -246,53 +276,19 @@ class ImportService:
         return None
 
     @staticmethod
-    def _find_or_create_student(student_id, full_name, existing_list, school_id, grade):
-        """
-        Ищет ученика. Сначала по ID, потом нечеткий поиск по имени.
-        Если не нашел — создает нового.
-        """
-        # 1. Поиск по ID (если есть)
-        if student_id and str(student_id).isdigit():
-            found = next((s for s in existing_list if str(s.custom_id) == str(student_id) or s.id == int(student_id)), None)
-            if found: return found, False
-
-        # 2. Поиск по Имени (Fuzzy String Matching)
-        # Если в Excel "Ivanov Ivan", а в базе "Ivanov I.", это сложнее.
-        # Используем простое совпадение пока.
-        if full_name:
-            clean_name = str(full_name).lower().strip()
-            for s in existing_list:
-                db_name = f"{s.last_name} {s.first_name}".lower()
-                # Если совпадение > 90%
-                if SequenceMatcher(None, clean_name, db_name).ratio() > 0.85:
-                    return s, False
-
-        # 3. Создание нового
-        names = str(full_name).split()
-        last = names[0] if len(names) > 0 else "Unknown"
-        first = names[1] if len(names) > 1 else "Student"
-        
-        # Нужен User для студента? Используем Auth Service если есть, или напрямую
-        # Создаем "фейковый" username
-        import uuid
-        username = f"std_{uuid.uuid4().hex[:8]}"
-        
-        with transaction.atomic():
-            # Создаем Django User (для совместимости)
-            from django.contrib.auth.models import User
-            u = User.objects.create_user(username=username, password="temp_password_123")
-            
-            # Профиль
-            UserProfile.objects.create(user=u, role='student', school_id=school_id)
-            
-            # Студент
-            new_student = Student.objects.create(
-                user=u, # Если поле user обязательное
-                school_id=school_id,
-                grade_level=grade,
-                first_name=first,
-                last_name=last,
-                custom_id=student_id if (student_id and str(student_id).isdigit()) else None
-            )
-            
-        return new_student, True
\ No newline at end of file
+    def _new_student_spec(student_id, full_name) -> Dict:
+        """Данные нового ученика из строки Excel: "Фамилия Имя" + ID личного дела (если есть)."""
+        names = str(full_name).split() if full_name and not pd.isna(full_name) else []
+        return {
+            "last_name_ru": names[0] if len(names) > 0 else "Unknown",
+            "first_name_ru": names[1] if len(names) > 1 else "Student",
+            "custom_id": normalize_id(student_id) or None,
+        }
+
+    @staticmethod
+    def _import_class(school_id, grade_level):
+        """Класс для новых учеников: первый класс параллели в школе, иначе создаем литеру 'А'."""
+        student_class = StudentClass.objects.filter(school_id=school_id, grade_level=grade_level).order_by('section').first()
+        if student_class is None:
+            student_class = StudentClass.objects.create(school_id=school_id, grade_level=grade_level, section='А')
+        return student_class
@@ -0,0 +1,83 @@
+import cv2
+import numpy as np
+from django.conf import settings
+
+# Буквы вариантов в порядке колонок бланка
+OPTIONS = ("A", "B", "C", "D")
+
+# Метка "закрашено несколько кружков" в ответах бланка
+DOUBLE_MARK = "*"
+
+
+class BubbleFillEngine:
+    """
+    ⚫ ДВИЖОК ЗАКРАШЕННОСТИ КРУЖКОВ (OMR)
+
+    Считает заполненность всех кружков листа за один проход:
+    1. Строим интегральное изображение бинарной маски (один проход по картинке).
+    2. Сумма пикселей в любом прямоугольнике = 4 обращения к массиву,
+       поэтому все кружки листа считаются одной векторной операцией NumPy.
+
+    Пороги (доли от 0 до 1) берутся из settings:
+    - GRADER_FILL_MIN_RATIO: ниже — кружок пустой.
+    - GRADER_DOUBLE_MARK_RATIO: если второй кружок закрашен не меньше чем на эту долю
+      от лучшего (и сам выше минимума) — это двойная отметка.
+    """
+
+    def __init__(self, min_fill=None, double_ratio=None, inset=0.2):
+        self.min_fill = settings.GRADER_FILL_MIN_RATIO if min_fill is None else min_fill
+        self.double_ratio = settings.GRADER_DOUBLE_MARK_RATIO if double_ratio is None else double_ratio
+        # Отступ внутрь рамки кружка (доля ширины/высоты), чтобы не считать контур и шум по краям
+        self.inset = inset
+
+    def fill_ratios(self, thresh, boxes):
+        """
+        thresh: бинарное изображение (кружок/чернила > 0).
+        boxes: массив (..., 4) с рамками x, y, w, h в пикселях.
+        Возвращает массив (...) долей закрашенных пикселей внутри каждой рамки.
+        """
+        integral = cv2.integral((thresh > 0).astype(np.uint8))
+        height, width = thresh.shape[:2]
+
+        b = np.asarray(boxes, dtype=np.float32)
+        x, y, w, h = b[..., 0], b[..., 1], b[..., 2], b[..., 3]
+
+        x0 = np.clip(np.rint(x + w * self.inset), 0, width).astype(np.intp)
+        x1 = np.clip(np.rint(x + w * (1 - self.inset)), 0, width).astype(np.intp)
+        y0 = np.clip(np.rint(y + h * self.inset), 0, height).astype(np.intp)
+        y1 = np.clip(np.rint(y + h * (1 - self.inset)), 0, height).astype(np.intp)
+
+        filled = integral[y1, x1] - integral[y0, x1] - integral[y1, x0] + integral[y0, x0]
+        area = np.maximum((x1 - x0) * (y1 - y0), 1)
+        return filled / area
+
+    def decide(self, ratios):
+        """
+        ratios: массив (вопросы, варианты).
+        Возвращает список ответов: буква, None (пусто) или DOUBLE_MARK (несколько отметок).
+        """
+        ratios = np.asarray(ratios, dtype=np.float32)
+        if ratios.size == 0:
+            return []
+
+        order = np.argsort(-ratios, axis=1)
+        best_idx = order[:, 0]
+        best = np.take_along_axis(ratios, order[:, :1], axis=1)[:, 0]
+
+        if ratios.shape[1] > 1:
+            second = np.take_along_axis(ratios, order[:, 1:2], axis=1)[:, 0]
+        else:
+            second = np.zeros_like(best)
+
+        blank = best < self.min_fill
+        double = ~blank & (second >= self.min_fill) & (second >= best * self.double_ratio)
+
+        answers = []
+        for q, idx in enumerate(best_idx):
+            if blank[q]:
+                answers.append(None)
+            elif double[q]:
+                answers.append(DOUBLE_MARK)
+            else:
+                answers.append(OPTIONS[idx])
+        return answers
@@ -7,6 +7,8 @@ from reportlab.lib.utils import ImageReader
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 import os
+from . import sheet_layout
+from .sheet_layout import layout_for_questions
 
 class PDFGenerator:
     def __init__(self):
@@ -40,13 +42,13 @@ class PDFGenerator:
         qr_img = self.generate_qr(qr_data)
         
         # Конвертируем для ReportLab
-        side_size = 100
         qr_buffer = io.BytesIO()
         qr_img.save(qr_buffer, format="PNG")
         qr_buffer.seek(0)
         
-        # Рисуем QR (координаты X, Y - от левого нижнего угла)
-        self.p.drawImage(ImageReader(qr_buffer), self.width - 130, self.height - 130, width=side_size, height=side_size)
+        # Рисуем QR (координаты X, Y - от левого нижнего угла). Центр QR — опорная точка грейдера
+        qr_x, qr_y = sheet_layout.QR_ORIGIN
+        self.p.drawImage(ImageReader(qr_buffer), qr_x, qr_y, width=sheet_layout.QR_SIZE, height=sheet_layout.QR_SIZE)
 
         # 2. Текст (Слева)
         self.p.setFont(self.font_name, 18)
@@ -62,39 +64,46 @@ class PDFGenerator:
         # Линия разделения
         self.p.line(50, self.height - 140, self.width - 50, self.height - 140)
 
-    def draw_bubble_sheet(self, questions_count=20):
-        """Рисует сетку ответов (Кружочки)"""
-        start_y = self.height - 180
-        start_x = 50
-        
+    def draw_bubble_sheet(self, questions_count=20, layout=None):
+        """Рисует сетку ответов (Кружочки) по сетке из sheet_layout — по ней же читает GraderService"""
+        layout = layout or layout_for_questions(questions_count)
+
         self.p.setFont(self.font_name, 10)
-        self.p.drawString(start_x, start_y + 20, "Mark your answers clearly:")
+        self.p.drawString(layout.columns[0], layout.first_row_y + 20, "Mark your answers clearly:")
 
-        # Рисуем строки
+        self.p.setFont(self.font_name, layout.font_size)
+        options = ['A', 'B', 'C', 'D']
         for i in range(questions_count):
-            y_pos = start_y - (i * 25)
-            
             # Номер вопроса
-            self.p.drawString(start_x, y_pos, f"{i+1}.")
-            
+            x_pos, y_pos = layout.question_origin(i)
+            self.p.drawString(x_pos, y_pos, f"{i+1}.")
+
             # Варианты A, B, C, D
-            options = ['A', 'B', 'C', 'D']
             for j, opt in enumerate(options):
-                x_pos = start_x + 50 + (j * 40)
-                
+                cx, cy = layout.bubble_center(i, j)
                 # Кружочек
-                self.p.circle(x_pos + 5, y_pos + 3, 8, stroke=1, fill=0)
-                # Буква внутри (опционально, или над кружком)
-                self.p.drawString(x_pos + 2, y_pos, opt)
+                self.p.circle(cx, cy, layout.bubble_radius, stroke=1, fill=0)
+                # Буква внутри кружка
+                self.p.drawString(cx - 3, y_pos, opt)
 
     def create_student_page(self, student, exam, variant):
         """Создает одну страницу PDF для конкретного студента"""
         
+        # Кол-во вопросов берем из экзамена, или 20 по умолчанию
+        q_count = 20
+        # Проверяем, есть ли у exam атрибут questions_count (через related manager)
+        if hasattr(exam, 'questions') and exam.questions.exists():
+             q_count = exam.questions.count()
+
+        layout = layout_for_questions(q_count)
+
         # Данные для QR (минимум байтов для легкого сканирования)
+        # "l" — версия сетки бланка, по ней грейдер знает координаты кружков
         qr_payload = {
             "uid": student.id,
             "eid": exam.id,
-            "v": variant
+            "v": variant,
+            "l": layout.version
         }
 
         # 🔥 ИСПРАВЛЕНИЕ: Собираем имя вручную из полей модели
@@ -108,18 +117,13 @@ class PDFGenerator:
         # Рисуем элементы
         self.draw_header(full_name, exam.title, variant, qr_payload)
         
-        # Кол-во вопросов берем из экзамена, или 20 по умолчанию
-        q_count = 20
-        # Проверяем, есть ли у exam атрибут questions_count (через related manager)
-        if hasattr(exam, 'questions') and exam.questions.exists():
-             q_count = exam.questions.count()
-        
-        self.draw_bubble_sheet(questions_count=q_count)
+        self.draw_bubble_sheet(questions_count=q_count, layout=layout)
         
         # Маркеры по углам (Якоря для выравнивания скана)
-        self.p.rect(30, 30, 10, 10, fill=1) # Левый нижний
-        self.p.rect(self.width-40, 30, 10, 10, fill=1) # Правый нижний
-        self.p.rect(30, self.height-40, 10, 10, fill=1) # Левый верхний
+        size = sheet_layout.ANCHOR_SIZE
+        self.p.rect(*sheet_layout.ANCHOR_BOTTOM_LEFT, size, size, fill=1) # Левый нижний
+        self.p.rect(*sheet_layout.ANCHOR_BOTTOM_RIGHT, size, size, fill=1) # Правый нижний
+        self.p.rect(*sheet_layout.ANCHOR_TOP_LEFT, size, size, fill=1) # Левый верхний
         
         # Конец страницы
         self.p.showPage()
@@ -0,0 +1,187 @@
+import random
+import secrets
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from ..models import Student, UserProfile
+
+# Алфавит паролей без похожих символов (l/1, O/0)
+PASSWORD_CHARS = "abcdefghijkmnpqrstuvwxyzABCDEFGHJKLMNPQRSTUVWXYZ23456789"
+
+_TRANSLIT = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'yo', 'ж': 'zh', 'з': 'z',
+    'и': 'i', 'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r',
+    'с': 's', 'т': 't', 'у': 'u', 'ф': 'f', 'х': 'kh', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'shch',
+    'ъ': '', 'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya', 'ғ': 'gh', 'қ': 'q', 'ҳ': 'h',
+    'ҷ': 'j', 'ӣ': 'i', 'ӯ': 'u'
+}
+
+
+def generate_password(length=8):
+    while True:
+        password = ''.join(secrets.choice(PASSWORD_CHARS) for _ in range(length))
+        if any(c.isdigit() for c in password) and any(c.isalpha() for c in password):
+            return password
+
+
+def transliterate(text):
+    return ''.join(_TRANSLIT.get(ch, ch) for ch in (text or '').lower() if ch.isalnum())
+
+
+class ProvisioningService:
+    """
+    👥 МАССОВОЕ СОЗДАНИЕ УЧЕТНЫХ ЗАПИСЕЙ УЧЕНИКОВ
+
+    Вместо цепочки create_user -> UserProfile -> Student на каждого ученика:
+    1. Пароли хэшируются параллельно (PBKDF2 — это CPU; hashlib отпускает GIL, поэтому хватает потоков).
+    2. Users, UserProfile и Student создаются через bulk_create пачками по BATCH_SIZE.
+    Сигналы post_save у bulk_create не срабатывают, поэтому профиль с ролью 'student' создаем сами.
+    """
+
+    BATCH_SIZE = 500
+
+    @staticmethod
+    def hash_passwords(passwords):
+        """Список сырых паролей -> список хэшей (в том же порядке)."""
+        if len(passwords) < 2:
+            return [make_password(p) for p in passwords]
+        with ThreadPoolExecutor(max_workers=settings.PROVISIONING_HASH_WORKERS) as pool:
+            return list(pool.map(make_password, passwords))
+
+    @staticmethod
+    def make_username(last_name, first_name, taken):
+        """Логин вида IvanovI123, уникальный относительно множества taken (пополняется)."""
+        base = transliterate(last_name).capitalize() or "Student"
+        initial = transliterate(first_name[:1]).upper() if first_name else ""
+        while True:
+            username = f"{base}{initial}{random.randint(100, 999)}"
+            if username not in taken:
+                taken.add(username)
+                return username
+
+    @staticmethod
+    def _taken_usernames(candidates):
+        """Какие из логинов уже заняты (User или Student) — два запроса на всю пачку."""
+        candidates = list(candidates)
+        taken = set(User.objects.filter(username__in=candidates).values_list('username', flat=True))
+        taken.update(Student.objects.filter(username__in=candidates).values_list('username', flat=True))
+        return taken
+
+    @staticmethod
+    def new_username(last_name, first_name):
+        """Один свободный логин (создание ученика вручную): make_username + проверка по базе."""
+        taken = set()
+        while True:
+            username = ProvisioningService.make_username(last_name, first_name, taken)
+            if not ProvisioningService._taken_usernames([username]):
+                return username
+
+    @staticmethod
+    def _assign_usernames(students):
+        """Выдает логины ученикам без логина, проверяя занятость одной пачкой."""
+        taken = set()
+        pending = [s for s in students if not s.username or len(s.username) < 3]
+        while pending:
+            proposed = {}
+            for student in pending:
+                username = ProvisioningService.make_username(student.last_name_ru, student.first_name_ru, taken)
+                proposed[username] = student
+            busy = ProvisioningService._taken_usernames(proposed)
+            for username, student in proposed.items():
+                if username not in busy:
+                    student.username = username
+            # Редкие коллизии с базой — на следующий круг
+            pending = [s for s in pending if not s.username or len(s.username) < 3]
+
+    @staticmethod
+    def create_students(specs, school_id, student_class):
+        """
+        Создает новых учеников вместе с User и профилем.
+        specs: список dict с first_name_ru, last_name_ru, custom_id (необязательно).
+        Возвращает список пар (student, сырой пароль) в порядке specs.
+        """
+        if not specs:
+            return []
+
+        students = []
+        for spec in specs:
+            first, last = spec.get('first_name_ru') or "Student", spec.get('last_name_ru') or "Unknown"
+            # bulk_create не вызывает Student.save(), поэтому TJ/EN имена заполняем сами
+            students.append(Student(
+                school_id=school_id,
+                student_class=student_class,
+                custom_id=spec.get('custom_id') or None,
+                first_name_ru=first, last_name_ru=last,
+                first_name_tj=first, last_name_tj=last,
+                first_name_en=first, last_name_en=last,
+            ))
+
+        ProvisioningService._assign_usernames(students)
+        passwords = [generate_password() for _ in students]
+        hashes = ProvisioningService.hash_passwords(passwords)
+
+        size = ProvisioningService.BATCH_SIZE
+        with transaction.atomic():
+            users = User.objects.bulk_create([
+                User(username=s.username, password=h, first_name=s.first_name_ru, last_name=s.last_name_ru, is_active=True)
+                for s, h in zip(students, hashes)
+            ], batch_size=size)
+            UserProfile.objects.bulk_create([
+                UserProfile(user=u, role='student', school_id=school_id) for u in users
+            ], batch_size=size)
+            students = Student.objects.bulk_create(students, batch_size=size)
+
+        return list(zip(students, passwords))
+
+    @staticmethod
+    def reset_credentials(students):
+        """
+        Выдает логины (если нет), новые пароли, активирует User и ставит роль 'student'.
+        Работает пачкой: одно чтение Users/профилей, bulk_create для новых, bulk_update для старых.
+        Возвращает {student.id: сырой пароль}.
+        """
+        students = list(students)
+        if not students:
+            return {}
+
+        ProvisioningService._assign_usernames(students)
+        passwords = [generate_password() for _ in students]
+        hashes = ProvisioningService.hash_passwords(passwords)
+        by_username = {s.username: (s, h) for s, h in zip(students, hashes)}
+
+        size = ProvisioningService.BATCH_SIZE
+        with transaction.atomic():
+            Student.objects.bulk_update(students, ['username'], batch_size=size)
+
+            users = {u.username: u for u in User.objects.filter(username__in=by_username)}
+            for username, (student, hashed) in by_username.items():
+                user = users.get(username)
+                if user is None:
+                    users[username] = User(username=username, password=hashed, first_name=student.first_name_ru,
+                                           last_name=student.last_name_ru, is_active=True)
+                else:
+                    user.password = hashed
+                    user.is_active = True
+
+            new_users = [u for u in users.values() if u.pk is None]
+            User.objects.bulk_update([u for u in users.values() if u.pk is not None], ['password', 'is_active'], batch_size=size)
+            User.objects.bulk_create(new_users, batch_size=size)
+
+            # Профили: роль 'student' и школа ученика
+            profiles = {p.user_id: p for p in UserProfile.objects.filter(user__in=users.values())}
+            to_create = []
+            for username, user in users.items():
+                student = by_username[username][0]
+                profile = profiles.get(user.pk)
+                if profile is None:
+                    to_create.append(UserProfile(user=user, role='student', school_id=student.school_id))
+                else:
+                    profile.role = 'student'
+                    profile.school_id = student.school_id
+            UserProfile.objects.bulk_update(profiles.values(), ['role', 'school'], batch_size=size)
+            UserProfile.objects.bulk_create(to_create, batch_size=size)
+
+        return {s.id: p for s, p in zip(students, passwords)}
@@ -0,0 +1,167 @@
+from collections import defaultdict
+from django.db import transaction
+
+from ..models import Exam, ExamResult, SubjectScore, QuestionResponse
+from .analytics_cache import AnalyticsCache
+
+# Буквы вариантов по порядку (для онлайн-экзамена, где хранится индекс выбранного варианта)
+LETTERS = ('A', 'B', 'C', 'D', 'E', 'F')
+
+
+class ResultFactsService:
+    """
+    📊 ФАКТ-ТАБЛИЦЫ АНАЛИТИКИ ИЗ ExamResult.details
+
+    Из details каждого результата строятся:
+    - SubjectScore:      верных/всего по предмету (рейтинги, дашборды)
+    - QuestionResponse:  ответ на каждый вопрос (тепловые карты, статистика заданий)
+
+    Понимает все форматы details, которые пишет система:
+    - ImportService:   {"<номер в буклете>": {"s": 0/1, "v": "A", "sb": "MAT"}} -> вопрос из question_order
+    - GraderService:   {"<номер на бланке>": {"student", "correct", "is_match"}} -> вопросы экзамена по id
+    - Онлайн-экзамен:  {"<id вопроса>": {"correct": bool, "u_idx": 0}}
+    Предмет вопроса = question.topic.subject. Вопросы без темы в SubjectScore не попадают.
+    """
+
+    BATCH_SIZE = 1000
+
+    @staticmethod
+    def exam_contexts(exam_ids):
+        """
+        Карты вопросов по экзаменам (2 запроса на любое число экзаменов):
+        {exam_id: {"booklet": {номер: id вопроса}, "ordered": [id по порядку], "subjects": {id вопроса: id предмета}}}
+        """
+        contexts = {}
+        for exam_id, own_map, shared_map in Exam.objects.filter(id__in=exam_ids).values_list(
+            'id', 'question_order', 'booklet__question_order'
+        ):
+            # Сгенерированные варианты держат карту в общей версии буклета (BookletVersion)
+            order_map = shared_map if shared_map is not None else own_map
+            booklet = {}
+            for num, map_data in (order_map or {}).items():
+                booklet[str(num)] = map_data if isinstance(map_data, int) else (map_data or {}).get('id')
+            contexts[exam_id] = {"booklet": booklet, "ordered": [], "subjects": {}}
+
+        links = (
+            Exam.questions.through.objects.filter(exam_id__in=exam_ids)
+            .order_by('question_id')
+            .values_list('exam_id', 'question_id', 'question__topic__subject_id')
+        )
+        for exam_id, question_id, subject_id in links:
+            context = contexts.get(exam_id)
+            if context is None:
+                continue
+            context["ordered"].append(question_id)
+            if subject_id:
+                context["subjects"][question_id] = subject_id
+        return contexts
+
+    @staticmethod
+    def iter_answers(details, context):
+        """
+        Ответы одного результата в едином виде:
+        (номер в буклете/на бланке, id вопроса, выбранная буква или '', верно ли).
+        Ответы, которые не удалось привязать к вопросу экзамена, пропускаются.
+        """
+        if not isinstance(details, dict) or not context:
+            return
+
+        for key, value in details.items():
+            if not isinstance(value, dict):
+                continue
+            number = int(key) if str(key).isdigit() else None
+
+            if "s" in value:
+                question_id = context["booklet"].get(str(key))
+                chosen = value.get("v")
+                is_correct = bool(value.get("s"))
+            elif "is_match" in value:
+                index = number - 1 if number else -1
+                question_id = context["ordered"][index] if 0 <= index < len(context["ordered"]) else None
+                chosen = value.get("student")
+                is_correct = bool(value.get("is_match"))
+            elif isinstance(value.get("correct"), bool):
+                question_id = number
+                u_idx = value.get("u_idx")
+                chosen = LETTERS[u_idx] if isinstance(u_idx, int) and 0 <= u_idx < len(LETTERS) else None
+                is_correct = value["correct"]
+                # Онлайн-экзамен хранит id вопроса — номер берем по порядку вопросов экзамена
+                number = context["ordered"].index(question_id) + 1 if question_id in context["ordered"] else None
+            else:
+                continue
+
+            if question_id is None or number is None:
+                continue
+            if chosen in (None, '-'):
+                chosen = ''
+            yield number, question_id, str(chosen)[:1], is_correct
+
+    @staticmethod
+    def rebuild(results, contexts=None):
+        """
+        Пересчитывает SubjectScore и QuestionResponse для списка ExamResult (старые строки удаляются).
+        Результатам без pk (после bulk_create на БД без RETURNING) pk подтягивается одним запросом.
+        Сбрасывает кэш аналитики (AnalyticsCache): все пути записи результатов проходят через rebuild.
+        Сброс — после COMMIT внешней транзакции, чтобы новую версию кэша не заполнили данными до коммита.
+        Возвращает (строк SubjectScore, строк QuestionResponse).
+        """
+        results = [r for r in results if r is not None]
+        if not results:
+            return 0, 0
+
+        ResultFactsService._ensure_pks(results)
+        if contexts is None:
+            contexts = ResultFactsService.exam_contexts({r.exam_id for r in results})
+
+        scores, responses = [], []
+        for result in results:
+            context = contexts.get(result.exam_id)
+            counts = defaultdict(lambda: [0, 0])
+            seen = set()
+
+            for number, question_id, chosen, is_correct in ResultFactsService.iter_answers(result.details, context):
+                if question_id in seen:  # Один вопрос дважды в карте — считаем один раз
+                    continue
+                seen.add(question_id)
+                responses.append(QuestionResponse(
+                    result_id=result.pk, question_id=question_id, booklet_num=number,
+                    chosen=chosen, is_correct=is_correct
+                ))
+
+                subject_id = context["subjects"].get(question_id)
+                if subject_id is not None:
+                    counts[subject_id][1] += 1
+                    if is_correct:
+                        counts[subject_id][0] += 1
+
+            for subject_id, (correct, total) in counts.items():
+                scores.append(SubjectScore(
+                    result_id=result.pk, student_id=result.student_id, subject_id=subject_id,
+                    correct=correct, total=total
+                ))
+
+        result_ids = [r.pk for r in results]
+        size = ResultFactsService.BATCH_SIZE
+        with transaction.atomic():
+            SubjectScore.objects.filter(result_id__in=result_ids).delete()
+            QuestionResponse.objects.filter(result_id__in=result_ids).delete()
+            SubjectScore.objects.bulk_create(scores, batch_size=size)
+            QuestionResponse.objects.bulk_create(responses, batch_size=size)
+        transaction.on_commit(AnalyticsCache.invalidate)
+        return len(scores), len(responses)
+
+    @staticmethod
+    def _ensure_pks(results):
+        missing = [r for r in results if r.pk is None]
+        if not missing:
+            return
+        pks = {
+            (student_id, exam_id): pk
+            for pk, student_id, exam_id in ExamResult.objects.filter(
+                student_id__in={r.student_id for r in missing},
+                exam_id__in={r.exam_id for r in missing},
+            ).values_list('id', 'student_id', 'exam_id')
+        }
+        for result in missing:
+            result.pk = pks.get((result.student_id, result.exam_id))
+        results[:] = [r for r in results if r.pk is not None]
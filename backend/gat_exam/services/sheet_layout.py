@@ -0,0 +1,127 @@
+import numpy as np
+from reportlab.lib.pagesizes import A4
+
+# ==============================================================================
+# 📐 ГЕОМЕТРИЯ БЛАНКА ОТВЕТОВ (общая для PDFGenerator и GraderService)
+# ==============================================================================
+# Все координаты — в пунктах PDF (origin: левый нижний угол, как в ReportLab).
+# Грейдер переводит их в пиксели выровненного скана (origin: левый верхний угол).
+
+PAGE_WIDTH, PAGE_HEIGHT = A4
+
+# Размер выровненного скана (A4 при 150 DPI)
+A4_WIDTH_PX = 1240
+A4_HEIGHT_PX = 1754
+SCALE_PX = A4_WIDTH_PX / PAGE_WIDTH
+
+# Якоря: черные квадраты ANCHOR_SIZE x ANCHOR_SIZE (левый нижний угол каждого)
+ANCHOR_SIZE = 10
+ANCHOR_TOP_LEFT = (30, PAGE_HEIGHT - 40)
+ANCHOR_BOTTOM_LEFT = (30, 30)
+ANCHOR_BOTTOM_RIGHT = (PAGE_WIDTH - 40, 30)
+
+# QR-код (правый верхний угол) — четвертая опорная точка выравнивания
+QR_ORIGIN = (PAGE_WIDTH - 130, PAGE_HEIGHT - 130)
+QR_SIZE = 100
+
+# Вариантов ответа на вопрос (A, B, C, D)
+OPTIONS_COUNT = 4
+
+
+def _center(origin, size):
+    return origin[0] + size / 2, origin[1] + size / 2
+
+
+def alignment_points_px():
+    """
+    Целевые точки выравнивания в пикселях скана.
+    Порядок: [Top-Left (якорь), Top-Right (центр QR), Bottom-Right (якорь), Bottom-Left (якорь)]
+    """
+    points = [
+        _center(ANCHOR_TOP_LEFT, ANCHOR_SIZE),
+        _center(QR_ORIGIN, QR_SIZE),
+        _center(ANCHOR_BOTTOM_RIGHT, ANCHOR_SIZE),
+        _center(ANCHOR_BOTTOM_LEFT, ANCHOR_SIZE),
+    ]
+    return np.array([[x * SCALE_PX, (PAGE_HEIGHT - y) * SCALE_PX] for x, y in points], dtype="float32")
+
+
+class SheetLayout:
+    """
+    Версионированная сетка кружков.
+    Вопросы идут по колонкам сверху вниз: №1..rows_per_column в первой колонке, дальше во второй и т.д.
+    Версия печатается в QR (ключ "l"), поэтому старые бланки читаются по своей сетке.
+    """
+
+    def __init__(self, version, columns, rows_per_column, row_pitch, option_pitch,
+                 number_offset, bubble_radius, font_size=10, first_row_y=PAGE_HEIGHT - 180):
+        self.version = version
+        self.columns = columns                # X начала каждой колонки (номер вопроса)
+        self.rows_per_column = rows_per_column
+        self.row_pitch = row_pitch            # Шаг между строками
+        self.option_pitch = option_pitch      # Шаг между кружками A-B-C-D
+        self.number_offset = number_offset    # От номера вопроса до центра кружка "A"
+        self.bubble_radius = bubble_radius
+        self.font_size = font_size
+        self.first_row_y = first_row_y        # Базовая линия первой строки
+
+    @property
+    def capacity(self):
+        return len(self.columns) * self.rows_per_column
+
+    def question_origin(self, index):
+        """(x, y) номера вопроса по индексу (с 0)."""
+        column, row = divmod(index, self.rows_per_column)
+        return self.columns[column], self.first_row_y - row * self.row_pitch
+
+    def bubble_center(self, index, option):
+        x, y = self.question_origin(index)
+        return x + self.number_offset + option * self.option_pitch, y + 3
+
+    def bubble_boxes_px(self, questions_count):
+        """
+        Рамки (x, y, w, h) всех кружков в пикселях выровненного скана.
+        Массив (вопросы, OPTIONS_COUNT, 4) — готовый вход для BubbleFillEngine.fill_ratios.
+        """
+        count = min(questions_count, self.capacity)
+        index = np.arange(count)
+        column, row = np.divmod(index, self.rows_per_column)
+
+        x = np.asarray(self.columns, dtype=np.float32)[column][:, None] + self.number_offset \
+            + np.arange(OPTIONS_COUNT) * self.option_pitch
+        y = np.broadcast_to((self.first_row_y - row * self.row_pitch + 3)[:, None], x.shape)
+
+        r = self.bubble_radius
+        boxes = np.stack([
+            (x - r) * SCALE_PX,
+            (PAGE_HEIGHT - y - r) * SCALE_PX,
+            np.full(x.shape, 2 * r * SCALE_PX),
+            np.full(x.shape, 2 * r * SCALE_PX),
+        ], axis=-1)
+        return boxes.astype(np.float32)
+
+
+LAYOUTS = {
+    # v1 — исходный бланк: одна колонка, шаг 25 pt (до 24 вопросов)
+    'v1': SheetLayout('v1', columns=[50], rows_per_column=24, row_pitch=25,
+                      option_pitch=40, number_offset=55, bubble_radius=8),
+    # v2 — компактный бланк: 4 колонки по 30 строк (до 120 вопросов)
+    'v2': SheetLayout('v2', columns=[45, 170, 295, 420], rows_per_column=30, row_pitch=20,
+                      option_pitch=24, number_offset=30, bubble_radius=7, font_size=8),
+}
+
+DEFAULT_LAYOUT = 'v1'
+
+
+def get_layout(version=None):
+    """Сетка по версии из QR. Неизвестная/пустая версия -> исходный бланк v1."""
+    return LAYOUTS.get(version or DEFAULT_LAYOUT, LAYOUTS[DEFAULT_LAYOUT])
+
+
+def layout_for_questions(questions_count):
+    """Самая крупная сетка, в которую помещаются все вопросы."""
+    for layout in LAYOUTS.values():
+        if questions_count <= layout.capacity:
+            return layout
+    max_capacity = max(layout.capacity for layout in LAYOUTS.values())
+    raise ValueError(f"На один бланк помещается не больше {max_capacity} вопросов (запрошено {questions_count}).")
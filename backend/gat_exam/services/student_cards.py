@@ -0,0 +1,187 @@
+import io
+import os
+import qrcode
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import A4
+from reportlab.lib import colors
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.lib.units import mm
+
+FONTS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'views', 'fonts')
+
+# Фоновые PDF с паролями: лежат в хранилище не дольше STUDENT_CARDS_TTL,
+# наружу отдаются только через StudentViewSet.download_pdf_cards (без публичной ссылки)
+CARDS_FOLDER = 'student_cards'
+
+
+def cards_path(task_id):
+    return f"{CARDS_FOLDER}/{task_id}.pdf"
+
+
+def render_access_cards(students, passwords, output):
+    """
+    🪪 КАРТОЧКИ ДОСТУПА УЧЕНИКОВ (PDF, 10 карточек на лист A4)
+    passwords: {student.id: сырой пароль} — выдаются заранее через ProvisioningService.
+    output: файл/HttpResponse, куда пишется PDF.
+    """
+    c = canvas.Canvas(output, pagesize=A4)
+    page_width, page_height = A4
+
+    # Шрифты (как в прошлом коде)
+    font_name = "Helvetica"
+    font_bold = "Helvetica-Bold"
+    possible_font_paths = [
+        os.path.join(FONTS_DIR, 'arial.ttf'),
+        "C:\\Windows\\Fonts\\arial.ttf",
+        "/usr/share/fonts/truetype/msttcorefonts/Arial.ttf",
+    ]
+    possible_bold_paths = [
+        os.path.join(FONTS_DIR, 'arialbd.ttf'),
+        "C:\\Windows\\Fonts\\arialbd.ttf",
+    ]
+
+    found_font = None
+    for path in possible_font_paths:
+        if os.path.exists(path):
+            found_font = path
+            break
+    
+    found_bold = None
+    for path in possible_bold_paths:
+         if os.path.exists(path):
+            found_bold = path
+            break
+
+    try:
+        if found_font:
+            pdfmetrics.registerFont(TTFont('CustomFont', found_font))
+            font_name = 'CustomFont'
+            if found_bold:
+                pdfmetrics.registerFont(TTFont('CustomFont-Bold', found_bold))
+                font_bold = 'CustomFont-Bold'
+            else:
+                font_bold = 'CustomFont'
+    except Exception as e:
+        print(f"Font error: {e}")
+
+    card_width = 90 * mm
+    card_height = 53 * mm
+    col_gap = 10 * mm
+    row_gap = 4 * mm
+    
+    total_content_width = (2 * card_width) + col_gap
+    total_content_height = (5 * card_height) + (4 * row_gap)
+    
+    margin_x = (page_width - total_content_width) / 2
+    margin_y = (page_height - total_content_height) / 2
+    
+    x_start = margin_x
+    y_start_top = page_height - margin_y - card_height
+    
+    col = 0
+    row = 0
+    
+    primary_color = colors.HexColor("#4F46E5")
+    secondary_color = colors.HexColor("#EEF2FF")
+    text_dark = colors.HexColor("#111827")
+    text_gray = colors.HexColor("#6B7280")
+
+    # QR одинаковый на всех карточках — рисуем его один раз
+    qr = qrcode.QRCode(box_size=10, border=0)
+    qr.add_data("https://www.edutest.tj")
+    qr.make(fit=True)
+    img = qr.make_image(fill_color="white", back_color="#4F46E5")
+    img_buffer = io.BytesIO()
+    img.save(img_buffer, format="PNG")
+    img_buffer.seek(0)
+    qr_image = ImageReader(img_buffer)
+
+    for student in students:
+        # Пароль выдан заранее (ProvisioningService) — здесь только рисование
+        new_password_for_card = passwords.get(student.id) if student.username else None
+        if not new_password_for_card:
+            new_password_for_card = "Error: No Login"
+
+        # Рисование карточки (без изменений)
+        x = x_start + (col * (card_width + col_gap))
+        y = y_start_top - (row * (card_height + row_gap))
+
+        c.setFillColor(colors.HexColor("#E5E7EB"))
+        c.roundRect(x + 1 * mm, y - 1 * mm, card_width, card_height, 3 * mm, fill=1, stroke=0)
+        c.setFillColor(colors.white)
+        c.roundRect(x, y, card_width, card_height, 3 * mm, fill=1, stroke=0)
+
+        sidebar_width = 25 * mm
+        c.setFillColor(primary_color)
+        p = c.beginPath()
+        p.moveTo(x + sidebar_width, y)
+        p.lineTo(x + 3 * mm, y)
+        p.arcTo(x, y, x, y + 3 * mm, 3 * mm)
+        p.lineTo(x, y + card_height - 3 * mm)
+        p.arcTo(x, y + card_height, x + 3 * mm, y + card_height, 3 * mm)
+        p.lineTo(x + sidebar_width, y + card_height)
+        p.lineTo(x + sidebar_width, y)
+        c.drawPath(p, fill=1, stroke=0)
+
+        c.drawImage(qr_image, x + 2.5 * mm, y + 15 * mm, width=20 * mm, height=20 * mm, mask='auto')
+
+        c.setFillColor(colors.white)
+        c.setFont(font_bold, 6)
+        c.drawCentredString(x + 12.5 * mm, y + 11 * mm, "SCAN ME")
+        
+        content_x = x + sidebar_width + 5 * mm
+        
+        if student.school.logo:
+            try:
+                logo_path = student.school.logo.path
+                if os.path.exists(logo_path):
+                    c.drawImage(logo_path, x + card_width - 12 * mm, y + card_height - 12 * mm, width=8 * mm, height=8 * mm, mask='auto')
+            except: pass
+
+        c.setFillColor(text_gray)
+        c.setFont(font_name, 7)
+        school_name = student.school.name
+        c.drawString(content_x, y + card_height - 10 * mm, school_name[:35].upper())
+
+        c.setFillColor(text_dark)
+        c.setFont(font_bold, 12)
+        lname = student.last_name_ru or ""
+        fname = student.first_name_ru or ""
+        full_name = f"{lname} {fname}"
+        c.drawString(content_x, y + card_height - 18 * mm, full_name[:22])
+
+        c.setFillColor(primary_color)
+        c.setFont(font_bold, 9)
+        class_txt = str(student.student_class) if student.student_class else "-"
+        c.drawString(content_x, y + card_height - 23 * mm, f"Класс: {class_txt}")
+
+        box_y = y + 10 * mm
+        box_height = 14 * mm
+        box_width = card_width - sidebar_width - 10 * mm
+        
+        c.setFillColor(secondary_color)
+        c.roundRect(content_x, box_y, box_width, box_height, 2 * mm, fill=1, stroke=0)
+        
+        c.setFillColor(text_gray)
+        c.setFont(font_name, 6)
+        c.drawString(content_x + 3 * mm, box_y + 9 * mm, "LOGIN")
+        c.drawString(content_x + 3 * mm, box_y + 3 * mm, "PASSWORD")
+        
+        c.setFillColor(text_dark)
+        c.setFont(font_bold, 10)
+        c.drawString(content_x + 20 * mm, box_y + 9 * mm, student.username or "-")
+        c.drawString(content_x + 20 * mm, box_y + 3 * mm, new_password_for_card)
+
+        col += 1
+        if col >= 2:
+            col = 0
+            row += 1
+        if row >= 5:
+            c.showPage()
+            col = 0
+            row = 0
+
+    c.save()
+
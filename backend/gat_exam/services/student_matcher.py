@@ -0,0 +1,145 @@
+import re
+from collections import defaultdict
+from difflib import SequenceMatcher
+
+# Кириллица (RU + TJ) -> латиница, чтобы "Иванов", "Ivanov" и "Иваноф" сходились в один ключ
+_TRANSLIT = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'e', 'ж': 'zh', 'з': 'z',
+    'и': 'i', 'й': 'i', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r',
+    'с': 's', 'т': 't', 'у': 'u', 'ф': 'f', 'х': 'kh', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'sh',
+    'ъ': '', 'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya',
+    # Таджикские буквы
+    'ғ': 'gh', 'ӣ': 'i', 'қ': 'q', 'ӯ': 'u', 'ҳ': 'h', 'ҷ': 'j',
+}
+
+_NOT_LETTER_RE = re.compile(r'[^a-z0-9]+')
+
+
+def normalize_name(text):
+    """
+    Ключ имени для сравнения: нижний регистр, транслит, без знаков, токены по алфавиту.
+    "Иванов Иван" и "ivan IVANOV" -> "ivan ivanov".
+    """
+    if not text or text != text:  # пусто или NaN из pandas
+        return ''
+    latin = ''.join(_TRANSLIT.get(ch, ch) for ch in str(text).lower())
+    tokens = [t for t in _NOT_LETTER_RE.split(latin) if t]
+    return ' '.join(sorted(tokens))
+
+
+def trigrams(key):
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def normalize_id(value):
+    """ID из Excel приходит как int, float (1234.0) или строка — приводим к строке."""
+    if value is None:
+        return ''
+    if isinstance(value, float):
+        if value != value:  # NaN
+            return ''
+        if value.is_integer():
+            value = int(value)
+    return str(value).strip()
+
+
+class StudentMatcher:
+    """
+    🔎 ИНДЕКС УЧЕНИКОВ ДЛЯ ИМПОРТА
+
+    Строится один раз на школу/параллель и отвечает на поиск без перебора всего списка:
+    1. Хэш-индексы по custom_id и id (точное совпадение).
+    2. Хэш-индекс по нормализованному имени (normalize_name для RU/TJ/EN написаний).
+    3. Нечеткий поиск: кандидаты отбираются по общим триграммам (blocking),
+       и только для короткого списка считается SequenceMatcher.
+    """
+
+    # Порог схожести имен (SequenceMatcher.ratio)
+    MIN_RATIO = 0.85
+    # Сколько кандидатов после триграммного отбора проверяем точной метрикой
+    SHORTLIST_SIZE = 10
+    # Минимальная доля общих триграмм, чтобы попасть в кандидаты
+    MIN_TRIGRAM_SHARE = 0.4
+    # По скольким самым редким триграммам запроса собираем кандидатов
+    BLOCKING_GRAMS = 4
+
+    def __init__(self, students=()):
+        self.by_custom_id = {}
+        self.by_id = {}
+        self.by_name = {}
+        self.keys = []            # Ключ имени по номеру записи
+        self.students = []        # Ученик по номеру записи
+        self.entry_grams = []     # Триграммы ключа по номеру записи
+        self.grams = defaultdict(set)  # Триграмма -> номера записей
+        for student in students:
+            self.add(student)
+
+    def add(self, student):
+        """Добавляет ученика во все индексы (в т.ч. только что созданного при импорте)."""
+        if student.custom_id:
+            self.by_custom_id.setdefault(normalize_id(student.custom_id), student)
+        self.by_id[student.id] = student
+
+        names = {
+            normalize_name(f"{student.last_name_ru} {student.first_name_ru}"),
+            normalize_name(f"{student.last_name_tj} {student.first_name_tj}"),
+            normalize_name(f"{student.last_name_en} {student.first_name_en}"),
+        }
+        for key in names:
+            if not key or key in self.by_name:
+                continue
+            self.by_name[key] = student
+            entry = len(self.keys)
+            self.keys.append(key)
+            self.students.append(student)
+            grams = trigrams(key)
+            self.entry_grams.append(grams)
+            for gram in grams:
+                self.grams[gram].add(entry)
+
+    def find(self, student_id=None, full_name=None):
+        """Ищет ученика: сначала по ID, потом по имени (точно, затем нечетко). None — не найден."""
+        sid = normalize_id(student_id)
+        if sid:
+            found = self.by_custom_id.get(sid)
+            if found is None and sid.isdigit():
+                found = self.by_id.get(int(sid))
+            if found is not None:
+                return found
+
+        key = normalize_name(full_name)
+        if not key:
+            return None
+
+        found = self.by_name.get(key)
+        if found is not None:
+            return found
+
+        return self._fuzzy(key)
+
+    def _fuzzy(self, key):
+        query = trigrams(key)
+        # Blocking: кандидатов берем по самым редким триграммам запроса
+        # (частые вроде " iv" есть у половины школы и только раздувают список)
+        known = [gram for gram in query if gram in self.grams]
+        rare = sorted(known, key=lambda gram: len(self.grams[gram]))[:self.BLOCKING_GRAMS]
+        candidates = set()
+        for gram in rare:
+            candidates |= self.grams[gram]
+
+        # Доля общих триграмм — дешевый фильтр перед SequenceMatcher
+        min_shared = len(query) * self.MIN_TRIGRAM_SHARE
+        scored = []
+        for entry in candidates:
+            shared = len(query & self.entry_grams[entry])
+            if shared >= min_shared:
+                scored.append((shared, entry))
+        scored.sort(reverse=True)
+
+        best, best_ratio = None, self.MIN_RATIO
+        for _, entry in scored[:self.SHORTLIST_SIZE]:
+            ratio = SequenceMatcher(None, key, self.keys[entry]).ratio()
+            if ratio > best_ratio:
+                best, best_ratio = self.students[entry], ratio
+        return best
@@ -0,0 +1,206 @@
+import hashlib
+import json
+import random
+from collections import defaultdict
+from django.core.cache import cache
+from django.db import transaction
+
+from ..models import BookletSection, SectionQuestion, Choice, Exam, BookletVersion
+from .analytics_cache import AnalyticsCache
+from .grader_service import GraderService
+
+# Буквы вариантов ответа по порядку в буклете
+LETTERS = ('A', 'B', 'C', 'D', 'E', 'F')
+
+
+def booklet_hash(order_map):
+    """Адрес содержимого буклета: sha256 канонического JSON карты."""
+    raw = json.dumps(order_map, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class VariantGenerator:
+    """
+    🧩 МАССОВАЯ ГЕНЕРАЦИЯ ВАРИАНТОВ РАУНДА (школы x параллели x варианты)
+
+    1. Утвержденные секции дня, их вопросы и варианты ответов читаются один раз (3 запроса на раунд).
+    2. "Умные карты" (question_order) строятся в памяти один раз на (параллель, вариант):
+       содержимое буклета не зависит от школы и хранится в общей BookletVersion (по хэшу карты).
+       Перемешивание детерминировано: зерно = (раунд, параллель, день, вариант),
+       поэтому повторная генерация дает тот же буклет, а вариантов может быть сколько угодно (до VARIANT_CHOICES).
+    3. Exam школ (со ссылкой на версию) и M2M (questions, subjects) пишутся bulk-операциями в одной короткой транзакции.
+    bulk-операции не шлют post_save/m2m_changed, поэтому кэши экзаменов сбрасываются здесь же.
+    """
+
+    BATCH_SIZE = 1000
+    DURATION = 180
+
+    def __init__(self, round_obj, day, grade=None, variants=2):
+        self.round = round_obj
+        self.day = int(day)
+        # Буквы вариантов по порядку: A (мастер), B, C, D...
+        self.variants = [code for code, _ in Exam.VARIANT_CHOICES][:max(1, variants)]
+        self.gat_round = round_obj.number if hasattr(round_obj, 'number') else 1
+        self.exam_ids = []  # Экзамены последнего generate() (для пре-рендера PDF)
+
+        sections = BookletSection.objects.filter(round=round_obj, status='approved', day=self.day)
+        if grade:
+            sections = sections.filter(grade_level=grade)
+        sections = list(sections.order_by('subject_id'))
+
+        # Вопросы секций строго по порядку эксперта
+        by_section = defaultdict(list)
+        for section_id, question_id in SectionQuestion.objects.filter(
+            section__in=sections
+        ).order_by('section_id', 'order').values_list('section_id', 'question_id'):
+            by_section[section_id].append(question_id)
+
+        # Параллель -> вопросы мастер-варианта и предметы (порядок предметов фиксирован: по id)
+        self.questions = defaultdict(list)
+        self.subjects = defaultdict(list)
+        for section in sections:
+            self.questions[section.grade_level].extend(by_section[section.id])
+            self.subjects[section.grade_level].append(section.subject_id)
+
+        # Вопрос -> [(id варианта ответа, верный?)] в исходном порядке (по id)
+        self.choices = defaultdict(list)
+        all_questions = {q for ids in self.questions.values() for q in ids}
+        for question_id, choice_id, is_correct in Choice.objects.filter(
+            question_id__in=all_questions
+        ).order_by('id').values_list('question_id', 'id', 'is_correct'):
+            self.choices[question_id].append((choice_id, is_correct))
+
+    @property
+    def grades(self):
+        return sorted(self.subjects)
+
+    @staticmethod
+    def seed(round_id, grade, day, variant):
+        """Зерно перестановки буклета (стабильно между процессами, в отличие от hash())."""
+        raw = f"{round_id}:{grade}:{day}:{variant}"
+        return int.from_bytes(hashlib.sha256(raw.encode()).digest()[:8], 'big')
+
+    def build_map(self, grade, variant):
+        """
+        "Умная карта" одного буклета: {номер: {"id", "key", "choices"}}.
+        Вариант A — порядок эксперта, остальные — перемешаны вопросы и варианты ответов
+        генератором с зерном seed(...): тот же вариант -> та же карта.
+        Возвращает (id вопросов в порядке буклета, карта).
+        """
+        shuffle = variant != 'A'
+        rng = random.Random(self.seed(self.round.id, grade, self.day, variant))
+
+        question_ids = list(self.questions[grade])
+        if shuffle:
+            rng.shuffle(question_ids)
+
+        order_map = {}
+        for idx, question_id in enumerate(question_ids):
+            choices = list(self.choices[question_id])  # Вход перестановки всегда в порядке id
+            if shuffle:
+                rng.shuffle(choices)
+
+            # Находим, какая буква теперь правильная (A, B, C, D)
+            key = "?"
+            for i, (_, is_correct) in enumerate(choices):
+                if is_correct:
+                    key = LETTERS[i] if i < len(LETTERS) else "?"
+
+            order_map[str(idx + 1)] = {
+                "id": question_id,
+                "key": key,                              # Правильный ответ для этого буклета
+                "choices": [c_id for c_id, _ in choices]  # Порядок вариантов для PDF
+            }
+        return question_ids, order_map
+
+    def generate(self, schools):
+        """
+        Создает/обновляет экзамены всех вариантов для школ.
+        Возвращает список (school, grade) — для лога.
+        """
+        schools = list(schools)
+        grades = self.grades
+
+        # Содержимое буклетов — один раз на (параллель, вариант), а не на каждую школу
+        booklets = {}
+        for grade in grades:
+            for variant in self.variants:
+                question_ids, order_map = self.build_map(grade, variant)
+                booklets[(grade, variant)] = (booklet_hash(order_map), question_ids, order_map)
+
+        existing = {}
+        for exam in Exam.objects.filter(
+            school__in=schools, gat_round=self.gat_round, gat_day=self.day,
+            grade_level__in=grades, variant__in=self.variants
+        ).order_by('id'):
+            existing[(exam.school_id, exam.grade_level, exam.variant)] = exam
+
+        size = self.BATCH_SIZE
+        questions_through = Exam.questions.through
+        subjects_through = Exam.subjects.through
+        with transaction.atomic():
+            versions = self._store_booklets(booklets)
+
+            plans, to_create, to_update, done = [], [], [], []
+            for school in schools:
+                for grade in grades:
+                    for variant in self.variants:
+                        content_hash, question_ids, _ = booklets[(grade, variant)]
+                        exam = existing.get((school.id, grade, variant)) or Exam(
+                            school=school, gat_round=self.gat_round, gat_day=self.day,
+                            grade_level=grade, variant=variant
+                        )
+                        exam.title = f"{self.round.name} - {grade} Кл - День {self.day} - Вар {variant}"
+                        exam.status = 'planned'
+                        exam.booklet = versions[content_hash]
+                        exam.question_order = {}  # Карта живет в версии буклета (см. Exam.order_map)
+                        exam.duration = self.DURATION
+                        (to_update if exam.pk else to_create).append(exam)
+                        plans.append((exam, question_ids, self.subjects[grade]))
+                    done.append((school, grade))
+
+            Exam.objects.bulk_create(to_create, batch_size=size)
+            Exam.objects.bulk_update(
+                to_update, ['title', 'status', 'booklet', 'question_order', 'duration'], batch_size=size
+            )
+
+            exam_ids = [exam.pk for exam, _, _ in plans]
+            self.exam_ids = exam_ids
+            questions_through.objects.filter(exam_id__in=exam_ids).delete()
+            subjects_through.objects.filter(exam_id__in=exam_ids).delete()
+            questions_through.objects.bulk_create([
+                questions_through(exam_id=exam.pk, question_id=q_id)
+                for exam, question_ids, _ in plans for q_id in question_ids
+            ], batch_size=size, ignore_conflicts=True)
+            subjects_through.objects.bulk_create([
+                subjects_through(exam_id=exam.pk, subject_id=s_id)
+                for exam, _, subject_ids in plans for s_id in subject_ids
+            ], batch_size=size, ignore_conflicts=True)
+
+        cache.delete_many([f"exam_sections_{exam_id}" for exam_id in exam_ids])
+        GraderService.invalidate_answer_keys(exam_ids)
+        AnalyticsCache.invalidate()
+        return done
+
+    def _store_booklets(self, booklets):
+        """
+        Находит или создает BookletVersion для каждой карты (по хэшу). Возвращает {хэш: версия}.
+        Уже существующие версии не перезаписываются — одинаковый хэш = одинаковое содержимое.
+        """
+        hashes = {content_hash for content_hash, _, _ in booklets.values()}
+        versions = {v.content_hash: v for v in BookletVersion.objects.filter(content_hash__in=hashes)}
+
+        missing = {}
+        for (grade, variant), (content_hash, _, order_map) in booklets.items():
+            if content_hash not in versions and content_hash not in missing:
+                missing[content_hash] = BookletVersion(
+                    content_hash=content_hash, grade_level=grade, gat_day=self.day,
+                    variant=variant, question_order=order_map
+                )
+        if missing:
+            # ignore_conflicts — на случай параллельной генерации того же раунда; id перечитываем
+            BookletVersion.objects.bulk_create(missing.values(), batch_size=self.BATCH_SIZE, ignore_conflicts=True)
+            versions.update({
+                v.content_hash: v for v in BookletVersion.objects.filter(content_hash__in=missing)
+            })
+        return versions
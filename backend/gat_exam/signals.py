@@ -1,11 +1,14 @@
 import logging
-from django.db.models.signals import post_delete
+from django.db.models.signals import post_delete, pre_delete
 from django.dispatch import receiver
 from django.contrib.auth.models import User
 from .models import Student
 from django.db.models.signals import m2m_changed, post_save
 from django.core.cache import cache
-from .models import Exam
+from django.db import transaction
+from .models import Exam, Question, Choice, ExamResult, School, StudentClass, Subject
+from .services.grader_service import GraderService
+from .services.analytics_cache import AnalyticsCache
 
 logger = logging.getLogger(__name__)
 
@@ -40,13 +43,25 @@ def delete_linked_user(sender, instance, **kwargs):
             pass
 
 @receiver(m2m_changed, sender=Exam.questions.through)
-def invalidate_exam_cache(sender, instance, **kwargs):
+def invalidate_exam_cache(sender, instance, action, reverse, pk_set, **kwargs):
     """
-    Если к экзамену добавили/удалили вопросы -> сбрасываем кэш структуры.
+    Если к экзамену добавили/удалили вопросы -> сбрасываем кэш структуры и ключ ответов.
     """
-    cache_key = f"exam_sections_{instance.id}"
-    cache.delete(cache_key)
-    print(f"🧹 Cache cleared for Exam {instance.id}")
+    if not action.startswith('post_') and action != 'pre_clear':
+        return
+
+    if reverse:
+        # question.assigned_exams.add(...) -> instance это Question, pk_set это ID экзаменов
+        if action == 'pre_clear':
+            exam_ids = set(instance.assigned_exams.values_list('id', flat=True))
+        else:
+            exam_ids = set(pk_set or ())
+    else:
+        exam_ids = {instance.id}
+
+    cache.delete_many([f"exam_sections_{exam_id}" for exam_id in exam_ids])
+    GraderService.invalidate_answer_keys(exam_ids)
+    print(f"🧹 Cache cleared for Exams {sorted(exam_ids)}")
 
 @receiver(post_save, sender=Exam)
 def invalidate_exam_update(sender, instance, **kwargs):
@@ -54,4 +69,61 @@ def invalidate_exam_update(sender, instance, **kwargs):
     Если изменили название или настройки экзамена -> сбрасываем кэш.
     """
     cache_key = f"exam_sections_{instance.id}"
-    cache.delete(cache_key)
\ No newline at end of file
+    cache.delete(cache_key)
+    GraderService.invalidate_answer_keys([instance.id])
+    # Раунд/день экзамена входит в фильтры рейтинга
+    transaction.on_commit(AnalyticsCache.invalidate)
+
+def _question_exam_ids(question_id):
+    return list(Exam.questions.through.objects.filter(question_id=question_id).values_list('exam_id', flat=True))
+
+@receiver(pre_delete, sender=Question)
+@receiver(pre_delete, sender=Choice)
+def remember_answer_key_exams(sender, instance, **kwargs):
+    """
+    Удаление вопроса каскадом удаляет связи Exam.questions ДО post_delete —
+    поэтому экзамены вопроса запоминаем заранее, а ключи сбрасываем в post_delete.
+    """
+    question_id = instance.id if sender is Question else instance.question_id
+    instance._answer_key_exam_ids = _question_exam_ids(question_id)
+
+def _invalidate_for_question(instance, question_id):
+    exam_ids = getattr(instance, '_answer_key_exam_ids', None)
+    if exam_ids is None:
+        exam_ids = _question_exam_ids(question_id)
+    GraderService.invalidate_answer_keys(exam_ids)
+    # Повторно после COMMIT: параллельная проверка могла заполнить кэш старым ключом до коммита
+    transaction.on_commit(lambda: GraderService.invalidate_answer_keys(exam_ids))
+
+@receiver(post_save, sender=Question)
+@receiver(post_delete, sender=Question)
+def invalidate_question_answer_keys(sender, instance, **kwargs):
+    """
+    Изменились баллы/вопрос -> сбрасываем ключи ответов всех экзаменов с этим вопросом.
+    """
+    _invalidate_for_question(instance, instance.id)
+
+@receiver(post_save, sender=Choice)
+@receiver(post_delete, sender=Choice)
+def invalidate_choice_answer_keys(sender, instance, **kwargs):
+    """
+    Поменяли правильный вариант ответа -> ключи экзаменов с этим вопросом устарели.
+    """
+    _invalidate_for_question(instance, instance.question_id)
+
+@receiver(post_save, sender=ExamResult)
+@receiver(post_delete, sender=ExamResult)
+@receiver(post_save, sender=School)
+@receiver(post_delete, sender=School)
+@receiver(post_save, sender=StudentClass)
+@receiver(post_delete, sender=StudentClass)
+@receiver(post_save, sender=Subject)
+@receiver(post_delete, sender=Subject)
+def invalidate_analytics_cache(sender, instance, **kwargs):
+    """
+    Результат добавили/изменили/удалили -> дашборды и рейтинги устарели.
+    Школы, классы и предметы — справочник фильтров рейтинга (rating_meta).
+    (bulk_create сигналов не шлет — там кэш сбрасывает ResultFactsService.rebuild)
+    Сброс — после COMMIT: иначе параллельный запрос заполнит новую версию старыми данными.
+    """
+    transaction.on_commit(AnalyticsCache.invalidate)
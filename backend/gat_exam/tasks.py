@@ -29,9 +29,205 @@ def ai_analyze_question_task(self, text, choices, image_data_base64=None):
     except Exception as e:
         return {"valid": False, "message": f"Critical AI Error: {str(e)}"}
 
+@shared_task(bind=True)
+def grader_process_scan_task(self, file_path):
+    """
+    Фоновая проверка бланков (OMR).
+    file_path — файл в default_storage: одно фото, ZIP с фото или многостраничный PDF.
+
+    Делит пачку на чанки по GRADER_CHUNK_SIZE бланков: каждый чанк сохраняется отдельным
+    файлом-частью и проверяется своей задачей (grader_scan_chunk_task) параллельно на всех воркерах.
+    Исходная загрузка удаляется сразу после нарезки, части — самими чанками.
+    ID группы сохраняется в результате задачи (django-db) — по нему считается прогресс.
+    """
+    import uuid
+    from celery import group
+    from django.conf import settings
+    from django.core.files.storage import default_storage
+    from .services.grader_service import GraderService
+
+    chunks = []
+    try:
+        with default_storage.open(file_path, 'rb') as f:
+            data = f.read()
+
+        pages = GraderService.list_batch_pages(data)
+        size = settings.GRADER_CHUNK_SIZE
+        for i in range(0, len(pages), size):
+            chunk = pages[i:i + size]
+            part_path = default_storage.save(
+                f"grader_uploads/parts/{uuid.uuid4().hex}", ContentFile(GraderService.extract_pages(data, chunk))
+            )
+            chunks.append((part_path, chunk))
+    except Exception:
+        # Пачка не нарезана до конца — уже сохраненные части никто не прочитает
+        for part_path, _ in chunks:
+            default_storage.delete(part_path)
+        raise
+    finally:
+        default_storage.delete(file_path)
+
+    job = group(grader_scan_chunk_task.s(part_path, file_path, chunk) for part_path, chunk in chunks).apply_async()
+    job.save()  # Сохраняем GroupResult в БД, чтобы потом восстановить его по ID
+
+    return {"group_id": job.id, "total": len(pages), "chunks": len(chunks)}
+
+@shared_task(bind=True)
+def grader_scan_chunk_task(self, part_path, file_path, pages):
+    """
+    Один чанк пачки: CV-этапы GraderService по каждому бланку + один bulk-upsert результатов.
+    part_path — файл-часть с бланками чанка (удаляется в конце), file_path — имя исходной пачки для отчета.
+    Ошибка страницы не роняет чанк: бланк (или нерастеризованный остаток PDF) попадает в отчет со status='error'.
+    Промежуточный прогресс пишется в состояние задачи (PROGRESS: done/total).
+    """
+    from django.core.files.storage import default_storage
+    from .services.grader_service import GraderService
+
+    sheets = []
+    try:
+        with default_storage.open(part_path, 'rb') as f:
+            data = f.read()
+
+        for index, (name, payload) in enumerate(GraderService.iter_part_pages(data, file_path, pages)):
+            sheet = GraderService.read_sheet(payload)
+            sheet.update({"index": index, "file": name})
+            sheets.append(sheet)
+            self.update_state(state='PROGRESS', meta={"done": index + 1, "total": len(pages)})
+    except Exception as e:
+        for page in pages[len(sheets):]:
+            sheets.append({
+                "status": "error", "message": f"Не удалось прочитать страницу: {str(e)}",
+                "index": len(sheets), "file": page if isinstance(page, str) else f"{file_path}#{page}"
+            })
+    finally:
+        default_storage.delete(part_path)
+
+    return GraderService.save_batch(sheets)
+
+@shared_task(bind=True)
+def import_results_task(self, file_path, school_id, round_id, grade_level, day=1):
+    """
+    Фоновый Smart Import (Excel/CSV с результатами).
+    Файл читается чанками; после каждого чанка прогресс пишется в состояние задачи
+    (PROGRESS: rows/processed), его отдает TaskStatusView.
+    Загруженный файл удаляется после импорта (и при ошибке).
+    """
+    from django.core.files.storage import default_storage
+    from .services.import_service import ImportService
+
+    def report(rows_done, processed):
+        self.update_state(state='PROGRESS', meta={"rows": rows_done, "processed": processed})
+
+    try:
+        with default_storage.open(file_path, 'rb') as f:
+            return ImportService.process_file(f, school_id, round_id, grade_level, day, progress_callback=report)
+    finally:
+        # Загрузка нужна только на время импорта (import_uploads/ из FileUploadView)
+        default_storage.delete(file_path)
+
+@shared_task(bind=True)
+def student_credentials_task(self, student_ids, cards=False, user_id=None):
+    """
+    Фоновая выдача логинов/паролей ученикам (ProvisioningService: хэши параллельно, запись пачкой).
+    cards=True — дополнительно рисует PDF с карточками доступа в default_storage (student_cards/).
+    PDF с паролями не получает публичной ссылки: его один раз скачивает только user_id
+    (StudentViewSet.download_pdf_cards), а через STUDENT_CARDS_TTL файл удаляется в любом случае.
+    """
+    import io
+    from django.conf import settings
+    from django.core.files.base import ContentFile
+    from django.core.files.storage import default_storage
+    from .models import Student
+    from .services.provisioning_service import ProvisioningService
+    from .services.student_cards import render_access_cards, cards_path
+
+    students = list(
+        Student.objects.filter(id__in=student_ids)
+        .select_related('school', 'student_class')
+        .order_by('last_name_ru')
+    )
+
+    if not cards:
+        passwords = ProvisioningService.reset_credentials(students)
+        return {"updated": len(passwords)}
+
+    # Карточки: пароли только тем, у кого уже есть логин (как в export_pdf_cards)
+    passwords = ProvisioningService.reset_credentials([s for s in students if s.username])
+    buffer = io.BytesIO()
+    render_access_cards(students, passwords, buffer)
+    path = default_storage.save(cards_path(self.request.id), ContentFile(buffer.getvalue()))
+    delete_file_task.apply_async((path,), countdown=settings.STUDENT_CARDS_TTL)
+
+    return {"updated": len(passwords), "user_id": user_id, "expires_in": settings.STUDENT_CARDS_TTL}
+
 @shared_task
-def grader_process_scan_task(file_path):
+def delete_file_task(path):
+    """Удаляет временный файл из default_storage (отложенный запуск = срок жизни файла)."""
+    from django.core.files.storage import default_storage
+
+    if default_storage.exists(path):
+        default_storage.delete(path)
+
+@shared_task(bind=True)
+def booklet_prerender_task(self, exam_ids):
+    """
+    Фоновый пре-рендер PDF буклетов после генерации вариантов (generate_variants).
+    Одинаковые буклеты (одна версия + одна шапка) у разных школ рендерятся один раз:
+    берется по одному экзамену на буклет, остальные получат тот же файл из хранилища.
+
+    Буклеты делятся на чанки по BOOKLET_RENDER_CHUNK_SIZE и запускаются группой
+    (booklet_render_chunk_task) на всех воркерах. ID группы сохраняется в результате задачи —
+    по нему BookletRenderStatusView считает прогресс.
     """
-    Фоновая задача для грейдера (на будущее)
+    from celery import group
+    from django.conf import settings
+    from .models import Exam
+    from .services.booklet_pdf import BookletPdfService
+
+    unique = {}
+    for exam_id, booklet_id, *header in Exam.objects.filter(id__in=exam_ids).order_by('id').values_list(
+        'id', 'booklet_id', 'title', 'variant', 'grade_level', 'gat_round', 'date'
+    ):
+        unique.setdefault((booklet_id, *header), (exam_id, booklet_id))
+
+    jobs = list(unique.values())
+    BookletPdfService.mark_rendering({booklet_id for _, booklet_id in jobs if booklet_id})
+
+    size = settings.BOOKLET_RENDER_CHUNK_SIZE
+    chunks = [jobs[i:i + size] for i in range(0, len(jobs), size)]
+
+    job = group(booklet_render_chunk_task.s(chunk) for chunk in chunks).apply_async()
+    job.save()  # Сохраняем GroupResult в БД, чтобы потом восстановить его по ID
+
+    return {"group_id": job.id, "total": len(jobs), "chunks": len(chunks)}
+
+@shared_task(bind=True)
+def booklet_render_chunk_task(self, jobs):
     """
-    return {"status": "pending", "message": "Grader task not implemented yet"}
\ No newline at end of file
+    Один чанк пре-рендера: [(exam_id, booklet_id)] -> PDF в хранилище (BookletPdfService).
+    Ошибка одного буклета не останавливает чанк: он вернется со статусом failed
+    и отрендерится при первом скачивании.
+    """
+    from .models import Exam
+    from .services.booklet_pdf import BookletPdfService
+
+    exams = Exam.objects.select_related('booklet').in_bulk([exam_id for exam_id, _ in jobs])
+
+    booklets = []
+    for index, (exam_id, booklet_id) in enumerate(jobs):
+        item = {"exam_id": exam_id, "booklet_id": booklet_id}
+        try:
+            exam = exams.get(exam_id)
+            if exam is None:
+                raise ValueError("Экзамен удален")
+            path, rendered = BookletPdfService.get_or_render(exam)
+            item.update({"status": "ready", "file": path, "rendered": rendered})
+        except Exception as e:
+            item.update({"status": "failed", "error": str(e)})
+        finally:
+            if booklet_id:
+                BookletPdfService.clear_rendering(booklet_id)
+        booklets.append(item)
+        self.update_state(state='PROGRESS', meta={"done": index + 1, "total": len(jobs)})
+
+    return booklets
@@ -1,8 +1,40 @@
-from django.test import TestCase
+from django.test import TestCase, SimpleTestCase, override_settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+import io
+import json
+import shutil
+import tempfile
+import unittest
+import zipfile
+from unittest import mock
+import cv2
+import numpy as np
+import pandas as pd
+from pypdf import PdfReader
 from django.contrib.auth.models import User
-from .models import School, StudentClass, Student, Question
+from rest_framework.test import APIClient
+from .models import School, StudentClass, Student, Question, Choice, Exam, ExamResult, Subject, Topic, SubjectScore, QuestionResponse
+from .models import ExamRound, BookletSection, SectionQuestion, BookletVersion
 # Импортируем наш новый сервис авторизации
 from .services.auth_service import AuthService  
+from .services.grader_service import GraderService
+from .services.omr_engine import BubbleFillEngine, DOUBLE_MARK
+from .services import grader_debug
+from .services.grader_debug import ScanDebug
+from .services.sheet_layout import layout_for_questions, get_layout
+from .services.import_scoring import ScoringPlan
+from .services.import_service import ImportService
+from .services.student_matcher import StudentMatcher
+from .services.provisioning_service import ProvisioningService
+from .services.student_cards import cards_path
+from .services.result_facts import ResultFactsService
+from .services.analytics_cache import AnalyticsCache
+from .services.variant_generator import VariantGenerator
+from .services.booklet_pdf import BookletPdfService, MediaFetcher, weasyprint
+from .views.analytics import DashboardAnalyticsView
+from .views.comparison import AnalyticsView
 
 class CoreLogicTests(TestCase):
     
@@ -67,4 +99,700 @@ class CoreLogicTests(TestCase):
         self.assertEqual(q.points, 3)
 
     def test_school_slug_generation(self):
-        self.assertEqual(self.school.slug, "testovaya-shkola-1")
\ No newline at end of file
+        self.assertEqual(self.school.slug, "testovaya-shkola-1")
+
+
+class GraderBatchTests(TestCase):
+
+    def setUp(self):
+        school = School.objects.create(name="Школа Грейдера", custom_id="GRADER01")
+        student_class = StudentClass.objects.create(school=school, grade_level=9, section="Б")
+        self.student = Student.objects.create(
+            school=school, student_class=student_class,
+            first_name_ru="Анна", last_name_ru="Бланкова"
+        )
+        self.exam = Exam.objects.create(title="GAT-1 9кл", school=school, grade_level=9)
+
+        # Q1: верный ответ B, Q2: верный ответ A
+        for correct_idx in (1, 0):
+            q = Question.objects.create(text="?", question_type="single")
+            for c_idx in range(4):
+                Choice.objects.create(question=q, text=str(c_idx), is_correct=(c_idx == correct_idx))
+            self.exam.questions.add(q)
+
+    def test_build_answer_key(self):
+        answer_key = GraderService.build_answer_key(self.exam.id)
+        self.assertEqual(answer_key["keys"], ["B", "A"])
+        self.assertEqual(len(answer_key["questions"]), 2)
+
+    def test_answer_key_cache_invalidated_on_choice_change(self):
+        self.assertEqual(GraderService.get_answer_key(self.exam.id)["keys"], ["B", "A"])
+
+        # Делаем правильным вариант D у первого вопроса
+        first = self.exam.questions.order_by('id').first()
+        first.choices.update(is_correct=False)
+        choice = first.choices.order_by('id').last()
+        choice.is_correct = True
+        choice.save()
+
+        self.assertEqual(GraderService.get_answer_key(self.exam.id)["keys"], ["D", "A"])
+
+    def test_answer_key_cache_invalidated_on_question_delete(self):
+        """Каскад удаляет связи экзамена раньше post_delete — экзамены берутся из pre_delete."""
+        self.assertEqual(GraderService.get_answer_key(self.exam.id)["keys"], ["B", "A"])
+
+        self.exam.questions.order_by('id').last().delete()
+
+        self.assertEqual(GraderService.get_answer_key(self.exam.id)["keys"], ["B"])
+
+    def test_save_batch_upserts_results(self):
+        """Пачка пишет один ExamResult на (ученик, экзамен) и перезаписывает старый."""
+        ExamResult.objects.create(student=self.student, exam=self.exam, score=0, max_score=2)
+
+        sheet = {"status": "ok", "message": "", "uid": self.student.id, "eid": self.exam.id, "debug_files": []}
+        sheets = [
+            {**sheet, "index": 0, "file": "a.jpg", "answers": {"1": "A"}},
+            {**sheet, "index": 1, "file": "b.jpg", "answers": {"1": "B", "2": "A"}},
+            {"status": "error", "message": "QR-код не найден.", "index": 2, "file": "c.jpg"},
+        ]
+
+        report = GraderService.save_batch(sheets)
+
+        self.assertEqual([r["status"] for r in report], ["success", "success", "error"])
+        result = ExamResult.objects.get(student=self.student, exam=self.exam)
+        self.assertEqual(result.score, 2)
+        self.assertEqual(result.percentage, 100)
+
+    def test_read_sheet_reports_cv_errors(self):
+        """Исключение CV на одном листе дает error-лист, а не обрыв всей пачки."""
+        with mock.patch.object(GraderService, 'detect_qr', side_effect=ValueError("bad page")):
+            sheet = GraderService.read_sheet(np.zeros((10, 10, 3), dtype=np.uint8))
+
+        self.assertEqual(sheet["status"], "error")
+        self.assertIn("bad page", sheet["message"])
+        self.assertEqual(sheet["answers"], {})
+
+    def test_extract_pages_keeps_only_chunk_sheets(self):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as archive:
+            for name in ("a.jpg", "b.jpg", "c.jpg", "notes.txt"):
+                archive.writestr(name, name.encode())
+        data = buffer.getvalue()
+
+        self.assertEqual(GraderService.list_batch_pages(data), ["a.jpg", "b.jpg", "c.jpg"])
+        part = GraderService.extract_pages(data, ["b.jpg", "c.jpg"])
+        self.assertEqual(
+            list(GraderService.iter_part_pages(part, "batch.zip", ["b.jpg", "c.jpg"])),
+            [("b.jpg", b"b.jpg"), ("c.jpg", b"c.jpg")]
+        )
+
+
+class ScanDebugWriterTests(SimpleTestCase):
+
+    def test_writer_recreated_after_fork(self):
+        writer = grader_debug._get_writer()
+        self.assertIs(grader_debug._get_writer(), writer)
+        with mock.patch('gat_exam.services.grader_debug.os.getpid', return_value=-1):
+            self.assertIsNot(grader_debug._get_writer(), writer)
+
+    def test_pool_worker_writes_synchronously(self):
+        debug = ScanDebug(mode='all')
+        debug.add("original", np.zeros((4, 4, 3), dtype=np.uint8))
+        with mock.patch.object(grader_debug, '_in_pool_worker', return_value=True), \
+                mock.patch.object(grader_debug, '_write_image') as write, \
+                mock.patch.object(grader_debug, '_get_writer') as get_writer:
+            paths = debug.flush()
+
+        write.assert_called_once_with(paths[0], mock.ANY)
+        get_writer.assert_not_called()
+
+
+class BubbleFillEngineTests(SimpleTestCase):
+
+    def test_blank_single_and_double_marks(self):
+        # 3 строки по 4 кружка 20x20: пусто / закрашен C / закрашены A и D
+        ink = np.zeros((100, 200), dtype=np.uint8)
+        boxes = np.array([[[10 + j * 40, 10 + q * 30, 20, 20] for j in range(4)] for q in range(3)])
+        for q, j in [(1, 2), (2, 0), (2, 3)]:
+            x, y, w, h = boxes[q, j]
+            ink[y:y + h, x:x + w] = 255
+
+        engine = BubbleFillEngine(min_fill=0.5, double_ratio=0.8)
+        ratios = engine.fill_ratios(ink, boxes)
+
+        self.assertEqual(ratios.shape, (3, 4))
+        self.assertEqual(engine.decide(ratios), [None, "C", DOUBLE_MARK])
+
+
+class SheetLayoutTests(SimpleTestCase):
+
+    def test_layout_choice_by_question_count(self):
+        self.assertEqual(layout_for_questions(20).version, 'v1')
+        self.assertEqual(layout_for_questions(100).version, 'v2')
+        # Старые бланки без версии в QR читаются по исходной сетке
+        self.assertEqual(get_layout(None).version, 'v1')
+
+    def test_bubble_boxes_follow_columns(self):
+        boxes = get_layout('v2').bubble_boxes_px(31)
+        self.assertEqual(boxes.shape, (31, 4, 4))
+        # Вопрос №31 открывает вторую колонку: на уровне №1, но правее
+        self.assertAlmostEqual(boxes[30, 0, 1], boxes[0, 0, 1], places=3)
+        self.assertGreater(boxes[30, 0, 0], boxes[0, 3, 0])
+
+
+class ImportScoringPlanTests(TestCase):
+
+    def setUp(self):
+        school = School.objects.create(name="Школа Импорта", custom_id="IMPORT01")
+        self.exam = Exam.objects.create(title="GAT-1 7кл Вар B", school=school, grade_level=7, variant='B')
+
+        questions = []
+        for correct_idx in (2, 0):
+            q = Question.objects.create(text="?", question_type="single")
+            for c_idx in range(4):
+                Choice.objects.create(question=q, text=str(c_idx), is_correct=(c_idx == correct_idx))
+            questions.append(q)
+        self.exam.questions.set(questions)
+
+        # №1 буклета — второй вопрос с запеченным ключом, №2 — старый формат (только ID)
+        self.exam.question_order = {"1": {"id": questions[1].id, "key": "D"}, "2": questions[0].id}
+        self.exam.save()
+
+        student_class = StudentClass.objects.create(school=school, grade_level=7, section="А")
+        self.student = Student.objects.create(
+            school=school, student_class=student_class, custom_id="7001",
+            first_name_ru="Далер", last_name_ru="Назаров"
+        )
+        self.school = school
+
+    def test_scores_all_rows_against_key_vector(self):
+        plan = ScoringPlan(self.exam)
+        self.assertEqual(list(plan.keys), ["D", "C"])
+
+        df = pd.DataFrame(
+            [["Иванов", " d", "C"], ["Петров", None, "c"], ["Сидоров", "A", "B"]],
+            columns=["FULL NAME", "Q1", "Q2"]
+        )
+        scores = plan.score(df)
+
+        self.assertEqual([s["total_score"] for s in scores], [2, 1, 0])
+        self.assertEqual(scores[0]["max_score_possible"], 2)
+        self.assertEqual(scores[1]["percentage"], 50.0)
+        self.assertEqual(scores[1]["details"]["1"], {"s": 0, "v": "-", "sb": "GEN"})
+
+    def test_reimport_upserts_results(self):
+        """Повторный импорт исправленного файла перезаписывает результат, а не дублирует его."""
+        def upload(answers):
+            content = f"STUDENT ID,FULL NAME,VARIANT,Q1,Q2\n7001,Назаров Далер,B,{answers}\n"
+            return SimpleUploadedFile("results.csv", content.encode("utf-8"), content_type="text/csv")
+
+        first = ImportService.process_file(upload("A,A"), self.school.id, round_id=1, grade_level=7)
+        self.assertEqual(first["processed"], 1)
+
+        second = ImportService.process_file(upload("D,C"), self.school.id, round_id=1, grade_level=7)
+        self.assertEqual(second["processed"], 1)
+
+        result = ExamResult.objects.get(student=self.student, exam=self.exam)
+        self.assertEqual(ExamResult.objects.filter(student=self.student).count(), 1)
+        self.assertEqual(result.score, 2)
+
+
+class StudentMatcherTests(TestCase):
+
+    def setUp(self):
+        school = School.objects.create(name="Школа Матчера", custom_id="MATCH01")
+        student_class = StudentClass.objects.create(school=school, grade_level=8, section="А")
+        self.rahimov = Student.objects.create(
+            school=school, student_class=student_class, custom_id="5501",
+            first_name_ru="Фарух", last_name_ru="Рахимов"
+        )
+        self.karimova = Student.objects.create(
+            school=school, student_class=student_class,
+            first_name_ru="Зарина", last_name_ru="Каримова", first_name_en="Zarina", last_name_en="Karimova"
+        )
+        self.matcher = StudentMatcher(Student.objects.filter(school=school))
+
+    def test_match_by_ids(self):
+        # Excel отдает числовые ID как float
+        self.assertEqual(self.matcher.find(5501.0, None), self.rahimov)
+        self.assertEqual(self.matcher.find(str(self.karimova.id), None), self.karimova)
+
+    def test_match_by_name_variants(self):
+        self.assertEqual(self.matcher.find(None, "ФАРУХ РАХИМОВ"), self.rahimov)
+        self.assertEqual(self.matcher.find(None, "Karimova Zarina"), self.karimova)
+        # Опечатка — нечеткий поиск по триграммам
+        self.assertEqual(self.matcher.find(None, "Рахимов Фарух."), self.rahimov)
+        self.assertEqual(self.matcher.find(None, "Рахимоф Фарух"), self.rahimov)
+        self.assertIsNone(self.matcher.find(None, "Иванов Иван"))
+
+
+class ProvisioningServiceTests(TestCase):
+
+    def setUp(self):
+        self.school = School.objects.create(name="Новая Школа", custom_id="NEW01")
+        self.student_class = StudentClass.objects.create(school=self.school, grade_level=5, section="А")
+
+    def test_create_students_in_bulk(self):
+        created = ProvisioningService.create_students([
+            {"first_name_ru": "Нигина", "last_name_ru": "Юсупова", "custom_id": "501"},
+            {"first_name_ru": "Сухроб", "last_name_ru": "Саидов"},
+        ], self.school.id, self.student_class)
+
+        self.assertEqual(len(created), 2)
+        for student, password in created:
+            self.assertIsNotNone(student.pk)
+            self.assertEqual(student.first_name_en, student.first_name_ru)
+            user = User.objects.get(username=student.username)
+            self.assertTrue(user.check_password(password))
+            self.assertEqual(user.profile.role, 'student')
+            self.assertEqual(user.profile.school, self.school)
+
+    def test_new_username_skips_taken_logins(self):
+        User.objects.create_user(username="SaidovS100", password="x")
+        with mock.patch('gat_exam.services.provisioning_service.random.randint', side_effect=[100, 101]):
+            self.assertEqual(ProvisioningService.new_username("Саидов", "Сухроб"), "SaidovS101")
+
+    def test_reset_credentials_updates_existing_users(self):
+        student = Student.objects.create(
+            school=self.school, student_class=self.student_class,
+            first_name_ru="Манижа", last_name_ru="Шарипова", username="SharipovaM100"
+        )
+        User.objects.create_user(username="SharipovaM100", password="old", is_active=False)
+
+        passwords = ProvisioningService.reset_credentials(Student.objects.filter(id=student.id))
+
+        user = User.objects.get(username="SharipovaM100")
+        self.assertTrue(user.is_active)
+        self.assertTrue(user.check_password(passwords[student.id]))
+        self.assertEqual(user.profile.role, 'student')
+
+    def test_background_cards_download_once_by_owner(self):
+        owner = User.objects.create_user(username="cards_owner", password="pass12345")
+        stranger = User.objects.create_user(username="cards_stranger", password="pass12345")
+        path = default_storage.save(cards_path("task-1"), ContentFile(b"%PDF-cards"))
+        self.addCleanup(default_storage.delete, path)
+
+        done = mock.Mock(state='SUCCESS', result={"updated": 1, "user_id": owner.id})
+        client = APIClient()
+        with mock.patch('gat_exam.views.students.AsyncResult', return_value=done):
+            client.force_authenticate(stranger)
+            self.assertEqual(client.get('/api/students/export-pdf-cards/task-1/').status_code, 403)
+
+            client.force_authenticate(owner)
+            response = client.get('/api/students/export-pdf-cards/task-1/')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.content, b"%PDF-cards")
+            self.assertFalse(default_storage.exists(path))
+            self.assertEqual(client.get('/api/students/export-pdf-cards/task-1/').status_code, 410)
+
+
+class ResultFactsTests(TestCase):
+
+    def setUp(self):
+        school = School.objects.create(name="Школа Аналитики", custom_id="STAT01")
+        student_class = StudentClass.objects.create(school=school, grade_level=10, section="А")
+        self.student = Student.objects.create(
+            school=school, student_class=student_class,
+            first_name_ru="Сухроб", last_name_ru="Назаров"
+        )
+        self.math = Subject.objects.create(name="Математика", slug="math", abbreviation="MAT")
+        self.eng = Subject.objects.create(name="Английский", slug="eng", abbreviation="ENG")
+        self.exam = Exam.objects.create(title="GAT-2 10кл", school=school, grade_level=10)
+
+        # Вопросы по id: математика (A), математика (B), английский (C)
+        for subject, correct_idx in ((self.math, 0), (self.math, 1), (self.eng, 2)):
+            topic = Topic.objects.create(subject=subject, quarter=1, grade_level=10, title=subject.name)
+            q = Question.objects.create(text="?", question_type="single", topic=topic)
+            for c_idx in range(4):
+                Choice.objects.create(question=q, text=str(c_idx), is_correct=(c_idx == correct_idx))
+            self.exam.questions.add(q)
+
+    def scores(self):
+        return {
+            s.subject_id: (s.correct, s.total)
+            for s in SubjectScore.objects.filter(student=self.student)
+        }
+
+    def test_grader_writes_result_facts(self):
+        GraderService.calculate_and_save(self.student, self.exam, {"1": "A", "2": "C", "3": "C"})
+        self.assertEqual(self.scores(), {self.math.id: (1, 2), self.eng.id: (1, 1)})
+
+        # Повторная проверка заменяет строки, а не добавляет
+        GraderService.calculate_and_save(self.student, self.exam, {"1": "A", "2": "B", "3": "D"})
+        self.assertEqual(self.scores(), {self.math.id: (2, 2), self.eng.id: (0, 1)})
+
+        responses = QuestionResponse.objects.filter(result__student=self.student).order_by('booklet_num')
+        self.assertEqual(
+            [(r.booklet_num, r.chosen, r.is_correct) for r in responses],
+            [(1, "A", True), (2, "B", True), (3, "D", False)]
+        )
+
+    def test_import_details_format(self):
+        """Формат импорта: номер в буклете -> question_order -> вопрос -> предмет."""
+        ids = list(self.exam.questions.order_by('id').values_list('id', flat=True))
+        self.exam.question_order = {"1": {"id": ids[2], "key": "C"}, "2": {"id": ids[0], "key": "A"}}
+        self.exam.save()
+
+        result = ExamResult.objects.create(
+            student=self.student, exam=self.exam, score=1, max_score=2,
+            details={"1": {"s": 1, "v": "C", "sb": "ENG"}, "2": {"s": 0, "v": "B", "sb": "MAT"}}
+        )
+        ResultFactsService.rebuild([result])
+        self.assertEqual(self.scores(), {self.math.id: (0, 1), self.eng.id: (1, 1)})
+
+        response = QuestionResponse.objects.get(result=result, booklet_num=1)
+        self.assertEqual((response.question_id, response.chosen, response.is_correct), (ids[2], "C", True))
+
+
+    def test_heatmap_groups_variants_by_question(self):
+        """Один вопрос под разными номерами в вариантах А и Б — одна ячейка с номером варианта А."""
+        ids = list(self.exam.questions.order_by('id').values_list('id', flat=True))
+        self.exam.question_order = {"1": ids[0], "2": ids[1], "3": ids[2]}
+        self.exam.save()
+        exam_b = Exam.objects.create(
+            title="GAT-2 10кл", school=self.exam.school, grade_level=10, variant='B',
+            question_order={"1": ids[1], "2": ids[0], "3": ids[2]}
+        )
+        exam_b.questions.set(ids)
+
+        other = Student.objects.create(
+            school=self.student.school, student_class=self.student.student_class,
+            first_name_ru="Дилшод", last_name_ru="Каримов"
+        )
+        for student, exam, num, is_correct in ((self.student, self.exam, 1, True), (other, exam_b, 2, False)):
+            result = ExamResult.objects.create(student=student, exam=exam, score=0, max_score=3)
+            QuestionResponse.objects.create(result=result, question_id=ids[0], booklet_num=num, is_correct=is_correct)
+
+        data, _ = AnalyticsView()._get_heatmap_data(ExamResult.objects.all())
+        heatmap = data["Математика (10-е классы)"]
+        self.assertEqual(heatmap["questions"], ["1"])
+        self.assertEqual(heatmap["schools"]["Школа Аналитики"], {"1": {"percentage": 50}})
+
+class DashboardAnalyticsTests(TestCase):
+
+    def setUp(self):
+        AnalyticsCache.invalidate()  # Сбросы on_commit внутри TestCase не срабатывают — начинаем с чистой версии
+        school = School.objects.create(name="Школа Дашборда", custom_id="DASH01")
+        self.student_class = StudentClass.objects.create(school=school, grade_level=9, section="Б")
+        self.exam = Exam.objects.create(title="GAT-1 9кл", school=school, grade_level=9, gat_round=1)
+        self.school = school
+        self.user = User.objects.create_user(username="dash_admin", password="pass12345")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def add_result(self, percentage):
+        student = Student.objects.create(
+            school=self.school, student_class=self.student_class,
+            first_name_ru="Имя", last_name_ru=f"Ученик{percentage}"
+        )
+        return ExamResult.objects.create(
+            student=student, exam=self.exam, score=percentage, max_score=100, percentage=percentage
+        )
+
+    def test_mark_matrix_buckets(self):
+        """Границы шкалы: 0-9.9% -> 1, 10% -> 2, 95% и 100% -> 10."""
+        for percentage in (0, 9.9, 10, 55, 95, 100):
+            self.add_result(percentage)
+
+        data = DashboardAnalyticsView.build(grades=(9,), rounds=(1,))
+        self.assertEqual(data["kpi"]["total_students"], 6)
+        self.assertEqual(data["kpi"]["top_school"], "Школа Дашборда")
+
+        cls = data["matrix"][0]["grades"][0]["classes"][0]
+        self.assertEqual(cls["name"], "9-Б")
+        self.assertEqual(cls["marks"], {1: 2, 2: 1, 6: 1, 10: 2})
+        self.assertEqual(cls["total"], 6)
+
+    def test_cached_response_refreshes_on_new_result(self):
+        self.add_result(40)
+        first = self.client.get('/api/analytics/dashboard/', {"schools": str(self.school.id)}).json()
+        self.assertEqual(first["kpi"]["total_students"], 1)
+
+        # Кэш сбрасывается только после COMMIT: иначе параллельный запрос заполнил бы
+        # новую версию данными до коммита
+        version = AnalyticsCache.version()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add_result(80)
+            self.assertEqual(AnalyticsCache.version(), version)
+        # Тот же набор фильтров в другом порядке/виде -> тот же ключ, но версия кэша уже новая
+        second = self.client.get('/api/analytics/dashboard/', {"schools": f"{self.school.id},x"}).json()
+        self.assertEqual(second["kpi"]["total_students"], 2)
+
+
+class MonitoringRatingTests(TestCase):
+
+    def setUp(self):
+        AnalyticsCache.invalidate()  # Сбросы on_commit внутри TestCase не срабатывают — начинаем с чистой версии
+        self.school = School.objects.create(name="Школа Рейтинга", custom_id="RATE01")
+        student_class = StudentClass.objects.create(school=self.school, grade_level=11, section="А")
+        self.math = Subject.objects.create(name="Математика", slug="math", abbreviation="MAT")
+        self.exam = Exam.objects.create(title="GAT-3 11кл", school=self.school, grade_level=11, gat_round=3)
+        self.exam.subjects.add(self.math)
+        student = Student.objects.create(
+            school=self.school, student_class=student_class,
+            first_name_ru="Фарид", last_name_ru="Каримов"
+        )
+        result = ExamResult.objects.create(student=student, exam=self.exam, score=7, max_score=10, percentage=70)
+        SubjectScore.objects.create(result=result, student=student, subject=self.math, correct=7, total=10)
+
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(username="rate_admin", password="pass12345"))
+
+    def test_badges_and_cached_filter_meta(self):
+        data = self.client.get('/api/monitoring/rating/').json()
+        self.assertEqual(data["data"][0]["badges"][0]["name"], "MAT")
+        self.assertEqual(data["data"][0]["badges"][0]["score"], 7)
+        self.assertEqual(data["meta"]["availableGats"], ["gat3"])
+        self.assertEqual(data["meta"]["schoolClasses"][str(self.school.id)]["sections"], ["А"])
+
+        # Новый класс сбрасывает закэшированный справочник фильтров (после COMMIT)
+        with self.captureOnCommitCallbacks(execute=True):
+            StudentClass.objects.create(school=self.school, grade_level=11, section="Б")
+        data = self.client.get('/api/monitoring/rating/').json()
+        self.assertEqual(data["meta"]["schoolClasses"][str(self.school.id)]["sections"], ["А", "Б"])
+
+    def test_cursor_pagination_walks_ties_without_gaps(self):
+        student_class = StudentClass.objects.get(school=self.school, section="А")
+        for i, score in enumerate((7, 7, 5)):
+            student = Student.objects.create(
+                school=self.school, student_class=student_class,
+                first_name_ru="Ученик", last_name_ru=f"Номер{i}"
+            )
+            ExamResult.objects.create(student=student, exam=self.exam, score=score, max_score=10, percentage=score * 10)
+
+        seen, cursor = [], None
+        while True:
+            params = {"limit": 2}
+            if cursor:
+                params["cursor"] = cursor
+            data = self.client.get('/api/monitoring/rating/', params).json()
+            seen += [(row["score"], row["id"]) for row in data["data"]]
+            self.assertEqual(data["meta"]["pagination"]["total"], 4)
+            cursor = data["meta"]["pagination"]["next_cursor"]
+            if not cursor:
+                break
+
+        self.assertEqual(len(seen), 4)
+        self.assertEqual(len(set(seen)), 4)
+        self.assertEqual([score for score, _ in seen], [7, 7, 7, 5])
+
+
+class AllResultsExportTests(TestCase):
+
+    def setUp(self):
+        school = School.objects.create(name="Школа Выгрузки", custom_id="EXP01")
+        student_class = StudentClass.objects.create(school=school, grade_level=8, section="В")
+        exam = Exam.objects.create(title="GAT-1 8кл", school=school, grade_level=8, gat_round=1, gat_day=2)
+        for i, score in enumerate((9, 4, 6)):
+            student = Student.objects.create(
+                school=school, student_class=student_class,
+                first_name_ru="Ученик", last_name_ru=f"Номер{i}"
+            )
+            ExamResult.objects.create(student=student, exam=exam, score=score, max_score=10,
+                                      percentage=score * 10, details={"1": {"s": 1}})
+
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(username="export_admin", password="pass12345"))
+
+    def test_paginated_field_selection(self):
+        data = self.client.get('/api/monitoring/results/', {"limit": 2, "fields": "student_name,score,nope"}).json()
+        self.assertTrue(data["has_next"])
+        self.assertEqual(data["results"], [
+            {"student_name": "Номер0 Ученик", "score": 9.0},
+            {"student_name": "Номер2 Ученик", "score": 6.0},
+        ])
+        # Итоги — по всей выборке, а не по странице
+        self.assertEqual((data["total"], data["avg"], data["max"]), (3, 63.3, 9.0))
+        self.assertNotIn("total", self.client.get('/api/monitoring/results/', {"limit": 2, "page": 2}).json())
+
+    def test_server_side_search(self):
+        data = self.client.get('/api/monitoring/results/', {"search": "Номер1", "fields": "student_name"}).json()
+        self.assertEqual(data["results"], [{"student_name": "Номер1 Ученик"}])
+        self.assertEqual(data["total"], 1)
+
+    def test_ndjson_stream(self):
+        response = self.client.get('/api/monitoring/results/', {"export": "ndjson", "fields": "class_name,day,details"})
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(json.loads(lines[0]), {"class_name": "8В", "day": 2, "details": {"1": {"s": 1}}})
+
+
+class RiskGroupTests(TestCase):
+
+    def test_trend_uses_previous_round_of_same_day(self):
+        school = School.objects.create(name="Школа Риска", custom_id="RISK01")
+        student_class = StudentClass.objects.create(school=school, grade_level=7, section="А")
+        exams = {
+            (gat_round, day): Exam.objects.create(
+                title=f"GAT-{gat_round} день {day}", school=school, grade_level=7,
+                gat_round=gat_round, gat_day=day, status='finished'
+            )
+            for gat_round in (1, 2) for day in (1, 2)
+        }
+        falling, rising = (
+            Student.objects.create(school=school, student_class=student_class, first_name_ru="Али", last_name_ru=name)
+            for name in ("Падающий", "Растущий")
+        )
+        for student, scores in ((falling, {1: 60, 2: 40}), (rising, {1: 20, 2: 45})):
+            for gat_round, pct in scores.items():
+                ExamResult.objects.create(student=student, exam=exams[(gat_round, 1)], score=pct, max_score=100, percentage=pct)
+        # День 2 другого раунда не должен считаться "предыдущим" для дня 1
+        ExamResult.objects.create(student=falling, exam=exams[(1, 2)], score=10, max_score=100, percentage=10)
+
+        risk = AnalyticsView()._get_risk_group(ExamResult.objects.filter(exam__gat_round=2))
+
+        self.assertEqual([(r["name"], r["score"], r["trend"]) for r in risk], [
+            ("Падающий Али", 40, "down"),
+            ("Растущий Али", 45, "up"),
+        ])
+
+
+class VariantGeneratorTests(TestCase):
+
+    def setUp(self):
+        self.round = ExamRound.objects.create(name="GAT-1", date="2026-10-01")
+        self.schools = [School.objects.create(name=f"Школа {i}", custom_id=f"GEN0{i}") for i in (1, 2)]
+        self.question_ids = []
+        for slug in ("math", "eng"):
+            subject = Subject.objects.create(name=slug, slug=slug, abbreviation=slug[:3].upper())
+            section = BookletSection.objects.create(round=self.round, subject=subject, grade_level=5, status='approved', day=1)
+            for order in range(1, 4):
+                q = Question.objects.create(text=f"{slug} {order}", question_type="single")
+                for c_idx in range(4):
+                    Choice.objects.create(question=q, text=str(c_idx), is_correct=(c_idx == order % 4))
+                SectionQuestion.objects.create(section=section, question=q, order=order)
+                self.question_ids.append(q.id)
+
+    def test_bulk_generation_and_regeneration(self):
+        VariantGenerator(self.round, day=1).generate(self.schools)
+        exams = Exam.objects.filter(gat_day=1, grade_level=5)
+        self.assertEqual(exams.count(), 4)
+
+        master = exams.get(school=self.schools[0], variant='A')
+        self.assertEqual([master.order_map[str(i)]["id"] for i in range(1, 7)], self.question_ids)
+        self.assertEqual(master.order_map["1"]["key"], "B")
+        self.assertEqual(set(master.questions.values_list('id', flat=True)), set(self.question_ids))
+        self.assertEqual(master.subjects.count(), 2)
+
+        # Ключ варианта B указывает на верный вариант ответа в его перемешанном порядке
+        shuffled = exams.get(school=self.schools[1], variant='B')
+        for entry in shuffled.order_map.values():
+            correct = Choice.objects.get(question_id=entry["id"], is_correct=True).id
+            self.assertEqual(entry["key"], "ABCDEF"[entry["choices"].index(correct)])
+
+        # Повторная генерация обновляет те же экзамены
+        VariantGenerator(self.round, day=1).generate(self.schools)
+        self.assertEqual(Exam.objects.filter(gat_day=1, grade_level=5).count(), 4)
+        self.assertEqual(Exam.questions.through.objects.filter(exam=master).count(), 6)
+
+    def test_seeded_variants_are_reproducible(self):
+        generator = VariantGenerator(self.round, day=1, variants=4)
+        first = {v: generator.build_map(5, v)[1] for v in generator.variants}
+        again = VariantGenerator(self.round, day=1, variants=4)
+        self.assertEqual(generator.variants, ['A', 'B', 'C', 'D'])
+        for variant, order_map in first.items():
+            self.assertEqual(again.build_map(5, variant)[1], order_map)
+
+        # Та же карта после записи в БД
+        generator.generate(self.schools[:1])
+        exam = Exam.objects.get(school=self.schools[0], grade_level=5, gat_day=1, variant='D')
+        self.assertEqual(exam.order_map, first['D'])
+
+    def test_booklet_versions_shared_across_schools(self):
+        VariantGenerator(self.round, day=1).generate(self.schools)
+        VariantGenerator(self.round, day=1).generate(self.schools)
+
+        # 1 параллель x 2 варианта = 2 версии, сколько бы школ и перегенераций ни было
+        self.assertEqual(BookletVersion.objects.count(), 2)
+        booklets = {
+            variant: set(Exam.objects.filter(variant=variant).values_list('booklet_id', flat=True))
+            for variant in ('A', 'B')
+        }
+        self.assertEqual(len(booklets['A']), 1)
+        self.assertEqual(len(booklets['B']), 1)
+        self.assertEqual(Exam.objects.exclude(question_order={}).count(), 0)
+
+        # Проверка импорта/факт-таблиц видит карту из общей версии
+        exam = Exam.objects.filter(variant='B').first()
+        context = ResultFactsService.exam_contexts([exam.id])[exam.id]
+        self.assertEqual(context["booklet"]["1"], exam.order_map["1"]["id"])
+
+    def test_pdf_fingerprint_is_content_addressed(self):
+        VariantGenerator(self.round, day=1).generate(self.schools)
+
+        def fingerprint(school, variant):
+            exam = Exam.objects.select_related('booklet').get(school=school, variant=variant)
+            return BookletPdfService.fingerprint(exam, BookletPdfService.build_sections(exam))
+
+        # Один буклет в разных школах = один PDF, другой вариант = другой
+        master = fingerprint(self.schools[0], 'A')
+        self.assertEqual(fingerprint(self.schools[1], 'A'), master)
+        self.assertNotEqual(fingerprint(self.schools[0], 'B'), master)
+
+        # Правка текста ответа меняет адрес PDF
+        Choice.objects.filter(question_id=self.question_ids[0]).update(text="новый")
+        self.assertNotEqual(fingerprint(self.schools[0], 'A'), master)
+
+    def test_pdf_status_for_catalog(self):
+        generator = VariantGenerator(self.round, day=1)
+        generator.generate(self.schools)
+        self.assertEqual(len(generator.exam_ids), 4)
+
+        exams = {e.variant: e for e in Exam.objects.select_related('booklet').filter(school=self.schools[0])}
+        self.assertEqual(BookletPdfService.status(exams['A']), 'pending')
+
+        BookletPdfService.mark_rendering([exams['A'].booklet_id])
+        rendering = BookletPdfService.rendering_ids({e.booklet_id for e in exams.values()})
+        self.assertEqual(rendering, {exams['A'].booklet_id})
+        self.assertEqual(BookletPdfService.status(exams['A'], rendering), 'rendering')
+
+        BookletVersion.objects.filter(id=exams['B'].booklet_id).update(pdf_file='booklets/pdf/b.pdf')
+        exam_b = Exam.objects.select_related('booklet').get(school=self.schools[1], variant='B')
+        self.assertEqual(BookletPdfService.status(exam_b, rendering), 'ready')
+
+        BookletPdfService.clear_rendering(exams['A'].booklet_id)
+        self.assertEqual(BookletPdfService.rendering_ids({exams['A'].booklet_id}), set())
+
+
+class BookletPdfMediaTests(TestCase):
+    """Картинки буклета читаются из хранилища, а не по HTTP от base_url (фоновый рендер идет без запроса)."""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root, MEDIA_URL='/media/')
+        self.settings_override.enable()
+
+        png = cv2.imencode('.png', np.full((8, 8, 3), 255, dtype=np.uint8))[1].tobytes()
+        self.question = Question.objects.create(text="Рисунок", question_type="single")
+        self.question.image.save("q.png", ContentFile(png))
+        Choice.objects.create(question=self.question, text="да", is_correct=True)
+        school = School.objects.create(name="Школа PDF", custom_id="PDF01")
+        self.exam = Exam.objects.create(title="GAT-1 5кл", school=school, grade_level=5)
+        self.exam.questions.add(self.question)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def test_fetcher_reads_media_without_base_url(self):
+        fetcher = MediaFetcher()
+        for url in (self.question.image.url, f"http://localhost{self.question.image.url}"):
+            self.assertEqual(fetcher(url)["string"], self.question.image.read())
+            self.question.image.seek(0)
+
+        with self.assertRaises(Exception):
+            fetcher("/media/questions/missing.png")
+        self.assertEqual(fetcher.missing, ["questions/missing.png"])
+
+    @unittest.skipIf(weasyprint is None, "WeasyPrint не установлен")
+    def test_background_render_keeps_images(self):
+        path, rendered = BookletPdfService.get_or_render(self.exam)
+        self.assertTrue(rendered)
+        with default_storage.open(path, 'rb') as f:
+            self.assertGreater(sum(len(page.images) for page in PdfReader(f).pages), 0)
+
+        # Пропавшая картинка -> ошибка, а не PDF без нее под тем же хэшем
+        self.question.image.storage.delete(self.question.image.name)
+        Choice.objects.filter(question=self.question).update(text="нет")
+        with self.assertRaises(RuntimeError):
+            BookletPdfService.get_or_render(self.exam)
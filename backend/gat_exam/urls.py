@@ -27,6 +27,7 @@ from .views import (
     
     # APIViews (Кастомные действия)
     FileUploadView, 
+    GraderTaskStatusView,
     ExamResultView, 
     AllResultsView, 
     MonitoringRatingView, 
@@ -34,6 +35,7 @@ from .views import (
     BookletCatalogView,
     BookletDownloadView, 
     BookletPreviewView,
+    BookletRenderStatusView,
 
     # AI Сервисы
     AIGenerateDistractorsView,
@@ -90,6 +92,7 @@ urlpatterns = [
 
     # --- ЗАГРУЗКА ФАЙЛОВ ---
     path('upload/', FileUploadView.as_view(), name='file-upload'),
+    path('grader/tasks/<str:task_id>/', GraderTaskStatusView.as_view(), name='grader-task-status'),
 
     # --- РЕЗУЛЬТАТЫ И РЕЙТИНГИ ---
     path('monitoring/results/', AllResultsView.as_view(), name='all-results'),
@@ -102,6 +105,7 @@ urlpatterns = [
     # --- БУКЛЕТЫ (PDF) ---
     path('booklets/catalog/', BookletCatalogView.as_view(), name='booklet-catalog'),
     path('download/pdf/<int:pk>/', BookletDownloadView.as_view(), name='booklet-pdf'),
+    path('booklets/render-tasks/<str:task_id>/', BookletRenderStatusView.as_view(), name='booklet-render-status'),
 
     # --- AI ФУНКЦИИ (CELERY + GPT) ---
     path('ai/generate-distractors/', AIGenerateDistractorsView.as_view(), name='ai-generate-distractors'),
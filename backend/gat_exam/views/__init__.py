@@ -21,14 +21,15 @@ from .exams import ExamViewSet
 from .smart_booklets import ExamRoundViewSet, BookletSectionViewSet, ExamPreviewViewSet
 
 # 5. Сервисы и Загрузка
-from .upload import FileUploadView
+from .upload import FileUploadView, GraderTaskStatusView
 from .ai_views import AIGenerateDistractorsView, AIAnalyzeQuestionView
 
 # 🔥 ВАЖНО: Добавлен BookletPreviewView в импорты
 from .booklets import (
     BookletCatalogView, 
     BookletDownloadView, 
-    BookletPreviewView
+    BookletPreviewView,
+    BookletRenderStatusView
 )
 
 from .notifications import NotificationViewSet
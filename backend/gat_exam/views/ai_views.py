@@ -62,6 +62,9 @@ class TaskStatusView(APIView):
              }, status=status.HTTP_200_OK)
         elif task_result.state == 'FAILURE':
              return Response({"state": "FAILURE", "error": str(task_result.result)}, status=status.HTTP_200_OK)
+        elif task_result.state == 'PROGRESS':
+             # Промежуточный прогресс, который задача пишет через update_state (например, импорт чанками)
+             return Response({"state": "PROGRESS", "progress": task_result.info}, status=status.HTTP_200_OK)
         
         return Response({"state": task_result.state}, status=status.HTTP_200_OK)
 
@@ -1,18 +1,67 @@
+import csv
+import json
+from django.db.models import Avg, Count, Max, Q
+from django.http import StreamingHttpResponse
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.permissions import IsAuthenticated
 from ..models import ExamResult
 
+# Поле ответа -> колонки values(), из которых оно собирается.
+# Из БД читаем только колонки запрошенных полей (details — самый тяжелый JSON)
+FIELD_COLUMNS = {
+    "id": ('id',),
+    "student_name": ('student__last_name_ru', 'student__first_name_ru'),
+    "class_name": ('student__student_class__grade_level', 'student__student_class__section'),
+    "school_name": ('student__school__name',),
+    "score": ('score',),
+    "max_score": ('max_score',),
+    "percentage": ('percentage',),
+    "details": ('details',),   # Детализация ответов (Eng_1: 1, Math_2: 0...)
+    "day": ('exam__gat_day',),  # День, чтобы показать в таблице
+}
+
+# Пагинация JSON-ответа
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+# Сколько строк за раз тянет из БД потоковая выгрузка (память не растет с размером выборки)
+EXPORT_CHUNK_SIZE = 2000
+
+
+class _Echo:
+    """Псевдо-файл для csv.writer: write() сразу возвращает строку для стриминга."""
+    def write(self, value):
+        return value
+
+
+def _field_value(field, row):
+    if field == "student_name":
+        return f"{row['student__last_name_ru']} {row['student__first_name_ru']}"
+    if field == "class_name":
+        # Безопасное получение класса и школы (на случай если удалены)
+        grade = row['student__student_class__grade_level']
+        return f"{grade}{row['student__student_class__section']}" if grade is not None else "-"
+    if field == "school_name":
+        return row['student__school__name'] or "—"
+    return row[FIELD_COLUMNS[field][0]]
+
+
 class AllResultsView(APIView):
-    # 🔒 РЕЖИМ ПРОДАКШЕНА (Безопасно):
+    """
+    URL: /api/monitoring/results/
+
+    Параметры:
+    - фильтры: schools=1,2 | quarter | gat | grade | day
+    - search=текст                   — поиск по ФИО ученика или названию школы
+    - fields=student_name,score,...  — какие поля вернуть (по умолчанию все)
+    - page, limit                    — страница JSON-ответа (limit до MAX_LIMIT);
+                                       первая страница несет итоги всей выборки: total, avg, max
+    - export=ndjson | csv            — потоковая выгрузка всей выборки (без пагинации)
+    """
     # Только авторизованные пользователи (Front-end с токеном) могут видеть данные.
     permission_classes = [IsAuthenticated]
 
-    # 🔓 РЕЖИМ ОТЛАДКИ (Тест в браузере):
-    # Если нужно проверить ссылку в Chrome без фронтенда,
-    # закомментируйте строку выше и раскомментируйте строку ниже:
-    # permission_classes = [AllowAny]
-
     def get(self, request):
         # --- 1. Считываем параметры из запроса ---
         school_ids = request.query_params.get('schools')
@@ -20,39 +69,29 @@ class AllResultsView(APIView):
         gat_round = request.query_params.get('gat')
         grade_level = request.query_params.get('grade')
         gat_day = request.query_params.get('day')  # 🔥 Параметр дня
+        search = request.query_params.get('search', '').strip()
 
-        # 🔍 ЛОГИ: Выводим в терминал параметры запроса
-        print(f"\n--- 🔍 ЗАПРОС API (AllResultsView) ---")
-        print(f"Schools: {school_ids}")
-        print(f"Quarter: {quarter_id}")
-        print(f"GAT Round: {gat_round}")
-        print(f"Grade: {grade_level}")
-        print(f"Day: {gat_day}")
-
-        # --- 2. Базовая выборка (Optimized) ---
-        # Используем select_related, чтобы Django не делал 1000 запросов к БД
-        queryset = ExamResult.objects.select_related(
-            'student', 
-            'student__school', 
-            'student__student_class', 
-            'exam'
-        ).all()
+        fields_param = request.query_params.get('fields')
+        fields = list(dict.fromkeys(f for f in fields_param.split(',') if f in FIELD_COLUMNS)) if fields_param else list(FIELD_COLUMNS)
+        if not fields:
+            return Response({"error": f"Неизвестные поля. Доступны: {', '.join(FIELD_COLUMNS)}"}, status=400)
+
+        # --- 2. Базовая выборка ---
+        # values() вместо моделей: только нужные колонки, без создания объектов на каждую строку
+        queryset = ExamResult.objects.all()
 
         # --- 3. Применяем фильтры ---
-        
+
         # Фильтр по Школам (принимает строку "1,2,3")
         if school_ids:
-            try:
-                ids = [int(x) for x in school_ids.split(',') if x.strip().isdigit()]
-                if ids:
-                    queryset = queryset.filter(student__school_id__in=ids)
-            except ValueError:
-                pass
-        
+            ids = [int(x) for x in school_ids.split(',') if x.strip().isdigit()]
+            if ids:
+                queryset = queryset.filter(student__school_id__in=ids)
+
         # Фильтр по Четверти
         if quarter_id and quarter_id.isdigit():
             queryset = queryset.filter(exam__quarter_id=int(quarter_id))
-            
+
         # Фильтр по Раунду GAT
         if gat_round and gat_round.isdigit():
             queryset = queryset.filter(exam__gat_round=int(gat_round))
@@ -60,36 +99,81 @@ class AllResultsView(APIView):
         # 🔥 Фильтр по Дню (1 или 2)
         if gat_day and gat_day.isdigit():
             queryset = queryset.filter(exam__gat_day=int(gat_day))
-            
+
         # Фильтр по Классу (grade level)
         if grade_level and grade_level.isdigit():
             queryset = queryset.filter(student__student_class__grade_level=int(grade_level))
 
-        # 🔍 ЛОГИ: Количество найденных записей
-        count = queryset.count()
-        print(f"✅ НАЙДЕНО ЗАПИСЕЙ: {count}")
-        print("-------------------------------------\n")
-
-        # --- 4. Формируем красивый JSON ---
-        data = []
-        for r in queryset:
-            # Безопасное получение имени школы и класса (на случай если удалены)
-            school_name = r.student.school.name if r.student.school else "—"
-            class_name = str(r.student.student_class) if r.student.student_class else "-"
-            
-            # Формируем ФИО
-            student_name = f"{r.student.last_name_ru} {r.student.first_name_ru}"
-            
-            data.append({
-                "id": r.id,
-                "student_name": student_name,
-                "class_name": class_name,
-                "school_name": school_name,
-                "score": r.score,
-                "max_score": r.max_score,
-                "percentage": r.percentage,
-                "details": r.details,   # Детализация ответов (Eng_1: 1, Math_2: 0...)
-                "day": r.exam.gat_day   # Возвращаем день, чтобы показать в таблице
+        # Поиск по всей выборке на сервере (не только по загруженным страницам)
+        if search:
+            queryset = queryset.filter(
+                Q(student__last_name_ru__icontains=search) |
+                Q(student__first_name_ru__icontains=search) |
+                Q(student__school__name__icontains=search)
+            )
+
+        columns = [column for field in fields for column in FIELD_COLUMNS[field]]
+        rows = queryset.order_by('-score', '-id').values(*columns)
+
+        # --- 4. Потоковая выгрузка ---
+        export = request.query_params.get('export')
+        if export == 'ndjson':
+            return self.stream_ndjson(rows, fields)
+        if export == 'csv':
+            return self.stream_csv(rows, fields)
+
+        # --- 5. Страница JSON ---
+        try:
+            page = max(int(request.query_params.get('page', 1)), 1)
+            limit = min(max(int(request.query_params.get('limit', DEFAULT_LIMIT)), 1), MAX_LIMIT)
+        except ValueError:
+            page, limit = 1, DEFAULT_LIMIT
+        offset = (page - 1) * limit
+
+        # На одну строку больше — узнаем, есть ли следующая страница, без COUNT
+        page_rows = list(rows[offset:offset + limit + 1])
+        data = {
+            "page": page,
+            "limit": limit,
+            "has_next": len(page_rows) > limit,
+            "results": [{field: _field_value(field, row) for field in fields} for row in page_rows[:limit]],
+        }
+
+        # Итоги для карточек — по всей выборке одним aggregate(), только с первой страницей
+        if page == 1:
+            totals = queryset.aggregate(total=Count('id'), avg=Avg('percentage'), max=Max('score'))
+            data.update({
+                "total": totals["total"],
+                "avg": round(totals["avg"], 1) if totals["avg"] is not None else None,
+                "max": totals["max"],
             })
-            
-        return Response(data)
\ No newline at end of file
+        return Response(data)
+
+    @staticmethod
+    def stream_ndjson(rows, fields):
+        """Одна строка JSON на результат (application/x-ndjson)."""
+        def generate():
+            for row in rows.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+                item = {field: _field_value(field, row) for field in fields}
+                yield json.dumps(item, ensure_ascii=False) + "\n"
+
+        return StreamingHttpResponse(generate(), content_type='application/x-ndjson; charset=utf-8')
+
+    @staticmethod
+    def stream_csv(rows, fields):
+        """CSV для Excel (BOM, чтобы кириллица открывалась без настройки кодировки)."""
+        writer = csv.writer(_Echo())
+        # details в ячейке CSV — строкой JSON
+        details_index = fields.index("details") if "details" in fields else None
+
+        def generate():
+            yield '\ufeff' + writer.writerow(fields)
+            for row in rows.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+                values = [_field_value(field, row) for field in fields]
+                if details_index is not None:
+                    values[details_index] = json.dumps(values[details_index], ensure_ascii=False)
+                yield writer.writerow(values)
+
+        response = StreamingHttpResponse(generate(), content_type='text/csv; charset=utf-8')
+        response['Content-Disposition'] = 'attachment; filename="gat_results.csv"'
+        return response
@@ -2,13 +2,14 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from rest_framework import status
-from django.db.models import Avg, Count
+from django.db.models import Avg, Count, Sum, Case, When, Value, IntegerField
 from collections import defaultdict
 import re
 
 # Импорт моделей
 from ..models import ExamResult, Student
 from ..services.ai_service import generate_class_report
+from ..services.analytics_cache import AnalyticsCache
 
 # ==========================================
 # 1. AI REPORT (Без изменений)
@@ -26,70 +27,86 @@ class ExamReportView(APIView):
 # ==========================================
 # 2. DASHBOARD ANALYTICS
 # ==========================================
+
+# Оценка по 10-балльной шкале из процента: <10% -> 1, 10-19% -> 2, ..., 90-100% -> 10.
+# Считается в SQL (CASE), чтобы матрица оценок строилась GROUP BY, а не циклом по всем результатам
+MARK_CASE = Case(
+    *[When(percentage__gte=(mark - 1) * 10, then=Value(mark)) for mark in range(10, 1, -1)],
+    default=Value(1),
+    output_field=IntegerField(),
+)
+
+
+def _parse_numbers(param, first_digits=False):
+    """'1,2,x' -> (1, 2); для классов/GAT ('5A', 'GAT-2') берем первое число. Отсортировано, без повторов."""
+    if not param:
+        return ()
+    numbers = set()
+    for item in param.split(','):
+        if first_digits:
+            digits = re.findall(r'\d+', item)
+            if digits:
+                numbers.add(int(digits[0]))
+        elif item.strip().isdigit():
+            numbers.add(int(item))
+    return tuple(sorted(numbers))
+
+
 class DashboardAnalyticsView(APIView):
     """
     URL: /api/analytics/dashboard/
+    Ответ кэшируется по нормализованным фильтрам (AnalyticsCache)
+    и сбрасывается, когда появляются новые результаты.
     """
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        # 1. Читаем фильтры
-        schools_param = request.query_params.get('schools')
-        classes_param = request.query_params.get('classes')
-        gats_param = request.query_params.get('gats')
-
-        # 2. Базовый запрос
-        queryset = ExamResult.objects.select_related(
-            'student', 'student__school', 'student__student_class', 'exam'
-        ).all()
-
-        # 3. Применяем фильтры
-        if schools_param:
-            try:
-                ids = [int(x) for x in schools_param.split(',') if x.isdigit()]
-                if ids:
-                    queryset = queryset.filter(student__school__id__in=ids)
-            except: pass
-
-        if classes_param:
-            target_grades = []
-            for item in classes_param.split(','):
-                digits = re.findall(r'\d+', item)
-                if digits: target_grades.append(int(digits[0]))
-            if target_grades:
-                queryset = queryset.filter(student__student_class__grade_level__in=target_grades)
-
-        if gats_param:
-            target_rounds = []
-            for item in gats_param.split(','):
-                digits = re.findall(r'\d+', item)
-                if digits: target_rounds.append(int(digits[0]))
-            if target_rounds:
-                # ВАЖНО: Проверь, как называется поле в модели Exam (round_id или gat_round)
-                # Обычно это gat_round или просто round
-                queryset = queryset.filter(exam__gat_round__in=target_rounds)
+        # 1. Читаем и нормализуем фильтры ("5,3" и "3,5" -> один ключ кэша)
+        filters = {
+            "schools": _parse_numbers(request.query_params.get('schools')),
+            "grades": _parse_numbers(request.query_params.get('classes'), first_digits=True),
+            "rounds": _parse_numbers(request.query_params.get('gats'), first_digits=True),
+        }
+        data = AnalyticsCache.get_or_build("dashboard", filters, lambda: self.build(**filters))
+        return Response(data, status=status.HTTP_200_OK)
+
+    @staticmethod
+    def build(schools=(), grades=(), rounds=()):
+        # 2. Базовый запрос + фильтры
+        queryset = ExamResult.objects.all()
+        if schools:
+            queryset = queryset.filter(student__school__id__in=schools)
+        if grades:
+            queryset = queryset.filter(student__student_class__grade_level__in=grades)
+        if rounds:
+            queryset = queryset.filter(exam__gat_round__in=rounds)
+
+        # --- РАСЧЕТ KPI --- (один запрос вместо exists + count + aggregate)
+        kpi = queryset.aggregate(total=Count('id'), avg=Avg('percentage'))
 
         # Если данных нет
-        if not queryset.exists():
-            return Response({
+        if not kpi['total']:
+            return {
                 "kpi": {"avg_gat": 0, "total_students": 0, "top_school": "-"},
                 "leaders": [],
                 "chart_schools": [],
-                "chart_subjects": [], # Пустой список
+                "chart_subjects": [],
                 "matrix": []
-            })
+            }
+
+        # --- ГРАФИК 1: ПО ШКОЛАМ --- (первая школа = лучшая, отдельный запрос не нужен)
+        schools_stats = queryset.values('student__school__name').annotate(
+            score=Avg('percentage')
+        ).order_by('-score')
 
-        # --- РАСЧЕТ KPI ---
-        total_students = queryset.count()
-        avg_gat = queryset.aggregate(Avg('percentage'))['percentage__avg'] or 0
-        
-        top_school_data = queryset.values('student__school__name').annotate(
-            avg=Avg('percentage')
-        ).order_by('-avg').first()
-        top_school = top_school_data['student__school__name'] if top_school_data else "-"
+        chart_schools = [
+            {"name": s['student__school__name'], "score": round(s['score'], 1), "prev": 0}
+            for s in schools_stats
+        ]
+        top_school = chart_schools[0]['name'] if chart_schools else "-"
 
         # --- ТОП 5 УЧЕНИКОВ ---
-        leaders_qs = queryset.order_by('-score')[:5]
+        leaders_qs = queryset.select_related('student', 'student__school').order_by('-score')[:5]
         leaders = []
         for res in leaders_qs:
             leaders.append({
@@ -99,86 +116,63 @@ class DashboardAnalyticsView(APIView):
                 "score": res.score
             })
 
-        # --- ГРАФИК 1: ПО ШКОЛАМ ---
-        schools_stats = queryset.values('student__school__name').annotate(
-            score=Avg('percentage')
-        ).order_by('-score')
-        
-        chart_schools = []
-        for s in schools_stats:
-            chart_schools.append({
-                "name": s['student__school__name'],
-                "score": round(s['score'], 1),
-                "prev": 0 
-            })
-
-        # --- 🔥 НОВОЕ: ГРАФИК 2: ПО ПРЕДМЕТАМ ---
+        # --- ГРАФИК 2: ПО ПРЕДМЕТАМ ---
         # Группируем по имени предмета, связанного с экзаменом
-        subjects_stats = queryset.values('exam__subjects__name').annotate(
+        subjects_stats = queryset.filter(exam__subjects__isnull=False).values('exam__subjects__name').annotate(
             score=Avg('percentage')
         ).order_by('-score')
 
-        chart_subjects = []
-        for s in subjects_stats:
-            subj_name = s['exam__subjects__name']
-            if subj_name: # Исключаем None
-                chart_subjects.append({
-                    "name": subj_name,
-                    "score": round(s['score'], 1)
-                })
+        chart_subjects = [
+            {"name": s['exam__subjects__name'], "score": round(s['score'], 1)}
+            for s in subjects_stats
+        ]
+
+        # --- МАТРИЦА ОЦЕНОК --- GROUP BY (параллель, литера, оценка) в SQL
+        buckets = (
+            queryset.filter(student__student_class__isnull=False)
+            .annotate(mark=MARK_CASE)
+            .values('student__student_class__grade_level', 'student__student_class__section', 'mark')
+            .annotate(count=Count('id'), sum_pct=Sum('percentage'))
+            .order_by()
+        )
 
-        # --- МАТРИЦА ОЦЕНОК ---
         tree = defaultdict(lambda: defaultdict(lambda: {
-            "marks": defaultdict(int), "total": 0, "sum_pct": 0
+            "marks": {}, "total": 0, "sum_pct": 0
         }))
+        for row in buckets:
+            grade = row['student__student_class__grade_level']
+            section = row['student__student_class__section']
+            cls_name = f"{grade}-{section}" if section else f"{grade}"
 
-        for res in queryset:
-            cls_obj = res.student.student_class
-            if not cls_obj: continue
-            
-            try:
-                section = getattr(cls_obj, 'section', '')
-                cls_name = f"{cls_obj.grade_level}-{section}" if section else f"{cls_obj.grade_level}"
-                level = f"{cls_obj.grade_level} Класс"
-            except:
-                level = "Неизвестно"
-                cls_name = str(cls_obj)
-
-            if res.percentage == 100: mark = 10
-            else: mark = int(res.percentage // 10) + 1
-            if mark < 1: mark = 1
-            if mark > 10: mark = 10
-
-            tree[level][cls_name]["marks"][mark] += 1
-            tree[level][cls_name]["total"] += 1
-            tree[level][cls_name]["sum_pct"] += res.percentage
+            cell = tree[grade][cls_name]
+            cell["marks"][row['mark']] = row['count']
+            cell["total"] += row['count']
+            cell["sum_pct"] += row['sum_pct'] or 0
 
         grades_list = []
-        sorted_levels = sorted(tree.keys(), key=lambda x: int(x.split()[0]) if x.split()[0].isdigit() else 0, reverse=True)
-
-        for level in sorted_levels:
+        for grade in sorted(tree, reverse=True):
             classes_data = []
-            for cls_name, data in tree[level].items():
-                avg = round(data["sum_pct"] / data["total"], 1) if data["total"] > 0 else 0
+            for cls_name, cell in tree[grade].items():
+                avg = round(cell["sum_pct"] / cell["total"], 1) if cell["total"] > 0 else 0
                 classes_data.append({
                     "name": cls_name,
-                    "marks": data["marks"],
-                    "total": data["total"],
+                    "marks": cell["marks"],
+                    "total": cell["total"],
                     "avg": avg
                 })
             classes_data.sort(key=lambda x: x["name"])
-            grades_list.append({"level": level, "classes": classes_data})
+            grades_list.append({"level": f"{grade} Класс", "classes": classes_data})
 
         matrix = [{"id": 1, "title": "GAT (Общий)", "grades": grades_list}]
 
-        return Response({
+        return {
             "kpi": {
-                "avg_gat": round(avg_gat, 1),
-                "total_students": total_students,
+                "avg_gat": round(kpi['avg'] or 0, 1),
+                "total_students": kpi['total'],
                 "top_school": top_school
             },
             "leaders": leaders,
             "chart_schools": chart_schools,
-            "chart_subjects": chart_subjects, # 🔥 Отправляем новые данные
+            "chart_subjects": chart_subjects,
             "matrix": matrix
-        }, status=status.HTTP_200_OK)
\ No newline at end of file
+        }
@@ -5,21 +5,18 @@ from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from django.db.models import Count
 from django.shortcuts import get_object_or_404
-from django.template.loader import render_to_string
-from django.http import HttpResponse
+from django.core.files.storage import default_storage
+from django.template import TemplateSyntaxError
+from django.http import HttpResponse, FileResponse
+from celery.result import AsyncResult, GroupResult
 import logging
 
 # Логгер
 logger = logging.getLogger(__name__)
 
-# WeasyPrint (PDF движок)
-try:
-    import weasyprint
-except ImportError:
-    weasyprint = None
-
 # --- ИМПОРТЫ МОДЕЛЕЙ ---
 from ..models import School, Exam, Question, Subject, BookletSection
+from ..services.booklet_pdf import BookletPdfService, weasyprint
 
 # ==============================================================================
 # 1. КАТАЛОГ БУКЛЕТОВ (Список для карточек)
@@ -107,7 +104,8 @@ class BookletCatalogView(APIView):
             if gat_number:
                 qs = qs.filter(gat_round=gat_number)
             
-            qs = qs.order_by('gat_day', 'variant')
+            qs = qs.select_related('booklet').order_by('gat_day', 'variant')
+            rendering = BookletPdfService.rendering_ids({exam.booklet_id for exam in qs if exam.booklet_id})
             
             data = []
             for exam in qs:
@@ -129,7 +127,8 @@ class BookletCatalogView(APIView):
                     "question_count": exam.questions.count(),
                     "fill_percent": 100 if is_ready else 50,
                     "color": "blue" if exam.variant == 'A' else "indigo",
-                    "status": exam.status
+                    "status": exam.status,
+                    "pdf_status": BookletPdfService.status(exam, rendering)  # ready | rendering | pending
                 })
             return Response(data)
 
@@ -147,10 +146,10 @@ class BookletPreviewView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request, pk):
-        exam = get_object_or_404(Exam, pk=pk)
+        exam = get_object_or_404(Exam.objects.select_related('booklet'), pk=pk)
         
-        # 1. Получаем карту порядка (JSON)
-        order_map = exam.question_order or {}
+        # 1. Получаем карту порядка (JSON) — общая версия буклета или своя карта экзамена
+        order_map = exam.order_map
         
         # 2. Загружаем вопросы
         all_questions = list(exam.questions.select_related('topic__subject').prefetch_related('choices'))
@@ -270,89 +269,81 @@ class BookletPreviewView(APIView):
 # ==============================================================================
 class BookletDownloadView(APIView):
     """
-    Генерирует PDF файл.
+    Отдает PDF файл буклета.
+    PDF кэшируется в хранилище по хэшу содержимого (BookletPdfService):
+    все учителя всех школ с этим буклетом получают один и тот же файл без повторного рендера.
     """
     permission_classes = [IsAuthenticated]
 
     def get(self, request, pk):
-        exam = get_object_or_404(Exam, pk=pk)
-        order_map = exam.question_order or {}
-        
-        all_questions = list(exam.questions.select_related('topic__subject').prefetch_related('choices'))
-        q_lookup = {q.id: q for q in all_questions}
+        exam = get_object_or_404(Exam.objects.select_related('booklet'), pk=pk)
 
-        ordered_questions = []
-        
-        if order_map:
-            sorted_keys = sorted(order_map.keys(), key=lambda x: int(x))
-            for key in sorted_keys:
-                item = order_map[key]
-                if isinstance(item, dict):
-                    q_id = item.get('id')
-                    custom_choices_order = item.get('choices', [])
-                else:
-                    q_id = item
-                    custom_choices_order = []
-
-                question = q_lookup.get(q_id)
-                if question:
-                    # Подменяем порядок ответов для PDF
-                    if custom_choices_order:
-                        c_lookup = {c.id: c for c in question.choices.all()}
-                        sorted_choices = []
-                        for c_id in custom_choices_order:
-                            if c_id in c_lookup:
-                                sorted_choices.append(c_lookup[c_id])
-                        question.pdf_choices = sorted_choices
-                    else:
-                        question.pdf_choices = list(question.choices.all())
-                    ordered_questions.append(question)
-        else:
-            ordered_questions = all_questions
-            for q in ordered_questions:
-                q.pdf_choices = list(q.choices.all())
+        # Без WeasyPrint — HTML буклета (для отладки шаблона)
+        if weasyprint is None:
+            try:
+                return HttpResponse(BookletPdfService.render_html(exam))
+            except Exception as e:
+                return Response({"error": f"Template error: {str(e)}"}, status=500)
 
-        # Группировка для PDF
-        sections = []
-        current_subject = None
-        current_questions = []
+        # Готовый PDF из хранилища (рендер только при первом скачивании этого содержимого)
+        try:
+            path, _ = BookletPdfService.get_or_render(exam, base_url=request.build_absolute_uri())
+        except TemplateSyntaxError as e:
+            return Response({"error": f"Template error: {str(e)}"}, status=500)
+        except Exception as e:
+            logger.error(f"WeasyPrint error: {e}")
+            return Response({"error": f"PDF Error: {str(e)}"}, status=500)
 
-        for q in ordered_questions:
-            subj_name = q.topic.subject.name if (q.topic and q.topic.subject) else "General"
-            
-            if subj_name != current_subject:
-                if current_subject:
-                    sections.append({'subject': current_subject, 'questions': list(current_questions)})
-                current_subject = subj_name
-                current_questions = []
-            current_questions.append(q)
+        filename = f"Exam_{exam.pk}_Var{exam.variant}.pdf"
+        return FileResponse(
+            default_storage.open(path, 'rb'), content_type='application/pdf',
+            as_attachment=False, filename=filename
+        )
 
-        if current_subject:
-            sections.append({'subject': current_subject, 'questions': current_questions})
-
-        context = {
-            'exam': exam,
-            'variant': exam.variant,
-            'sections': sections,
-            'school_name': exam.school.name if exam.school else "EduTest",
-            'date': exam.date or "2026",
-            'host': request.build_absolute_uri('/')[:-1]
-        }
 
-        try:
-            html_string = render_to_string('booklet_pdf.html', context, request=request)
-        except Exception as e:
-            return Response({"error": f"Template error: {str(e)}"}, status=500)
+# ==============================================================================
+# 4. ПРОГРЕСС ФОНОВОГО РЕНДЕРА PDF (после генерации вариантов)
+# ==============================================================================
+class BookletRenderStatusView(APIView):
+    """
+    Прогресс booklet_prerender_task (render_task_id из generate_variants).
+    Собирает состояние группы чанков из django-db: сколько буклетов готово и статус каждого.
+    """
+    permission_classes = [IsAuthenticated]
 
-        if weasyprint:
-            try:
-                pdf_file = weasyprint.HTML(string=html_string, base_url=request.build_absolute_uri()).write_pdf()
-                response = HttpResponse(pdf_file, content_type='application/pdf')
-                filename = f"Exam_{exam.pk}_Var{exam.variant}.pdf"
-                response['Content-Disposition'] = f'inline; filename="{filename}"'
-                return response
-            except Exception as e:
-                logger.error(f"WeasyPrint error: {e}")
-                return Response({"error": f"PDF Error: {str(e)}"}, status=500)
-        else:
-            return HttpResponse(html_string)
\ No newline at end of file
+    def get(self, request, task_id):
+        task_result = AsyncResult(task_id)
+
+        if task_result.state in ('PENDING', 'STARTED'):
+            return Response({"state": task_result.state, "status": "Подготовка буклетов..."})
+        if task_result.state == 'FAILURE':
+            return Response({"state": "FAILURE", "error": str(task_result.result)})
+
+        info = task_result.result or {}
+        group_result = GroupResult.restore(info.get('group_id'))
+        if group_result is None:
+            return Response({"state": "FAILURE", "error": "Группа задач не найдена"})
+
+        booklets, errors, in_progress = [], [], 0
+        for chunk in group_result.results:
+            if chunk.state == 'SUCCESS':
+                booklets.extend(chunk.result)
+            elif chunk.state == 'PROGRESS':
+                in_progress += (chunk.info or {}).get('done', 0)
+            elif chunk.state == 'FAILURE':
+                errors.append(str(chunk.result))
+
+        total = info.get('total', 0)
+        processed = len(booklets) + in_progress
+        ready = sum(1 for item in booklets if item['status'] == 'ready')
+
+        return Response({
+            "state": "SUCCESS" if group_result.ready() else "PROGRESS",
+            "total": total,
+            "processed": processed,
+            "percent": round(processed / total * 100, 1) if total else 100,
+            "ready": ready,
+            "failed": len(booklets) - ready,
+            "errors": errors,
+            "booklets": booklets
+        })
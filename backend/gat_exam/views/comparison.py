@@ -1,12 +1,12 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
-from django.db.models import Avg, Count, F, Q
-from django.db.models.functions import TruncDate
+from django.db.models import Avg, Count, F, Min, Q, Value, Window
+from django.db.models.functions import Coalesce, Lag, TruncDate
 from collections import defaultdict
 
 # Импортируем твои модели
-from ..models import ExamResult, Exam, Subject, School, Student, StudentClass
+from ..models import ExamResult, Exam, Subject, School, Student, StudentClass, QuestionResponse
 
 class AnalyticsView(APIView):
     """
@@ -201,39 +201,35 @@ class AnalyticsView(APIView):
 
     def _get_heatmap_data(self, qs):
         """
-        Формирует структуру для тепловых карт, разбирая JSON с ответами.
-        Ожидаемая структура JSON в ExamResult.details:
-        { "1": true, "2": false, ... } - где ключ - номер вопроса.
+        Формирует структуру для тепловых карт.
+        Верные/всего по (предмет, параллель, школа, вопрос) считаются одним GROUP BY
+        по факт-таблице QuestionResponse (см. ResultFactsService), без разбора JSON details.
+        Группируем по question_id: в варианте Б тот же вопрос стоит под другим номером.
+        Подпись ячейки — номер вопроса в варианте А (мастер-порядок буклета).
         """
         # Структура: data[Subject_Name][School_Name][Question_Num] = {correct, total}
         raw_map = defaultdict(lambda: defaultdict(lambda: defaultdict(lambda: {"correct": 0, "total": 0})))
-        
-        # Получаем данные пакетами (оптимизация)
-        # Нам нужны: детали ответов, имя школы, класс, предмет
-        values = qs.values(
-            'details', 
-            'student__school__name', 
-            'exam__subjects__name',
-            'student__student_class__grade_level'
+
+        rows = list(
+            QuestionResponse.objects.filter(result__in=qs.values('id'))
+            .values(
+                'question_id',
+                subject_name=Coalesce('question__topic__subject__name', Value('Общее')),
+                grade=F('result__student__student_class__grade_level'),
+                school_name=F('result__student__school__name'),
+            )
+            .annotate(total=Count('id'), correct=Count('id', filter=Q(is_correct=True)), first_num=Min('booklet_num'))
         )
+        master_nums = self._master_numbers({item['question_id'] for item in rows})
 
-        for item in values:
-            details = item['details']
-            school_name = item['student__school__name']
-            subject_name = item['exam__subjects__name']
-            grade = item['student__student_class__grade_level']
-            
+        for item in rows:
             # Ключ для группировки карт (например: "Математика (11-е классы)")
-            heatmap_key = f"{subject_name} ({grade}-е классы)"
-            
-            if not details or not isinstance(details, dict):
-                continue
-            
-            for q_num, is_correct in details.items():
-                # q_num - это номер вопроса ("1", "2"...)
-                raw_map[heatmap_key][school_name][q_num]["total"] += 1
-                if is_correct:
-                    raw_map[heatmap_key][school_name][q_num]["correct"] += 1
+            heatmap_key = f"{item['subject_name']} ({item['grade']}-е классы)"
+            # Вопроса нет ни в одном буклете варианта А — берем его номер из ответов
+            q_num = str(master_nums.get(item['question_id'], item['first_num']))
+            cell = raw_map[heatmap_key][item['school_name']][q_num]
+            cell["correct"] += item['correct']
+            cell["total"] += item['total']
 
         # Превращаем в финальный формат для фронтенда
         final_data = {}
@@ -293,42 +289,89 @@ class AnalyticsView(APIView):
 
         return final_data, final_summary
 
+    def _master_numbers(self, question_ids):
+        """
+        {question_id: номер в варианте А} по картам буклетов варианта А с этими вопросами.
+        Версия буклета общая для всех школ — каждую карту разбираем один раз.
+        """
+        if not question_ids:
+            return {}
+        exams = (
+            Exam.objects.filter(variant='A', questions__in=question_ids)
+            .select_related('booklet').distinct()
+        )
+        numbers = {}
+        seen_booklets = set()
+        for exam in exams:
+            if exam.booklet_id:
+                if exam.booklet_id in seen_booklets:
+                    continue
+                seen_booklets.add(exam.booklet_id)
+            for key, item in exam.order_map.items():
+                q_id = item.get('id') if isinstance(item, dict) else item
+                if q_id in question_ids and str(key).isdigit():
+                    numbers.setdefault(q_id, int(key))
+        return numbers
+
     def _get_risk_group(self, qs):
         """
-        Находит учеников с баллом < 50%.
-        Пытается определить тренд (сравнивая с предыдущим GAT).
+        Находит учеников с баллом < 50% (вся выборка, от худших к лучшим).
+        Тренд — сравнение с предыдущим GAT того же года и дня (тот же набор предметов).
+        3 запроса на любое число учеников: сами результаты, оконный LAG по раундам, предметы экзаменов.
         """
-        # Берем только последние результаты учеников (группировка сложная, упростим)
-        # Фильтруем "двоечников"
-        low_scores = qs.filter(percentage__lt=50).order_by('percentage')[:10] # Топ 10 проблемных
-        
+        low_scores = list(
+            qs.filter(percentage__lt=50).order_by('percentage', 'id').values(
+                'id', 'percentage', 'exam_id', 'exam__gat_round',
+                'student__last_name_ru', 'student__first_name_ru',
+                'student__student_class__grade_level', 'student__student_class__section',
+                'student__school__name',
+            ).distinct()
+        )
+        if not low_scores:
+            return []
+
+        # Предыдущий результат ученика: LAG по раундам внутри (ученик, учебный год, день GAT).
+        # Окно считается по всей истории ученика, поэтому фильтры по GAT не отрезают прошлый раунд
+        partition = [F('student_id'), F('exam__school_year_id'), F('exam__gat_day')]
+        previous = {
+            row['id']: row
+            for row in ExamResult.objects.filter(
+                exam__status='finished',
+                student_id__in=qs.filter(percentage__lt=50).values('student_id'),
+            ).annotate(
+                prev_percentage=Window(Lag('percentage'), partition_by=partition, order_by=F('exam__gat_round').asc()),
+                prev_round=Window(Lag('exam__gat_round'), partition_by=partition, order_by=F('exam__gat_round').asc()),
+            ).values('id', 'prev_percentage', 'prev_round')
+        }
+
+        # Первый предмет экзамена (по названию, как exam.subjects.first())
+        exam_subject = {}
+        for exam_id, name in Exam.subjects.through.objects.filter(
+            exam_id__in={res['exam_id'] for res in low_scores}
+        ).values_list('exam_id', 'subject__name'):
+            if exam_id not in exam_subject or name < exam_subject[exam_id]:
+                exam_subject[exam_id] = name
+
         risk_list = []
         for res in low_scores:
-            # Попытка найти предыдущий результат
             trend = "stable"
-            current_gat = res.exam.gat_round
-            if current_gat > 1:
-                prev_res = ExamResult.objects.filter(
-                    student=res.student,
-                    exam__gat_round=current_gat - 1,
-                    exam__subjects__in=res.exam.subjects.all()
-                ).first()
-                
-                if prev_res:
-                    if res.percentage < prev_res.percentage:
-                        trend = "down" # Ухудшился
-                    elif res.percentage > prev_res.percentage:
-                        trend = "up"   # Улучшился
-            
+            prev = previous.get(res['id'])
+            if prev and prev['prev_percentage'] is not None and prev['prev_round'] == res['exam__gat_round'] - 1:
+                if res['percentage'] < prev['prev_percentage']:
+                    trend = "down" # Ухудшился
+                elif res['percentage'] > prev['prev_percentage']:
+                    trend = "up"   # Улучшился
+
+            grade = res['student__student_class__grade_level']
             risk_list.append({
-                "name": f"{res.student.last_name_ru} {res.student.first_name_ru}",
-                "class": f"{res.student.student_class.grade_level}{res.student.student_class.section}",
-                "school": res.student.school.name,
-                "subject": res.exam.subjects.first().name if res.exam.subjects.exists() else "GAT",
-                "score": int(res.percentage),
+                "name": f"{res['student__last_name_ru']} {res['student__first_name_ru']}",
+                "class": f"{grade}{res['student__student_class__section']}" if grade is not None else "-",
+                "school": res['student__school__name'],
+                "subject": exam_subject.get(res['exam_id'], "GAT"),
+                "score": int(res['percentage']),
                 "trend": trend
             })
-            
+
         return risk_list
 
     def _get_ai_insights(self, qs, trend_chart):
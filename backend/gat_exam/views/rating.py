@@ -1,9 +1,99 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
-from django.db.models import Avg
-from ..models import ExamResult, Subject, StudentClass, School
-import json
+import base64
+from django.db.models import Avg, Count, Q
+from collections import defaultdict
+from ..models import ExamResult, Exam, Subject, SubjectScore, StudentClass, School
+from ..services.analytics_cache import AnalyticsCache
+
+
+def _translated(row, lang):
+    """Название на языке интерфейса: name_tj / name_en, если заполнено, иначе name (RU)."""
+    if 'tj' in lang:
+        return row.get('name_tj') or row['name']
+    if 'en' in lang:
+        return row.get('name_en') or row['name']
+    return row['name']
+
+
+def rating_meta():
+    """
+    Справочник для фильтров рейтинга: школы, классы (school_id, параллель, литера),
+    раунды GAT с результатами и предметы. 4 запроса на всю сеть, дальше — из AnalyticsCache
+    (сбрасывается при новых результатах и изменении школ/классов/предметов, см. signals.py).
+    """
+    def build():
+        return {
+            "schools": list(School.objects.order_by('id').values('id', 'name', 'name_tj', 'name_en', 'color_theme')),
+            "classes": list(StudentClass.objects.values_list('school_id', 'grade_level', 'section').distinct()),
+            "gats": list(Exam.objects.filter(results__isnull=False).values_list('gat_round', flat=True).distinct().order_by('gat_round')),
+            "subjects": {
+                s['id']: s for s in Subject.objects.order_by('name').values(
+                    'id', 'name', 'name_tj', 'name_en', 'slug', 'abbreviation', 'color', 'is_active'
+                )
+            },
+        }
+    return AnalyticsCache.get_or_build("rating_meta", {}, build)
+
+
+def _int_list(param):
+    return sorted({int(x) for x in param.split(',') if x.strip().isdigit()}) if param else []
+
+
+def encode_cursor(score, result_id):
+    """Курсор keyset-пагинации: последняя строка страницы (score, id) -> непрозрачная строка."""
+    return base64.urlsafe_b64encode(f"{score!r}:{result_id}".encode()).decode()
+
+
+def decode_cursor(token):
+    """Строка курсора -> (score, id) или None, если курсора нет или он битый."""
+    if not token:
+        return None
+    try:
+        score, result_id = base64.urlsafe_b64decode(token.encode()).decode().split(':')
+        return float(score), int(result_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def filtered_results(filters):
+    """ExamResult по нормализованным фильтрам рейтинга."""
+    queryset = ExamResult.objects.all()
+    if filters["schools"]: queryset = queryset.filter(student__school_id__in=filters["schools"])
+    if filters["grades"]: queryset = queryset.filter(student__student_class__grade_level__in=filters["grades"])
+    if filters["sections"]: queryset = queryset.filter(student__student_class__section__in=filters["sections"])
+    if filters["rounds"]: queryset = queryset.filter(exam__gat_round__in=filters["rounds"])
+    if filters["days"]: queryset = queryset.filter(exam__gat_day__in=filters["days"])
+    if filters["subjects"]: queryset = queryset.filter(exam__subjects__id__in=filters["subjects"]).distinct()
+    return queryset
+
+
+def rating_totals(filters):
+    """
+    Участники, средний балл и школа-лидер по фильтрам (2 запроса).
+    Кэшируется в AnalyticsCache — страницы рейтинга не платят за COUNT по всей выборке.
+    """
+    def build():
+        queryset = filtered_results(filters)
+        totals = queryset.aggregate(total=Count('id'), avg=Avg('score'))
+        leader = None
+        if totals['total']:
+            # Запрашиваем только существующие поля! name_ru не запрашиваем.
+            best_school = queryset.values(
+                'student__school__name',
+                'student__school__name_tj',
+                'student__school__name_en'
+            ).annotate(avg_score=Avg('score')).order_by('-avg_score').first()
+            if best_school:
+                leader = {
+                    'name': best_school['student__school__name'],
+                    'name_tj': best_school['student__school__name_tj'],
+                    'name_en': best_school['student__school__name_en'],
+                }
+        return {"total": totals['total'], "avg": totals['avg'], "leader": leader}
+    return AnalyticsCache.get_or_build("rating_totals", filters, build)
+
 
 class MonitoringRatingView(APIView):
     permission_classes = [IsAuthenticated]
@@ -20,158 +110,119 @@ class MonitoringRatingView(APIView):
         days = request.query_params.get('days')
         subjects = request.query_params.get('subjects')
 
-        # Пагинация
+        # Пагинация: cursor (keyset по score, id) — страница за постоянное время;
+        # page без cursor оставлен для совместимости (OFFSET)
         try:
             page = int(request.query_params.get('page', 1))
             limit = int(request.query_params.get('limit', 50))
         except ValueError:
             page = 1
             limit = 50
-        offset = (page - 1) * limit
+        cursor = decode_cursor(request.query_params.get('cursor'))
+        offset = 0 if cursor else (page - 1) * limit
+
+        # --- НОРМАЛИЗАЦИЯ ФИЛЬТРОВ --- (отсортированные списки: один набор = один ключ кэша)
+        filters = {
+            "schools": _int_list(school_ids_param),
+            "grades": _int_list(grades),
+            "sections": sorted({x.strip() for x in sections.split(',') if x.strip()}) if sections else [],
+            "rounds": sorted({int(e.lower().replace('gat', '')) for e in exams.split(',') if 'gat' in e.lower()}) if exams else [],
+            "days": _int_list(days),
+            "subjects": _int_list(subjects),
+        }
+        selected_school_ids = filters["schools"]
+        g_list = filters["grades"]
+
+        # --- СБОР МЕТА-ДАННЫХ --- из закэшированного справочника (без запросов на каждую школу)
+        meta = rating_meta()
+        selected = set(selected_school_ids)
+        classes = [c for c in meta["classes"] if not selected or c[0] in selected]
+
+        available_grades = sorted({grade for _, grade, _ in classes})
+        available_sections = sorted({section for _, grade, section in classes if not g_list or grade in g_list})
+        available_gats = meta["gats"]
 
-        # --- ПОДГОТОВКА ID ШКОЛ ---
-        selected_school_ids = []
-        if school_ids_param:
-            selected_school_ids = [int(x) for x in school_ids_param.split(',') if x.strip().isdigit()]
-        
-        # --- СБОР МЕТА-ДАННЫХ ---
-        classes_qs = StudentClass.objects.all()
-        if selected_school_ids:
-            classes_qs = classes_qs.filter(school_id__in=selected_school_ids)
-        
-        sections_qs = classes_qs
-        if grades:
-            g_list = [int(x) for x in grades.split(',') if x.strip().isdigit()]
-            sections_qs = sections_qs.filter(grade_level__in=g_list)
-
-        available_grades = classes_qs.values_list('grade_level', flat=True).distinct().order_by('grade_level')
-        available_sections = sections_qs.values_list('section', flat=True).distinct().order_by('section')
-        available_gats = ExamResult.objects.values_list('exam__gat_round', flat=True).distinct().order_by('exam__gat_round')
-        
         # Предметы (перевод)
-        all_subjects_db = Subject.objects.filter(is_active=True).order_by('name')
-        smart_subjects = []
-        for s in all_subjects_db:
-            default_name = getattr(s, 'name', 'Subject')
-            name = default_name
-            if 'tj' in lang: name = getattr(s, 'name_tj', None) or default_name
-            elif 'en' in lang: name = getattr(s, 'name_en', None) or default_name
-            smart_subjects.append({'id': str(s.id), 'label': name, 'slug': getattr(s, 'slug', str(s.id))})
+        smart_subjects = [
+            {'id': str(s['id']), 'label': _translated(s, lang), 'slug': s['slug'] or str(s['id'])}
+            for s in meta["subjects"].values() if s['is_active']
+        ]
 
         # --- ШКОЛЫ И КЛАССЫ ---
+        school_grades, school_sections = defaultdict(set), defaultdict(set)
+        for school_id, grade, section in meta["classes"]:
+            school_grades[school_id].add(grade)
+            school_sections[school_id].add(section)
+
         school_classes_info = {}
-        schools_to_fetch = School.objects.filter(id__in=selected_school_ids) if selected_school_ids else School.objects.all()
-        
-        for school in schools_to_fetch:
-            school_classes = StudentClass.objects.filter(school_id=school.id)
-            grades_in_school = school_classes.values_list('grade_level', flat=True).distinct().order_by('grade_level')
-            sections_in_school = school_classes.values_list('section', flat=True).distinct().order_by('section')
-            
-            # Логика имени школы (RU = name, TJ = name_tj, EN = name_en)
-            sch_name = school.name
-            if 'tj' in lang: 
-                sch_name = getattr(school, 'name_tj', '') or school.name
-            elif 'en' in lang: 
-                sch_name = getattr(school, 'name_en', '') or school.name
-            
-            school_classes_info[str(school.id)] = {
-                'id': school.id,
-                'name': sch_name,
-                'color_theme': school.color_theme,
-                'grades': list(grades_in_school),
-                'sections': list(sections_in_school),
+        for school in meta["schools"]:
+            if selected and school['id'] not in selected:
+                continue
+            school_classes_info[str(school['id'])] = {
+                'id': school['id'],
+                # Логика имени школы (RU = name, TJ = name_tj, EN = name_en)
+                'name': _translated(school, lang),
+                'color_theme': school['color_theme'],
+                'grades': sorted(school_grades[school['id']]),
+                'sections': sorted(school_sections[school['id']]),
             }
 
         # --- ФИЛЬТРАЦИЯ ---
-        queryset = ExamResult.objects.select_related('student', 'student__school', 'student__student_class', 'exam').prefetch_related('exam__subjects')
-
-        if selected_school_ids: queryset = queryset.filter(student__school_id__in=selected_school_ids)
-        if grades: queryset = queryset.filter(student__student_class__grade_level__in=[int(x) for x in grades.split(',') if x.strip().isdigit()])
-        if sections: queryset = queryset.filter(student__student_class__section__in=[x.strip() for x in sections.split(',') if x.strip()])
-        if exams: queryset = queryset.filter(exam__gat_round__in=[int(e.lower().replace('gat', '')) for e in exams.split(',') if 'gat' in e.lower()])
-        if days: queryset = queryset.filter(exam__gat_day__in=[int(x) for x in days.split(',') if x.strip().isdigit()])
-        if subjects: queryset = queryset.filter(exam__subjects__id__in=[int(x) for x in subjects.split(',') if x.strip().isdigit()]).distinct()
+        # details (JSON со всеми ответами) для списка не нужен — не тянем его из БД
+        queryset = filtered_results(filters).select_related(
+            'student', 'student__school', 'student__student_class', 'exam'
+        ).defer('details')
 
-        final_queryset = queryset.order_by('-score')
-        total_count = final_queryset.count()
+        # --- ИТОГИ И ЛИДЕР --- COUNT/AVG/GROUP BY по всей выборке считаются один раз на набор фильтров
+        totals = rating_totals(filters)
+        total_count = totals['total']
 
-        # --- ЛИДЕР (ИСПРАВЛЕНО) ---
         leader_info = { "key": "leader_school", "params": {}, "value": "-", "type": "school" }
-        if final_queryset.exists():
-            # Запрашиваем только существующие поля! name_ru не запрашиваем.
-            best_school = final_queryset.values(
-                'student__school__name', 
-                'student__school__name_tj', 
-                'student__school__name_en'
-            ).annotate(avg_score=Avg('score')).order_by('-avg_score').first()
-            
-            if best_school:
-                 # Выбираем имя лидера
-                 l_sch_name = best_school['student__school__name'] # По умолчанию (RU)
-                 
-                 if 'tj' in lang and best_school.get('student__school__name_tj'): 
-                     l_sch_name = best_school['student__school__name_tj']
-                 elif 'en' in lang and best_school.get('student__school__name_en'): 
-                     l_sch_name = best_school['student__school__name_en']
-                 
-                 leader_info = { "key": "leader_school", "params": {}, "value": l_sch_name, "type": "school" }
-
-        # --- СПИСОК СТУДЕНТОВ ---
-        paginated_qs = final_queryset[offset : offset + limit]
-        
+        if totals['leader']:
+            leader_info = { "key": "leader_school", "params": {}, "value": _translated(totals['leader'], lang), "type": "school" }
+
+        # --- СПИСОК СТУДЕНТОВ --- (-score, -id): id делает порядок однозначным при равных баллах
+        page_qs = queryset.order_by('-score', '-id')
+        if cursor:
+            score, last_id = cursor
+            page_qs = page_qs.filter(Q(score__lt=score) | Q(score=score, id__lt=last_id))
+        # Берем на одну строку больше, чтобы узнать, есть ли следующая страница, без COUNT
+        paginated_qs = list(page_qs[offset : offset + limit + 1])
+        has_next = len(paginated_qs) > limit
+        paginated_qs = paginated_qs[:limit]
+        next_cursor = encode_cursor(paginated_qs[-1].score, paginated_qs[-1].id) if has_next else None
+
+        # Баллы по предметам для всей страницы — одним запросом из SubjectScore
+        # (считаются при записи результата, см. ResultFactsService)
+        subject_scores = defaultdict(dict)
+        for result_id, subject_id, correct in SubjectScore.objects.filter(
+            result_id__in=[res.id for res in paginated_qs]
+        ).values_list('result_id', 'subject_id', 'correct'):
+            subject_scores[result_id][subject_id] = correct
+
+        # Предметы экзаменов страницы — один запрос по связующей таблице
+        exam_subjects = defaultdict(list)
+        for exam_id, subject_id in Exam.subjects.through.objects.filter(
+            exam_id__in={res.exam_id for res in paginated_qs}
+        ).values_list('exam_id', 'subject_id'):
+            if subject_id in meta["subjects"]:
+                exam_subjects[exam_id].append(meta["subjects"][subject_id])
+
         students_data = []
         for res in paginated_qs:
             student = res.student
             exam = res.exam
-            badges = []
-            db_subjects = exam.subjects.all()
-            
-            # Подготовка details
-            details_map = {}
-            if res.details:
-                raw_details = res.details
-                if isinstance(raw_details, str):
-                    try: raw_details = json.loads(raw_details.replace("'", '"'))
-                    except: raw_details = {}
-                if isinstance(raw_details, dict):
-                    for k, v in raw_details.items():
-                        details_map[str(k).strip().lower()] = v
-
-            # Расчет баллов
-            for subj in db_subjects:
-                score_sum = 0
-                has_score = False
-                subj_id = str(subj.id)
-                subj_slug = getattr(subj, 'slug', '').lower()
-                target_prefixes = []
-                
-                if subj_id == '1': target_prefixes = ['math']
-                elif subj_id == '6': target_prefixes = ['eng']
-                elif subj_id == '3': target_prefixes = ['рус.яз']
-                elif subj_id == '2': target_prefixes = ['заб.точ']
-                elif subj_id == '4': target_prefixes = ['табиат', 'tabiat']
-                else:
-                    if 'mat' in subj_slug: target_prefixes = ['math']
-                    elif 'eng' in subj_slug: target_prefixes = ['eng']
-                    elif 'rus' in subj_slug: target_prefixes = ['рус.яз']
-                    elif 'taj' in subj_slug or 'zab' in subj_slug: target_prefixes = ['заб.точ']
-                    elif 'tab' in subj_slug or 'sci' in subj_slug: target_prefixes = ['табиат']
-                    else: target_prefixes = [subj_slug]
-
-                for key, val in details_map.items():
-                    for prefix in target_prefixes:
-                        if key.startswith(prefix + '_') or key.startswith(prefix + ' '):
-                            try:
-                                score_sum += int(val)
-                                has_score = True
-                            except: pass
-                
-                badges.append({
-                    "slug": getattr(subj, 'slug', 'def'),
-                    "name": (getattr(subj, 'abbreviation', '') or subj.name)[:3].upper(), 
-                    "score": score_sum if has_score else "-",
-                    "color": getattr(subj, 'color', 'indigo')
-                })
+            result_scores = subject_scores.get(res.id, {})
+
+            badges = [
+                {
+                    "slug": subj['slug'] or 'def',
+                    "name": (subj['abbreviation'] or subj['name'])[:3].upper(),
+                    "score": result_scores.get(subj['id'], "-"),
+                    "color": subj['color'] or 'indigo'
+                }
+                for subj in sorted(exam_subjects.get(res.exam_id, ()), key=lambda x: x['name'])
+            ]
 
             # 🔥 ПЕРЕВОД ИМЕН (ИСПРАВЛЕНО) 🔥
             base_first = getattr(student, 'first_name', '')
@@ -220,13 +271,14 @@ class MonitoringRatingView(APIView):
                 "availableSubjects": smart_subjects,
                 "schoolClasses": school_classes_info,
                 "pagination": {
-                    "page": page, "limit": limit, "total": total_count, "has_next": (offset + limit) < total_count
+                    "page": page, "limit": limit, "total": total_count, "has_next": has_next,
+                    "next_cursor": next_cursor
                 }
             },
             "leader": leader_info,
             "stats": {
                 "participants": total_count,
-                "avgScore": round(final_queryset.aggregate(Avg('score'))['score__avg'] or 0)
+                "avgScore": round(totals['avg'] or 0)
             },
             "data": students_data
         })
\ No newline at end of file
@@ -7,7 +7,6 @@ from django.db.models import Count, Max, Q, F
 from django.db import transaction
 from django.shortcuts import get_object_or_404
 from rest_framework import serializers
-import random
 import logging
 import difflib
 
@@ -18,6 +17,9 @@ from ..models import (
     SchoolYear
 )
 
+from ..services.variant_generator import VariantGenerator
+from ..tasks import booklet_prerender_task
+
 # --- ИМПОРТЫ СЕРИАЛИЗАТОРОВ ---
 from ..serializers import (
     ExamRoundSerializer, 
@@ -94,16 +96,18 @@ class ExamRoundViewSet(viewsets.ModelViewSet):
             "total_templates": limits.count()
         })
     
-    # --- 2. ГЕНЕРАТОР ВАРИАНТОВ A/B (CORE LOGIC) ---
+    # --- 2. ГЕНЕРАТОР ВАРИАНТОВ A/B/C/D (CORE LOGIC) ---
     @action(detail=True, methods=['post'])
     def generate_variants(self, request, pk=None):
         """
-        🔥 MAIN GENERATOR: Создает Варианты А и Б для школ.
+        🔥 MAIN GENERATOR: Создает Варианты (А — мастер, Б, В, Г — перемешанные) для школ.
+        Перемешивание детерминировано: повторный запуск для школы дает те же буклеты.
         
         Input:
             - day: "1" or "2" (Обязательно)
             - school_ids: [1, 2, 5] (Опционально. Если нет - для всех)
             - grade: 5 (Опционально. Если нет - для всех параллелей)
+            - variants: 2 (Опционально. Сколько вариантов, от 1 до 4)
         """
         round_obj = self.get_object()
         
@@ -115,164 +119,49 @@ class ExamRoundViewSet(viewsets.ModelViewSet):
         if not day:
              return Response({"error": "Не указан день (Day 1 или Day 2)"}, status=400)
 
+        max_variants = len(Exam.VARIANT_CHOICES)
+        try:
+            variants = int(request.data.get('variants', 2))
+        except (TypeError, ValueError):
+            variants = 0
+        if not 1 <= variants <= max_variants:
+            return Response({"error": f"Количество вариантов: от 1 до {max_variants}"}, status=400)
+
         # 1. Определяем список школ
         if school_ids:
-            schools = School.objects.filter(id__in=school_ids)
+            schools = list(School.objects.filter(id__in=school_ids))
         else:
-            schools = School.objects.all() # Если пусто, берем ВСЕ школы
-
-        # 2. Находим утвержденные секции (Master Copies)
-        # Ищем секции, которые 'approved' и соответствуют нужному дню
-        # ВАЖНО: В модели BookletSection должно быть поле 'day' или логика разделения предметов по дням.
-        # Если поля нет, считаем, что все утвержденные подходят.
-        sections_qs = BookletSection.objects.filter(
-            round=round_obj,
-            status='approved'
-        )
-        
-        # Если у Секции есть поле day, фильтруем. Если нет - игнорируем.
-        if hasattr(BookletSection, 'day'):
-            sections_qs = sections_qs.filter(day=day)
+            schools = list(School.objects.all()) # Если пусто, берем ВСЕ школы
 
-        if grade_param:
-            sections_qs = sections_qs.filter(grade_level=grade_param)
+        # 2. Загружаем утвержденные секции дня (Master Copies) одним проходом
+        generator = VariantGenerator(round_obj, day=day, grade=grade_param, variants=variants)
 
-        if not sections_qs.exists():
+        if not generator.grades:
             return Response({"error": f"Нет утвержденных секций для генерации (День {day})"}, status=400)
 
-        # 3. Группируем секции по Параллелям (5, 6, 7...)
-        # { 5: [MathSec, EngSec], 6: [BioSec, ChemSec] }
-        sections_by_grade = {}
-        for sec in sections_qs:
-            g = sec.grade_level
-            if g not in sections_by_grade:
-                sections_by_grade[g] = []
-            sections_by_grade[g].append(sec)
-
-        generated_log = []
-        
+        # 3. Все буклеты строятся в памяти и пишутся пачкой
         try:
-            with transaction.atomic():
-                # Проходим по каждой школе
-                for school in schools:
-                    # Проходим по каждой параллели (5, 6, 7 класс...)
-                    for grade_level, grade_sections in sections_by_grade.items():
-                        
-                        # Сортируем секции, чтобы порядок предметов был фиксирован (Мат, Англ, Ист...)
-                        sorted_sections = sorted(grade_sections, key=lambda s: s.subject.id)
-
-                        # --- ГЕНЕРАЦИЯ ВАРИАНТА A ---
-                        self._create_exam_variant(
-                            school=school, 
-                            round_obj=round_obj, 
-                            grade=grade_level, 
-                            day=day, 
-                            sections=sorted_sections, 
-                            variant='A'
-                        )
-                        
-                        # --- ГЕНЕРАЦИЯ ВАРИАНТА B ---
-                        self._create_exam_variant(
-                            school=school, 
-                            round_obj=round_obj, 
-                            grade=grade_level, 
-                            day=day, 
-                            sections=sorted_sections, 
-                            variant='B'
-                        )
-                        
-                        generated_log.append(f"School {school.name}: Grade {grade_level} OK")
-
+            done = generator.generate(schools)
         except Exception as e:
             logger.error(f"Generation Error: {e}")
             return Response({"error": f"Ошибка генерации: {str(e)}"}, status=500)
 
+        generated_log = [f"School {school.name}: Grade {grade_level} OK" for school, grade_level in done]
+
+        # 4. PDF буклетов рендерятся в фоне, чтобы к утру экзамена все уже лежали в хранилище.
+        # Недоступный брокер не отменяет генерацию: PDF отрендерится при первом скачивании
+        render_task_id = None
+        try:
+            render_task_id = booklet_prerender_task.delay(generator.exam_ids).id
+        except Exception as e:
+            logger.error(f"Booklet prerender queue error: {e}")
+
         return Response({
             "message": f"Генерация завершена! Обработано школ: {len(schools)}",
-            "details": generated_log
+            "details": generated_log,
+            "render_task_id": render_task_id
         })
 
-    def _create_exam_variant(self, school, round_obj, grade, day, sections, variant):
-        """
-        Внутренний метод создания одного физического экзамена (буклета).
-        Теперь с поддержкой перемешивания ОТВЕТОВ (Full Shuffle).
-        """
-        # 1. Собираем список вопросов из всех секций
-        questions_list = []
-        subjects_list = []
-        
-        for sec in sections:
-            subjects_list.append(sec.subject)
-            # Берем вопросы строго по порядку эксперта
-            q_qs = sec.section_questions.select_related('question').order_by('order')
-            for sq in q_qs:
-                questions_list.append(sq.question)
-        
-        # 2. Перемешивание ВОПРОСОВ (Если Вариант Б)
-        final_questions = list(questions_list)
-        if variant == 'B':
-            random.shuffle(final_questions)
-        
-        # 3. ГЕНЕРАЦИЯ "УМНОЙ КАРТЫ" (JSON MAPPING)
-        # Здесь мы "запекаем" правильные ответы для этого варианта
-        question_order_map = {}
-        
-        for idx, question in enumerate(final_questions):
-            q_num = str(idx + 1)
-            
-            # Получаем варианты ответов
-            choices = list(question.choices.all())
-            
-            # Если Вариант Б — перемешиваем и ВАРИАНТЫ ОТВЕТОВ тоже!
-            if variant == 'B':
-                random.shuffle(choices)
-            # Если Вариант А — оставляем оригинальный порядок (как создал учитель/эксперт)
-            # или сортируем по ID, чтобы было предсказуемо
-            else:
-                choices.sort(key=lambda x: x.id)
-
-            # Находим, какая буква теперь правильная (A, B, C, D)
-            correct_letter = "?"
-            choice_ids_order = []
-            
-            letters = ['A', 'B', 'C', 'D', 'E', 'F']
-            
-            for i, choice in enumerate(choices):
-                choice_ids_order.append(choice.id) # Сохраняем порядок ID для PDF генератора
-                if choice.is_correct:
-                    correct_letter = letters[i] if i < len(letters) else "?"
-            
-            # 🔥 СОХРАНЯЕМ ВСЮ ИНФУ В JSON
-            question_order_map[q_num] = {
-                "id": question.id,
-                "key": correct_letter,     # <-- ГЛАВНОЕ: Правильный ответ для этого буклета (напр. "C")
-                "choices": choice_ids_order # <-- Нужно для PDF, чтобы напечатать в том же порядке
-            }
-            
-        # 4. СОЗДАЕМ/ОБНОВЛЯЕМ ЭКЗАМЕН В БД
-        title = f"{round_obj.name} - {grade} Кл - День {day} - Вар {variant}"
-        
-        exam, created = Exam.objects.update_or_create(
-            school=school,
-            gat_round=round_obj.number if hasattr(round_obj, 'number') else 1,
-            gat_day=day,
-            grade_level=grade,
-            variant=variant,
-            defaults={
-                'title': title,
-                'status': 'planned',
-                'question_order': question_order_map, # 🔥 Теперь здесь лежит "Умная карта"
-                'duration': 180
-            }
-        )
-        
-        # 5. ПРИВЯЗЫВАЕМ ДАННЫЕ (M2M)
-        # Это нужно для совместимости с админкой и списками
-        exam.questions.set(final_questions)
-        exam.subjects.set(subjects_list)
-        
-        return exam
-
 # ==============================================================================
 # 📝 2. BOOKLET SECTION VIEWSET (РАБОЧЕЕ МЕСТО ЭКСПЕРТА)
 # ==============================================================================
@@ -545,7 +434,7 @@ class ExamPreviewViewSet(viewsets.ReadOnlyModelViewSet):
         для генерации PDF или предпросмотра.
         """
         try:
-            exam_with_questions = Exam.objects.prefetch_related(
+            exam_with_questions = Exam.objects.select_related('booklet').prefetch_related(
                 'questions', 
                 'questions__choices',
                 'subjects'
@@ -556,7 +445,7 @@ class ExamPreviewViewSet(viewsets.ReadOnlyModelViewSet):
             
             data = serializer.data
             # Передаем маппинг порядка, чтобы фронт мог отрисовать реальный порядок Варианта Б
-            data['question_order_map'] = exam_with_questions.question_order
+            data['question_order_map'] = exam_with_questions.order_map
             
             return Response(data)
         except Exam.DoesNotExist:
@@ -7,27 +7,18 @@ from django.db.models import Q
 from django.http import HttpResponse
 from django.db import transaction
 from django.contrib.auth.models import User
+from django.core.files.storage import default_storage
+from celery.result import AsyncResult
 
-import random
-import qrcode
-import secrets
 import openpyxl
 import re
-import io
-import os
-
-# Библиотеки для PDF
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import A4
-from reportlab.lib import colors
-from reportlab.lib.utils import ImageReader
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.lib.units import mm
 
 # 🔥 ДОБАВИЛ ИМПОРТ UserProfile
 from ..models import Student, StudentClass, School, UserProfile
 from ..serializers import StudentSerializer
+from ..services.provisioning_service import ProvisioningService, generate_password
+from ..services.student_cards import render_access_cards, cards_path
+from ..tasks import student_credentials_task
 
 class StudentViewSet(viewsets.ModelViewSet):
     serializer_class = StudentSerializer
@@ -113,13 +104,11 @@ class StudentViewSet(viewsets.ModelViewSet):
 
         # 3. Генерация логина (если нет)
         if not data.get('username') and data.get('last_name_ru'):
-            base_login = self._transliterate(data['last_name_ru'])
-            suffix = data.get('custom_id')[-4:] if data.get('custom_id') else str(random.randint(100, 999))
-            data['username'] = f"{base_login}{suffix}"
+            data['username'] = ProvisioningService.new_username(data['last_name_ru'], data.get('first_name_ru', ''))
 
         # 4. Пароль
         if not data.get('password'):
-            data['password'] = self._generate_strong_password()
+            data['password'] = generate_password()
 
         serializer = self.get_serializer(data=data)
         serializer.is_valid(raise_exception=True)
@@ -166,66 +155,28 @@ class StudentViewSet(viewsets.ModelViewSet):
             print(f"Error generating ID: {e}")
             return None
 
-    def _transliterate(self, text):
-        if not text: return ""
-        mapping = {
-            'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'yo', 'ж': 'zh', 'з': 'z',
-            'и': 'i', 'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r',
-            'с': 's', 'т': 't', 'у': 'u', 'ф': 'f', 'х': 'kh', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'shch',
-            'ъ': '', 'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya', 'ғ': 'gh', 'қ': 'q', 'ҳ': 'h',
-            'ҷ': 'j', 'ӣ': 'i', 'ӯ': 'u'
-        }
-        return "".join([mapping.get(char, char) for char in text.lower()])
-
-    def _generate_strong_password(self, length=8):
-        chars = "abcdefghijkmnpqrstuvwxyzABCDEFGHJKLMNPQRSTUVWXYZ23456789"
-        while True:
-            password = ''.join(secrets.choice(chars) for _ in range(length))
-            if (any(c.isdigit() for c in password) and any(c.isalpha() for c in password)):
-                return password
-
     # --- ДЕЙСТВИЯ (ACTIONS) ---
 
     @action(detail=False, methods=['post'], url_path='bulk-generate-credentials')
     def bulk_generate_credentials(self, request):
         """
         Генерирует новые пароли, активирует и СТАВИТ РОЛЬ STUDENT.
+        {"async": true} — в фоне (Celery), ответ 202 с task_id.
         """
         ids = request.data.get('ids', [])
         if not ids:
             return Response({"error": "No students selected"}, status=400)
 
         students = self.get_queryset().filter(id__in=ids)
-        updated_count = 0
 
-        with transaction.atomic():
-            for student in students:
-                # 1. Генерируем логин
-                if not student.username or len(student.username) < 3:
-                     if student.last_name_ru and student.first_name_ru:
-                        base = self._transliterate(student.last_name_ru).capitalize()
-                        initial = self._transliterate(student.first_name_ru[0]).upper()
-                        suffix = str(random.randint(100, 999))
-                        student.username = f"{base}{initial}{suffix}"
-                        student.save()
+        # Большие пачки — в фон: сразу отдаем task_id, статус -> /tasks/<task_id>/
+        if request.data.get('async'):
+            task = student_credentials_task.delay(list(students.values_list('id', flat=True)))
+            return Response({"task_id": task.id, "status": "processing"}, status=status.HTTP_202_ACCEPTED)
 
-                # 2. Пароль
-                raw_password = self._generate_strong_password()
-                
-                # 3. User + Профиль
-                if student.username:
-                    user, created = User.objects.get_or_create(username=student.username)
-                    user.set_password(raw_password)
-                    user.is_active = True
-                    user.save()
-                    
-                    # 🔥 ВАЖНОЕ ИСПРАВЛЕНИЕ: ПРИНУДИТЕЛЬНО СТАВИМ РОЛЬ "STUDENT"
-                    profile, _ = UserProfile.objects.get_or_create(user=user)
-                    profile.role = 'student'
-                    profile.school = student.school # Привязываем к школе
-                    profile.save()
-                    
-                    updated_count += 1
+        # Логины, пароли (хэши параллельно), User + Профиль с ролью STUDENT — пачкой
+        passwords = ProvisioningService.reset_credentials(students)
+        updated_count = len(passwords)
 
         return Response({"message": f"Generated credentials and fixed roles for {updated_count} students"})
 
@@ -320,174 +271,45 @@ class StudentViewSet(viewsets.ModelViewSet):
         else:
             students = self.filter_queryset(self.get_queryset())
 
+        # async=1 — PDF рисуется в фоне; статус — /tasks/<task_id>/, файл — export-pdf-cards/<task_id>/
+        if request.query_params.get('async'):
+            task = student_credentials_task.delay(
+                list(students.values_list('id', flat=True)), cards=True, user_id=request.user.id
+            )
+            return Response({"task_id": task.id, "status": "processing"}, status=status.HTTP_202_ACCEPTED)
+
         response = HttpResponse(content_type='application/pdf')
         response['Content-Disposition'] = 'attachment; filename="student_access_cards.pdf"'
 
-        c = canvas.Canvas(response, pagesize=A4)
-        page_width, page_height = A4
-
-        # Шрифты (как в прошлом коде)
-        font_name = "Helvetica"
-        font_bold = "Helvetica-Bold"
-        possible_font_paths = [
-            os.path.join(os.path.dirname(__file__), 'fonts', 'arial.ttf'),
-            "C:\\Windows\\Fonts\\arial.ttf",
-            "/usr/share/fonts/truetype/msttcorefonts/Arial.ttf",
-        ]
-        possible_bold_paths = [
-            os.path.join(os.path.dirname(__file__), 'fonts', 'arialbd.ttf'),
-            "C:\\Windows\\Fonts\\arialbd.ttf",
-        ]
-
-        found_font = None
-        for path in possible_font_paths:
-            if os.path.exists(path):
-                found_font = path
-                break
-        
-        found_bold = None
-        for path in possible_bold_paths:
-             if os.path.exists(path):
-                found_bold = path
-                break
+        # Новые пароли — пачкой (хэши параллельно); ученики без логина получают "Error: No Login"
+        students = list(students)
+        passwords = ProvisioningService.reset_credentials([s for s in students if s.username])
 
-        try:
-            if found_font:
-                pdfmetrics.registerFont(TTFont('CustomFont', found_font))
-                font_name = 'CustomFont'
-                if found_bold:
-                    pdfmetrics.registerFont(TTFont('CustomFont-Bold', found_bold))
-                    font_bold = 'CustomFont-Bold'
-                else:
-                    font_bold = 'CustomFont'
-        except Exception as e:
-            print(f"Font error: {e}")
+        render_access_cards(students, passwords, response)
+        return response
 
-        card_width = 90 * mm
-        card_height = 53 * mm
-        col_gap = 10 * mm
-        row_gap = 4 * mm
-        
-        total_content_width = (2 * card_width) + col_gap
-        total_content_height = (5 * card_height) + (4 * row_gap)
-        
-        margin_x = (page_width - total_content_width) / 2
-        margin_y = (page_height - total_content_height) / 2
-        
-        x_start = margin_x
-        y_start_top = page_height - margin_y - card_height
-        
-        col = 0
-        row = 0
-        
-        primary_color = colors.HexColor("#4F46E5")
-        secondary_color = colors.HexColor("#EEF2FF")
-        text_dark = colors.HexColor("#111827")
-        text_gray = colors.HexColor("#6B7280")
+    @action(detail=False, methods=['get'], url_path=r'export-pdf-cards/(?P<task_id>[\w-]+)')
+    def download_pdf_cards(self, request, task_id=None):
+        """
+        Скачивание PDF, нарисованного в фоне (export-pdf-cards?async=1).
+        Только тот, кто запускал задачу, и только один раз: после отдачи файл удаляется.
+        """
+        task_result = AsyncResult(task_id)
+        if task_result.state != 'SUCCESS':
+            return Response({"state": task_result.state, "error": "PDF еще не готов"}, status=status.HTTP_409_CONFLICT)
 
-        with transaction.atomic():
-            for student in students:
-                new_password_for_card = self._generate_strong_password()
-                
-                if student.username:
-                    user, _ = User.objects.get_or_create(username=student.username)
-                    user.set_password(new_password_for_card)
-                    user.is_active = True
-                    user.save()
-                    
-                    # 🔥 ИСПРАВЛЕНИЕ РОЛИ ПРИ ПЕЧАТИ
-                    profile, _ = UserProfile.objects.get_or_create(user=user)
-                    profile.role = 'student'
-                    profile.school = student.school
-                    profile.save()
-                else:
-                    new_password_for_card = "Error: No Login"
-
-                # Рисование карточки (без изменений)
-                x = x_start + (col * (card_width + col_gap))
-                y = y_start_top - (row * (card_height + row_gap))
-
-                c.setFillColor(colors.HexColor("#E5E7EB"))
-                c.roundRect(x + 1 * mm, y - 1 * mm, card_width, card_height, 3 * mm, fill=1, stroke=0)
-                c.setFillColor(colors.white)
-                c.roundRect(x, y, card_width, card_height, 3 * mm, fill=1, stroke=0)
-
-                sidebar_width = 25 * mm
-                c.setFillColor(primary_color)
-                p = c.beginPath()
-                p.moveTo(x + sidebar_width, y)
-                p.lineTo(x + 3 * mm, y)
-                p.arcTo(x, y, x, y + 3 * mm, 3 * mm)
-                p.lineTo(x, y + card_height - 3 * mm)
-                p.arcTo(x, y + card_height, x + 3 * mm, y + card_height, 3 * mm)
-                p.lineTo(x + sidebar_width, y + card_height)
-                p.lineTo(x + sidebar_width, y)
-                c.drawPath(p, fill=1, stroke=0)
-
-                qr = qrcode.QRCode(box_size=10, border=0)
-                qr.add_data("https://www.edutest.tj")
-                qr.make(fit=True)
-                img = qr.make_image(fill_color="white", back_color="#4F46E5")
-                img_buffer = io.BytesIO()
-                img.save(img_buffer, format="PNG")
-                img_buffer.seek(0)
-                c.drawImage(ImageReader(img_buffer), x + 2.5 * mm, y + 15 * mm, width=20 * mm, height=20 * mm, mask='auto')
-
-                c.setFillColor(colors.white)
-                c.setFont(font_bold, 6)
-                c.drawCentredString(x + 12.5 * mm, y + 11 * mm, "SCAN ME")
-                
-                content_x = x + sidebar_width + 5 * mm
-                
-                if student.school.logo:
-                    try:
-                        logo_path = student.school.logo.path
-                        if os.path.exists(logo_path):
-                            c.drawImage(logo_path, x + card_width - 12 * mm, y + card_height - 12 * mm, width=8 * mm, height=8 * mm, mask='auto')
-                    except: pass
-
-                c.setFillColor(text_gray)
-                c.setFont(font_name, 7)
-                school_name = student.school.name
-                c.drawString(content_x, y + card_height - 10 * mm, school_name[:35].upper())
-
-                c.setFillColor(text_dark)
-                c.setFont(font_bold, 12)
-                lname = student.last_name_ru or ""
-                fname = student.first_name_ru or ""
-                full_name = f"{lname} {fname}"
-                c.drawString(content_x, y + card_height - 18 * mm, full_name[:22])
-
-                c.setFillColor(primary_color)
-                c.setFont(font_bold, 9)
-                class_txt = str(student.student_class) if student.student_class else "-"
-                c.drawString(content_x, y + card_height - 23 * mm, f"Класс: {class_txt}")
-
-                box_y = y + 10 * mm
-                box_height = 14 * mm
-                box_width = card_width - sidebar_width - 10 * mm
-                
-                c.setFillColor(secondary_color)
-                c.roundRect(content_x, box_y, box_width, box_height, 2 * mm, fill=1, stroke=0)
-                
-                c.setFillColor(text_gray)
-                c.setFont(font_name, 6)
-                c.drawString(content_x + 3 * mm, box_y + 9 * mm, "LOGIN")
-                c.drawString(content_x + 3 * mm, box_y + 3 * mm, "PASSWORD")
-                
-                c.setFillColor(text_dark)
-                c.setFont(font_bold, 10)
-                c.drawString(content_x + 20 * mm, box_y + 9 * mm, student.username or "-")
-                c.drawString(content_x + 20 * mm, box_y + 3 * mm, new_password_for_card)
-
-                col += 1
-                if col >= 2:
-                    col = 0
-                    row += 1
-                if row >= 5:
-                    c.showPage()
-                    col = 0
-                    row = 0
-
-        c.save()
-        return response
\ No newline at end of file
+        info = task_result.result or {}
+        if info.get('user_id') != request.user.id:
+            raise PermissionDenied("Этот PDF запрашивал другой пользователь")
+
+        path = cards_path(task_id)
+        if not default_storage.exists(path):
+            return Response({"error": "PDF уже скачан или истек срок хранения"}, status=status.HTTP_410_GONE)
+
+        with default_storage.open(path, 'rb') as f:
+            content = f.read()
+        default_storage.delete(path)
+
+        response = HttpResponse(content, content_type='application/pdf')
+        response['Content-Disposition'] = 'attachment; filename="student_access_cards.pdf"'
+        return response
@@ -11,6 +11,7 @@ from ..models import Exam, ExamResult, Student
 # Убедитесь, что ExamPlaySerializer добавлен в serializers.py (код был выше)
 from ..serializers import ExamPlaySerializer  
 from ..services.pdf_generator import PDFGenerator
+from ..services.result_facts import ResultFactsService
 
 class StudentExamViewSet(viewsets.ReadOnlyModelViewSet):
     """
@@ -94,7 +95,7 @@ class StudentExamViewSet(viewsets.ReadOnlyModelViewSet):
 
         # 4. Сохранение
         with transaction.atomic():
-            ExamResult.objects.create(
+            result = ExamResult.objects.create(
                 student=student,
                 exam=exam,
                 score=score,
@@ -102,6 +103,7 @@ class StudentExamViewSet(viewsets.ReadOnlyModelViewSet):
                 percentage=percentage,
                 details=details
             )
+            ResultFactsService.rebuild([result])
 
         return Response({
             "message": "Экзамен успешно сдан",
@@ -3,11 +3,15 @@ from rest_framework.response import Response
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.permissions import IsAuthenticated
 from rest_framework import status
+from django.core.files.storage import default_storage
+from celery.result import AsyncResult, GroupResult
 import logging
+import uuid
 
 # Импортируем сервисы
 from ..services.import_service import ImportService 
 from ..services.grader_service import GraderService 
+from ..tasks import grader_process_scan_task, import_results_task
 
 logger = logging.getLogger(__name__)
 
@@ -18,9 +22,12 @@ class FileUploadView(APIView):
     
     Поддерживаемые режимы (mode):
     1. 'smart'   -> 🚀 НОВЫЙ: Умный массовый импорт (Школа + Класс + Раунд + День)
+    1.1 'smart_async' -> То же в фоне (Celery): сразу возвращает task_id, прогресс -> TaskStatusView
     2. 'scan'    -> Обработка фото бланка/OMR (GraderService)
-    3. 'scores'  -> (Legacy) Старый импорт баллов в конкретный экзамен
-    4. 'answers' -> (Legacy) Старый импорт ответов в конкретный экзамен
+    3. 'scan_batch' -> Пачка бланков: ZIP с фото или многостраничный PDF (GraderService)
+    3.1 'scan_async' -> То же в фоне (Celery): сразу возвращает task_id, прогресс -> GraderTaskStatusView
+    4. 'scores'  -> (Legacy) Старый импорт баллов в конкретный экзамен
+    5. 'answers' -> (Legacy) Старый импорт ответов в конкретный экзамен
     """
     parser_classes = (MultiPartParser, FormParser)
     permission_classes = [IsAuthenticated]
@@ -58,7 +65,7 @@ class FileUploadView(APIView):
             # ==========================================
             # 🚀 ВАРИАНТ 1: SMART IMPORT (Умный робот)
             # ==========================================
-            if mode == 'smart':
+            if mode in ['smart', 'smart_async']:
                 print(f"🧠 [UploadView] Запуск Smart Import...")
                 
                 # Проверка обязательных полей
@@ -74,9 +81,17 @@ class FileUploadView(APIView):
                         status=status.HTTP_400_BAD_REQUEST
                     )
 
+                # Большие файлы — в фон: файл в media-хранилище, воркер читает его чанками
+                if mode == 'smart_async':
+                    file_path = default_storage.save(f"import_uploads/{uuid.uuid4().hex}_{file_obj.name}", file_obj)
+                    task = import_results_task.delay(file_path, int(school_id), int(round_id), int(grade), int(day))
+                    print(f"⏳ [UploadView] Импорт поставлен в очередь: task={task.id}")
+
+                    return Response({"task_id": task.id, "status": "processing"}, status=status.HTTP_202_ACCEPTED)
+
                 # Вызов сервиса (с преобразованием типов в int)
-                result = ImportService.process_smart_import(
-                    file=file_obj,
+                result = ImportService.process_file(
+                    file_obj,
                     school_id=int(school_id),
                     grade_level=int(grade),
                     round_id=int(round_id),
@@ -102,6 +117,29 @@ class FileUploadView(APIView):
                 
                 return Response(result, status=status.HTTP_200_OK)
 
+            # ==========================================
+            # 📦 ВАРИАНТ 2.1: ПАКЕТНОЕ СКАНИРОВАНИЕ
+            # ==========================================
+            elif mode == 'scan_batch':
+                print("📦 [UploadView] Пакетная проверка бланков...")
+                result = GraderService.process_batch(file_obj)
+
+                if result.get('status') == 'error':
+                    return Response(result, status=status.HTTP_400_BAD_REQUEST)
+
+                return Response(result, status=status.HTTP_200_OK)
+
+            # ==========================================
+            # ⏳ ВАРИАНТ 2.2: ФОНОВОЕ СКАНИРОВАНИЕ (Celery)
+            # ==========================================
+            elif mode == 'scan_async':
+                # Сохраняем файл в media-хранилище: воркеры на других нодах читают его оттуда
+                file_path = default_storage.save(f"grader_uploads/{uuid.uuid4().hex}_{file_obj.name}", file_obj)
+                task = grader_process_scan_task.delay(file_path)
+                print(f"⏳ [UploadView] Пачка поставлена в очередь: task={task.id}")
+
+                return Response({"task_id": task.id, "status": "processing"}, status=status.HTTP_202_ACCEPTED)
+
             # ==========================================
             # 📊 ВАРИАНТ 3: ОБЫЧНЫЙ ИМПОРТ (Legacy)
             # ==========================================
@@ -134,4 +172,49 @@ class FileUploadView(APIView):
             return Response(
                 {"status": "error", "message": f"Внутренняя ошибка сервера: {str(e)}"}, 
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
\ No newline at end of file
+            )
+
+
+class GraderTaskStatusView(APIView):
+    """
+    Прогресс фоновой проверки бланков (mode='scan_async').
+    Собирает состояние группы чанков из django-db: сколько бланков проверено и их результаты.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, task_id):
+        task_result = AsyncResult(task_id)
+
+        if task_result.state in ('PENDING', 'STARTED'):
+            return Response({"state": task_result.state, "status": "Подготовка пачки..."}, status=status.HTTP_200_OK)
+        if task_result.state == 'FAILURE':
+            return Response({"state": "FAILURE", "error": str(task_result.result)}, status=status.HTTP_200_OK)
+
+        info = task_result.result or {}
+        group_result = GroupResult.restore(info.get('group_id'))
+        if group_result is None:
+            return Response({"state": "FAILURE", "error": "Группа задач не найдена"}, status=status.HTTP_200_OK)
+
+        sheets, errors, in_progress = [], [], 0
+        for chunk in group_result.results:
+            if chunk.state == 'SUCCESS':
+                sheets.extend(chunk.result)
+            elif chunk.state == 'PROGRESS':
+                in_progress += (chunk.info or {}).get('done', 0)
+            elif chunk.state == 'FAILURE':
+                errors.append(str(chunk.result))
+
+        total = info.get('total', 0)
+        processed = len(sheets) + in_progress
+        graded = sum(1 for sheet in sheets if sheet['status'] == 'success')
+
+        return Response({
+            "state": "SUCCESS" if group_result.ready() else "PROGRESS",
+            "total": total,
+            "processed": processed,
+            "percent": round(processed / total * 100, 1) if total else 100,
+            "graded": graded,
+            "failed": len(sheets) - graded,
+            "errors": errors,
+            "sheets": sheets
+        }, status=status.HTTP_200_OK)
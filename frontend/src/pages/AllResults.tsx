@@ -29,6 +29,27 @@ interface ResultItem {
 	day?: number;
 }
 
+interface ResultsPage {
+	page: number;
+	limit: number;
+	has_next: boolean;
+	results: ResultItem[];
+	// Итоги всей выборки (только на первой странице)
+	total?: number;
+	avg?: number | null;
+	max?: number | null;
+}
+
+interface ResultTotals {
+	total: number;
+	avg: number | null;
+	max: number | null;
+}
+
+// Поля, которые показывает таблица, и размер страницы monitoring/results/
+const RESULT_FIELDS = 'id,student_name,class_name,school_name,score,max_score,percentage,details,day';
+const PAGE_SIZE = 100;
+
 // --- КОМПОНЕНТ 1: ЛЕПЕСТКОВАЯ ДИАГРАММА (RADAR CHART) ---
 const StudentRadarChart = ({ details }: { details: Record<string, number> }) => {
 	const data = useMemo(() => {
@@ -219,6 +240,10 @@ const GlobalMonitoring: React.FC = () => {
 	const [subjects, setSubjects] = useState<string[]>([]);
 	const [searchTerm, setSearchTerm] = useState('');
 	const [expandedId, setExpandedId] = useState<number | null>(null);
+	const [page, setPage] = useState(1);
+	const [hasNext, setHasNext] = useState(false);
+	const [loadingMore, setLoadingMore] = useState(false);
+	const [totals, setTotals] = useState<ResultTotals | null>(null);
 
 	// --- EFFECTS ---
 	useEffect(() => {
@@ -231,30 +256,44 @@ const GlobalMonitoring: React.FC = () => {
 		fetchSchools();
 	}, []);
 
-	const fetchResults = async () => {
+	const buildParams = () => {
+		const params = new URLSearchParams();
+		if (selectedSchools.length) params.append('schools', selectedSchools.join(','));
+		if (selectedQuarter) params.append('quarter', selectedQuarter);
+		if (selectedGat) params.append('gat', selectedGat);
+		if (selectedGrade) params.append('grade', selectedGrade);
+		if (selectedDay) params.append('day', selectedDay);
+		if (searchTerm.trim()) params.append('search', searchTerm.trim());
+		return params;
+	};
+
+	// Страница JSON (сервер уже сортирует по баллам); следующая страница дописывается к таблице
+	const fetchResults = async (nextPage = 1) => {
 		if (selectedSchools.length === 0 && !selectedGrade && !selectedGat) return;
 
-		setLoading(true);
-		setResults([]);
-		setExpandedId(null);
+		const isFirstPage = nextPage === 1;
+		if (isFirstPage) {
+			setLoading(true);
+			setResults([]);
+			setTotals(null);
+			setExpandedId(null);
+		} else {
+			setLoadingMore(true);
+		}
 
 		try {
-			const params = new URLSearchParams();
-			if (selectedSchools.length) params.append('schools', selectedSchools.join(','));
-			if (selectedQuarter) params.append('quarter', selectedQuarter);
-			if (selectedGat) params.append('gat', selectedGat);
-			if (selectedGrade) params.append('grade', selectedGrade);
-			if (selectedDay) params.append('day', selectedDay);
+			const params = buildParams();
+			params.append('fields', RESULT_FIELDS);
+			params.append('page', String(nextPage));
+			params.append('limit', String(PAGE_SIZE));
+			const response = await $api.get<ResultsPage>(`monitoring/results/?${params.toString()}`);
+			const data = response.data.results;
 
-			const response = await $api.get(`monitoring/results/?${params.toString()}`);
-			const data = response.data;
-
-			// Сортировка по баллам
-			data.sort((a: ResultItem, b: ResultItem) => b.score - a.score);
+			const merged = isFirstPage ? data : [...results, ...data];
 
 			// Определение предметов
 			const allSubjects = new Set<string>();
-			data.forEach((item: ResultItem) => {
+			merged.forEach((item: ResultItem) => {
 				if (item.details) {
 					Object.keys(item.details).forEach(key => {
 						const parts = key.split('_');
@@ -263,29 +302,50 @@ const GlobalMonitoring: React.FC = () => {
 				}
 			});
 			setSubjects(Array.from(allSubjects).sort());
-			setResults(data);
+			setResults(merged);
+			setPage(nextPage);
+			setHasNext(response.data.has_next);
+			if (isFirstPage) {
+				const { total = 0, avg = null, max = null } = response.data;
+				setTotals({ total, avg, max });
+			}
 		} catch (error) {
 			console.error(error);
 		} finally {
 			setLoading(false);
+			setLoadingMore(false);
 		}
 	};
 
-	// --- COMPUTED ---
-	const filteredResults = useMemo(() => {
-		const lowerSearch = searchTerm.toLowerCase();
-		return results.filter(r =>
-			r.student_name.toLowerCase().includes(lowerSearch) ||
-			r.school_name.toLowerCase().includes(lowerSearch)
-		);
-	}, [results, searchTerm]);
+	// Вся выборка файлом CSV (сервер отдает ее потоком, страницы не нужны)
+	const downloadCsv = async () => {
+		try {
+			const params = buildParams();
+			params.append('export', 'csv');
+			const response = await $api.get(`monitoring/results/?${params.toString()}`, { responseType: 'blob' });
+			const url = window.URL.createObjectURL(new Blob([response.data]));
+			const link = document.createElement('a');
+			link.href = url;
+			link.setAttribute('download', 'gat_results.csv');
+			document.body.appendChild(link);
+			link.click();
+			link.remove();
+			window.URL.revokeObjectURL(url);
+		} catch (error) {
+			console.error(error);
+		}
+	};
 
+	// --- COMPUTED ---
+	// Итоги считает сервер по всей выборке (не по загруженным страницам)
 	const stats = useMemo(() => {
-		if (!results.length) return null;
-		const avg = results.reduce((acc, curr) => acc + curr.percentage, 0) / results.length;
-		const max = Math.max(...results.map(r => r.score));
-		return { avg: avg.toFixed(1), max, total: results.length };
-	}, [results]);
+		if (!totals || !totals.total) return null;
+		return {
+			avg: totals.avg !== null ? totals.avg.toFixed(1) : '—',
+			max: totals.max ?? '—',
+			total: totals.total
+		};
+	}, [totals]);
 
 	// --- HELPERS ---
 	const getSubjectScore = (details: Record<string, number>, subject: string) => {
@@ -361,14 +421,15 @@ const GlobalMonitoring: React.FC = () => {
 								<div className="p-3 text-slate-400"><Search size={20} /></div>
 								<input
 									type="text"
-									placeholder="Поиск ученика или школы..."
+									placeholder="Поиск ученика или школы (Enter)..."
 									value={searchTerm}
 									onChange={(e) => setSearchTerm(e.target.value)}
+									onKeyDown={(e) => { if (e.key === 'Enter') fetchResults(); }}
 									className="flex-1 bg-transparent border-none outline-none font-bold text-slate-700 placeholder:text-slate-400 placeholder:font-medium"
 								/>
 								{results.length > 0 && (
 									<div className="pr-4 text-xs font-bold text-slate-400">
-										{filteredResults.length} найдено
+										{totals?.total ?? results.length} найдено
 									</div>
 								)}
 							</div>
@@ -395,7 +456,7 @@ const GlobalMonitoring: React.FC = () => {
 											</tr>
 										</thead>
 										<tbody className="divide-y divide-slate-50">
-											{filteredResults.map((item, index) => (
+											{results.map((item, index) => (
 												<React.Fragment key={item.id}>
 													<tr
 														onClick={() => setExpandedId(expandedId === item.id ? null : item.id)}
@@ -504,6 +565,24 @@ const GlobalMonitoring: React.FC = () => {
 											))}
 										</tbody>
 									</table>
+									<div className="flex items-center justify-center gap-3 p-6 border-t border-slate-100">
+										{hasNext && (
+											<button
+												onClick={() => fetchResults(page + 1)}
+												disabled={loadingMore}
+												className="px-6 py-3 bg-slate-900 hover:bg-indigo-600 text-white rounded-xl font-bold text-sm transition-all flex items-center gap-2 disabled:opacity-70"
+											>
+												{loadingMore ? <RefreshCw className="animate-spin" size={16} /> : <ChevronDown size={16} />}
+												Загрузить еще
+											</button>
+										)}
+										<button
+											onClick={downloadCsv}
+											className="px-6 py-3 bg-slate-100 hover:bg-slate-200 text-slate-700 rounded-xl font-bold text-sm transition-all"
+										>
+											Скачать CSV
+										</button>
+									</div>
 								</div>
 							) : (
 								<div className="flex flex-col items-center justify-center h-[500px] text-center">
@@ -624,7 +703,7 @@ const GlobalMonitoring: React.FC = () => {
 										</div>
 
 										<button
-											onClick={fetchResults}
+											onClick={() => fetchResults()}
 											disabled={loading}
 											className="w-full py-4 bg-slate-900 hover:bg-indigo-600 text-white rounded-xl font-bold text-sm shadow-xl shadow-slate-900/10 active:scale-[0.98] transition-all flex items-center justify-center gap-2 disabled:opacity-70 mt-4"
 										>
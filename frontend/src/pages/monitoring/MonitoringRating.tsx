@@ -252,6 +252,7 @@ const MonitoringRating = () => {
 
 	// Пагинация и загрузка
 	const [page, setPage] = useState(1);
+	const [nextCursor, setNextCursor] = useState<string | null>(null);
 	const [hasMore, setHasMore] = useState(false);
 	const [isLoading, setIsLoading] = useState(false);
 	const [isInitialLoading, setIsInitialLoading] = useState(true);
@@ -278,6 +279,7 @@ const MonitoringRating = () => {
 			const data = await MonitoringService.getRating({
 				page: currentPage,
 				limit: 50,
+				cursor: isLoadMore ? nextCursor : null,
 				schoolIds: filters.schoolIds,
 				grades: filters.grades,
 				sections: filters.sections,
@@ -300,8 +302,10 @@ const MonitoringRating = () => {
 			if (data.meta && data.meta.pagination) {
 				setHasMore(data.meta.pagination.has_next);
 				setPage(data.meta.pagination.page);
+				setNextCursor(data.meta.pagination.next_cursor || null);
 			} else {
 				setHasMore(false);
+				setNextCursor(null);
 			}
 
 		} catch (e) {
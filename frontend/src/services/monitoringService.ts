@@ -49,6 +49,7 @@ export interface MonitoringMeta {
 		limit: number;
 		total: number;
 		has_next: boolean;
+		next_cursor?: string | null;
 	};
 }
 
@@ -78,6 +79,7 @@ export interface RatingResponse {
 export interface RatingFilters {
 	page?: number;
 	limit?: number;
+	cursor?: string | null; // Курсор следующей страницы (из meta.pagination.next_cursor)
 	schoolIds?: number[];
 	grades?: number[];
 	sections?: string[];
@@ -94,6 +96,7 @@ export const MonitoringService = {
 
 		if (filters.page) params.append('page', filters.page.toString());
 		if (filters.limit) params.append('limit', filters.limit.toString());
+		if (filters.cursor) params.append('cursor', filters.cursor);
 
 		if (filters.schoolIds?.length) params.append('schools', filters.schoolIds.join(','));
 		if (filters.grades?.length) params.append('grades', filters.grades.join(','));
@@ -18,6 +18,18 @@ export interface Student {
 	gender: 'male' | 'female';
 }
 
+// Фоновые задачи (Celery): опрос /tasks/<task_id>/ до SUCCESS или FAILURE
+const TASK_POLL_INTERVAL = 2000;
+
+const waitForTask = async (taskId: string) => {
+	while (true) {
+		const { data } = await $api.get(`/tasks/${taskId}/`);
+		if (data.state === 'SUCCESS') return data.result;
+		if (data.state === 'FAILURE') throw new Error(data.error || 'Task failed');
+		await new Promise(resolve => setTimeout(resolve, TASK_POLL_INTERVAL));
+	}
+};
+
 export const StudentService = {
 	getAll: async (params: any) => {
 		const response = await $api.get<Student[]>('/students/', { params });
@@ -49,9 +61,10 @@ export const StudentService = {
 		return response.data;
 	},
 
+	// Пароли генерируются в фоне: ждем задачу, чтобы не упираться в таймаут запроса
 	bulkGenerateCredentials: async (ids: number[]) => {
-		const response = await $api.post('/students/bulk-generate-credentials/', { ids });
-		return response.data;
+		const response = await $api.post('/students/bulk-generate-credentials/', { ids, async: true });
+		return waitForTask(response.data.task_id);
 	},
 
 	previewImport: async (formData: FormData) => {
@@ -76,9 +89,14 @@ export const StudentService = {
 		return response.data;
 	},
 
+	// PDF рисуется в фоне: запуск -> опрос задачи -> разовое скачивание по task_id
 	// 🔥 ВАЖНО: responseType: 'blob' для PDF (Иначе файл придет битым)
 	exportPdfCards: async (params: URLSearchParams) => {
-		const response = await $api.get(`/students/export-pdf-cards/?${params.toString()}`, {
+		params.set('async', '1');
+		const started = await $api.get(`/students/export-pdf-cards/?${params.toString()}`);
+		const taskId = started.data.task_id;
+		await waitForTask(taskId);
+		const response = await $api.get(`/students/export-pdf-cards/${taskId}/`, {
 			responseType: 'blob'
 		});
 		return response.data;